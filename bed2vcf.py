@@ -9,65 +9,672 @@ Calculate archaic match percent from provided bed file
 '''
 
 import argparse
-from typing import List
+from typing import List, Tuple
 from itertools import chain
-from bed_vcf_match.read_vcf import import_vcf, import_archaic_vcf
-from bed_vcf_match.analyze_bed import bed_structure
-import gzip
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from bed_vcf_match.read_vcf import (open_vcf,
+                                    iter_genotypes, iter_archaic_vcf)
+from bed_vcf_match.vcf_cache import vcf_cache
+from bed_vcf_match.vcf_index import merge_regions
+from bed_vcf_match.profiler import profiler
+from bed_vcf_match.checkpoint import (checkpoint, output_manifest,
+                                     file_sources, fingerprint)
+from bed_vcf_match.output_pool import output_pool
+from bed_vcf_match.query_server import (resident_db, query_server, query,
+                                        request, DEFAULT_PORT)
+from thin_vcf import read_indivs, read_sites, site_filter
+from bed_vcf_match.sweep import sweep_chromosome
+from bed_vcf_match.analyze_bed import (bed_structure, site_index,
+                                      archaic_sites, summarize_beds,
+                                      load_beds, read_regions,
+                                      bed_individual, matched_filename)
+import numpy as np
 import os
+import shutil
+import sys
+
+
+CHROMOSOMES = list(range(1, 23))
 
 
 def main():
+    if sys.argv[1:2] == ['merge']:
+        merge_shards(read_merge_args(sys.argv[2:]))
+        return
+    if sys.argv[1:2] == ['serve']:
+        serve_databases(read_serve_args(sys.argv[2:]))
+        return
+    if sys.argv[1:2] == ['query']:
+        query_databases(read_query_args(sys.argv[2:]))
+        return
+
     args = read_args()
+    profile = run_profiler(args)
+    labels = archaic_labels(args)
+    if len(labels) > 1:
+        print(f'archaic genomes: {", ".join(labels)}')
+
+    # shards write partial outputs for merge
+    sharded = args.chromosomes is not None or args.individuals is not None
+    chromosomes = shard_chromosomes(args)
+
+    # only run the bed files with outputs which are not up to date
+    if args.incremental:
+        if sharded:
+            raise ValueError('--incremental can not be used with '
+                             '--chromosomes or --individuals')
+        fingerprints = output_fingerprints(args)
+        manifests = output_manifests(args)
+        current = set(bed_file for bed_file in args.bed_files
+                      if manifests[output_directory(bed_file, args)].current(
+                          matched_filename(bed_file, args.output_dir),
+                          fingerprints[bed_file]))
+        args.bed_files = [bed_file for bed_file in args.bed_files
+                          if bed_file not in current]
+        print(f'found {len(current)} outputs up to date')
+        if not args.bed_files:
+            print('done!')
+            return
 
     # read in bed files, building output files and bed structure
-    beds = []
-    for bed_file in args.bed_files:
-        beds.append(bed_structure(bed_file, args.output_dir))
+    outputs = output_pool(max_open=args.max_open_files)
+    with profile.stage('read_beds') as counts:
+        beds = load_beds(shard_beds(args), args.output_dir, labels, outputs,
+                         threads=args.bed_threads)
+        counts['beds'] = len(beds)
+        counts['regions'] = sum(len(regions) for bed in beds
+                                for regions in bed.bed.values())
 
     indivs = list(set([bed.individual for bed in beds]))
     print(f'found {len(indivs)} individuals')
     print(f'found {len(beds)} bed files')
+    overlapping = sum(bed.overlapping for bed in beds)
+    if overlapping > 0:
+        print(f'found {overlapping} bed files with overlapping regions, '
+              'sites are counted in each region')
 
-    for chrm in range(1, 23):
-        print(f'starting chromosome {chrm}')
-        vcf = args.modern_vcfs[0].format(chr=chrm)
-        print(os.path.split(vcf)[1], flush=True)
-        if os.path.splitext(vcf)[1] == '.gz':
-            reader = gzip.open(vcf, 'rt')
-        else:
-            reader = open(vcf)
-        modern_db = import_vcf(reader,
-                               check_phasing=True,
-                               individuals=indivs)
-        reader.close()
-
-        vcf = args.archaic_vcfs[0].format(chr=chrm)
-        print(os.path.split(vcf)[1], flush=True)
-        if os.path.splitext(vcf)[1] == '.gz':
-            reader = gzip.open(vcf, 'rt')
-        else:
-            reader = open(vcf)
-
-        archaic_db = import_archaic_vcf(reader,
-                                        include_canc=args.canc_correction)
-        reader.close()
-
-        print('starting bed output...')
-        for bed in beds:
-            bed.process_chrom(chrm, modern_db, archaic_db)
-        print(f'finished chromosome {chrm}')
-
-    for bed in beds:
-        bed.close()
+    # thin the modern vcf as it is read
+    if args.individuals_file is not None:
+        with open(args.individuals_file) as indiv_file:
+            keep = set(read_indivs(indiv_file))
+        for indiv in indivs:
+            if indiv not in keep:
+                raise ValueError(f'{indiv} not in individuals file!')
+    sites = None
+    if args.sites_bed is not None and '{chr}' not in args.sites_bed:
+        with profile.stage('sites_bed'):
+            sites = site_filter(read_sites(args.sites_bed, args.sites_merge))
+
+    checkpoints = None
+    done = set()
+    if args.checkpoint_dir is not None:
+        checkpoints = checkpoint(args.checkpoint_dir, run_fingerprint(args))
+        done = {chrm for chrm in chromosomes
+                if checkpoints.done(chrm, chromosome_sources(args, chrm))}
+        if done:
+            print(f'resuming with {len(done)} completed chromosomes')
+
+    if args.workers > 1:
+        # schedule largest chromosomes first, checkpoint each as it
+        # finishes and write in chromosome order
+        order = sorted([chrm for chrm in chromosomes if chrm not in done],
+                       key=lambda c: -vcf_size(args.modern_vcfs[0], c))
+        finished = {}
+        unwritten = list(chromosomes)
+
+        def write_finished():
+            while unwritten and (unwritten[0] in done or
+                                 unwritten[0] in finished):
+                chrm = unwritten.pop(0)
+                if chrm in done:
+                    results = resume_chromosome(chrm, checkpoints, profile)
+                else:
+                    results = finished.pop(chrm)
+                with profile.stage('write', chrm):
+                    write_chromosome(beds, results, chrm, sharded)
+                print(f'finished chromosome {chrm}', flush=True)
+
+        with ProcessPoolExecutor(args.workers,
+                                 initializer=init_worker,
+                                 initargs=(args, beds, indivs, sites)) as pool:
+            futures = {pool.submit(worker_chromosome, chrm): chrm
+                       for chrm in order}
+            write_finished()
+            error = None
+            for future in as_completed(futures):
+                chrm = futures[future]
+                try:
+                    results, exported = future.result()
+                except Exception as exception:
+                    # checkpoint the other chromosomes before failing
+                    error = error or exception
+                    continue
+                profile.merge(exported)
+                save_chromosome(chrm, args, results, checkpoints, profile)
+                finished[chrm] = results
+                if error is None:
+                    write_finished()
+            if error is not None:
+                raise error
+
+    else:
+        for chrm in chromosomes:
+            if chrm in done:
+                results = resume_chromosome(chrm, checkpoints, profile)
+            else:
+                results = process_chromosome(chrm, args, beds, indivs,
+                                             sites, profile)
+                save_chromosome(chrm, args, results, checkpoints, profile)
+            with profile.stage('write', chrm):
+                write_chromosome(beds, results, chrm, sharded)
+            print(f'finished chromosome {chrm}')
+
+    with profile.stage('write'):
+        outputs.close()
+    if args.incremental:
+        record_outputs(args, fingerprints, manifests)
+
+    if args.profile is not None:
+        profile.report(args.profile)
+    if args.profile_stats is not None:
+        stage = profile.dump_stats(args.profile_stats)
+        print(f'profiled stage {stage}')
     print('done!')
 
 
+def process_chromosome(chrm: int,
+                       args: argparse.Namespace,
+                       beds: List[bed_structure],
+                       indivs: List[str],
+                       sites: site_filter = None,
+                       profile: profiler = None) -> List[str]:
+    '''
+    Load the vcfs of a single chromosome and summarize each bed file,
+    returning the output lines of each bed.  If sites is provided, only
+    those modern vcf sites are read.  Stages are recorded by profile.
+    '''
+    print(f'starting chromosome {chrm}')
+    if profile is None:
+        profile = profiler()
+    sites = chromosome_sites(chrm, args, sites, profile)
+    if args.stream:
+        with profile.stage('stream', chrm, beds=len(beds)):
+            return stream_chromosome(chrm, args, beds, indivs, sites)
+
+    regions = covered_regions(chrm, beds) if args.use_index else None
+    modern_db, archaic_dbs = load_chromosome(chrm, args, indivs, sites,
+                                             regions, profile)
+
+    print('starting bed output...', flush=True)
+    with profile.stage('summarize', chrm, beds=len(beds)) as counts:
+        counts['regions'] = sum(len(bed.regions(chrm)[0]) for bed in beds)
+        return summarize_beds(chrm, beds, modern_db, *archaic_dbs)
+
+
+def chromosome_sites(chrm: int,
+                     args: argparse.Namespace,
+                     sites: site_filter = None,
+                     profile: profiler = None) -> site_filter:
+    '''
+    sites of the modern vcf to read for a chromosome, from sites if provided
+    or from a sites bed of the chromosome.  None reads all sites.
+    '''
+    if sites is None and args.sites_bed is not None:
+        with (profile or profiler()).stage('sites_bed', chrm):
+            sites = site_filter(read_sites(args.sites_bed.format(chr=chrm),
+                                           args.sites_merge))
+    return sites
+
+
+def load_chromosome(chrm: int,
+                    args: argparse.Namespace,
+                    indivs: List[str] = None,
+                    sites: site_filter = None,
+                    regions: tuple = None,
+                    profile: profiler = None) -> Tuple[site_index,
+                                                       List[archaic_sites]]:
+    '''
+    Load the modern vcf of a single chromosome, sorted by position, and
+    join each archaic vcf to its sites.  Only the columns of indivs are
+    read, all if None, and only sites within regions if provided.
+    '''
+    if profile is None:
+        profile = profiler()
+    cache = vcf_cache(None if args.no_cache else cache_dir(args),
+                      rebuild=args.rebuild_cache,
+                      threads=args.decompress_threads)
+
+    vcf = args.modern_vcfs[0].format(chr=chrm)
+    print(os.path.split(vcf)[1], flush=True)
+    with profile.stage('modern_vcf', chrm) as counts:
+        modern_db = cache.load_genotypes(vcf,
+                                         check_phasing=True,
+                                         individuals=indivs,
+                                         regions=regions,
+                                         site_filter=sites)
+        counts['sites'] = len(modern_db)
+        if regions is not None:
+            counts['regions'] = len(regions[1])
+
+    # sort and join sites once for all bed files and archaic genomes
+    with profile.stage('site_index', chrm, sites=len(modern_db)):
+        modern_db = site_index(modern_db, chrm)
+    archaic_dbs = []
+    for template in args.archaic_vcfs:
+        vcf = template.format(chr=chrm)
+        print(os.path.split(vcf)[1], flush=True)
+        with profile.stage('archaic_vcf', chrm) as counts:
+            archaic = cache.load_archaic(vcf,
+                                         include_canc=args.canc_correction,
+                                         regions=regions)
+            counts['sites'] = len(archaic)
+        with profile.stage('join_archaic', chrm, sites=len(archaic)):
+            archaic_dbs.append(archaic_sites(modern_db, archaic))
+    return modern_db, archaic_dbs
+
+
+def covered_regions(chrm: int, beds: List[bed_structure]) -> tuple:
+    '''
+    Return the chromosome with the merged starts and ends of all bed regions
+    '''
+    regions = [bed.regions(chrm) for bed in beds]
+    starts, ends = merge_regions(
+        np.concatenate([starts for starts, _ in regions]),
+        np.concatenate([ends for _, ends in regions]))
+    return chrm, starts, ends
+
+
+def stream_chromosome(chrm: int,
+                      args: argparse.Namespace,
+                      beds: List[bed_structure],
+                      indivs: List[str],
+                      sites: site_filter = None) -> List[str]:
+    '''
+    Sweep the sorted vcfs of a single chromosome in chunks without loading
+    either into memory, returning the output lines of each bed
+    '''
+    vcfs = [template.format(chr=chrm)
+            for template in args.modern_vcfs[:1] + args.archaic_vcfs]
+    print(*[os.path.split(vcf)[1] for vcf in vcfs], flush=True)
+    with ExitStack() as stack:
+        readers = [stack.enter_context(
+            open_vcf(vcf, args.decompress_threads)) for vcf in vcfs]
+        return sweep_chromosome(
+            chrm,
+            beds,
+            iter_genotypes(readers[0],
+                           check_phasing=True,
+                           individuals=indivs,
+                           site_filter=sites),
+            *[iter_archaic_vcf(reader, include_canc=args.canc_correction)
+              for reader in readers[1:]])
+
+
+def write_chromosome(beds: List[bed_structure],
+                     results: List[str],
+                     chrm: int = None,
+                     sharded: bool = False):
+    '''
+    write the output lines of a chromosome to each bed file, or to a
+    partial output of the chromosome for each bed if sharded
+    '''
+    for bed, result in zip(beds, results):
+        if not sharded:
+            bed.write(result)
+            continue
+        part = part_filename(bed.outfile, chrm)
+        temp = f'{part}.{os.getpid()}.tmp'
+        with open(temp, 'w') as writer:
+            writer.write(bed.header)
+            writer.write(result)
+        os.replace(temp, part)
+
+
+def part_filename(outfile: str, chrm: int) -> str:
+    '''
+    partial output of a chromosome, written by a shard
+    '''
+    return f'{outfile}.chr{chrm}.part'
+
+
+def shard_chromosomes(args: argparse.Namespace) -> List[int]:
+    '''
+    sorted chromosomes of the shard, all autosomes by default
+    '''
+    if args.chromosomes is None:
+        return CHROMOSOMES
+    for chrm in args.chromosomes:
+        if chrm not in CHROMOSOMES:
+            raise ValueError(f'Unexpected chromosome {chrm}')
+    return sorted(set(args.chromosomes))
+
+
+def shard_beds(args: argparse.Namespace) -> List[str]:
+    '''
+    bed files of the individuals of the shard, all by default
+    '''
+    if args.individuals is None:
+        return args.bed_files
+    found = set(bed_individual(bed_file) for bed_file in args.bed_files)
+    for indiv in args.individuals:
+        if indiv not in found:
+            raise ValueError(f'{indiv} not in bed files!')
+    return [bed_file for bed_file in args.bed_files
+            if bed_individual(bed_file) in args.individuals]
+
+
+def merge_shards(args: argparse.Namespace):
+    '''
+    combine the partial outputs of every chromosome into the output of each
+    bed file, raising a value error if any shard is missing
+    '''
+    outfiles = [matched_filename(bed_file, args.output_dir)
+                for bed_file in args.bed_files]
+    missing = [part_filename(outfile, chrm)
+               for outfile in outfiles
+               for chrm in CHROMOSOMES
+               if not os.path.exists(part_filename(outfile, chrm))]
+    if missing:
+        raise ValueError(f'Missing {len(missing)} partial outputs: '
+                         f'{", ".join(missing[:5])}'
+                         f'{", ..." if len(missing) > 5 else ""}')
+
+    for outfile in outfiles:
+        temp = f'{outfile}.{os.getpid()}.tmp'
+        header = None
+        try:
+            with open(temp, 'w') as writer:
+                for chrm in CHROMOSOMES:
+                    part = part_filename(outfile, chrm)
+                    with open(part) as reader:
+                        part_header = reader.readline()
+                        if header is None:
+                            header = part_header
+                            writer.write(header)
+                        elif part_header != header:
+                            raise ValueError(f'{part} does not match the '
+                                             'header of chromosome 1')
+                        shutil.copyfileobj(reader, writer)
+        except BaseException:
+            os.remove(temp)
+            raise
+        os.replace(temp, outfile)
+
+    print(f'merged {len(outfiles)} bed files')
+
+
+def serve_databases(args: argparse.Namespace):
+    '''
+    load the vcfs of each chromosome of the shard once, then answer queries
+    until shutdown
+    '''
+    db = resident_db(archaic_labels(args))
+    sites = None
+    if args.sites_bed is not None and '{chr}' not in args.sites_bed:
+        sites = site_filter(read_sites(args.sites_bed, args.sites_merge))
+    for chrm in shard_chromosomes(args):
+        print(f'loading chromosome {chrm}')
+        db.add(*load_chromosome(chrm, args, args.individuals,
+                                chromosome_sites(chrm, args, sites)))
+
+    server = query_server(db, args.host, args.port, verbose=args.verbose)
+    host, port = server.server_address[:2]
+    print(f'serving {len(db.chromosomes)} chromosomes on {host}:{port}',
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def query_databases(args: argparse.Namespace):
+    '''
+    query a running server with the regions of each bed file, writing the
+    output of bed2vcf, or with a regions file for individuals and haplotypes
+    '''
+    address = f'{args.host}:{args.port}'
+    if args.shutdown:
+        request(address, '/shutdown', {})
+        return
+
+    status = request(address, '/status')
+    if args.bed_files:
+        beds = load_beds(args.bed_files, args.output_dir,
+                         status['archaic_labels'])
+        queries = [{'individual': bed.individual,
+                    'haplotype': bed.haplotype,
+                    'regions': [(chrm, int(start), int(end))
+                                for chrm in status['chromosomes']
+                                for start, end in zip(*bed.regions(chrm))]}
+                   for bed in beds]
+        _, results = query(address, queries)
+        for bed, result in zip(beds, results):
+            bed.write(result)
+            bed.close()
+        print(f'wrote {len(beds)} bed files')
+
+    if args.regions is not None:
+        with open(args.regions, 'rb') as reader:
+            regions = [(chrm, int(start), int(end))
+                       for chrm, bounds in read_regions(reader.read()).items()
+                       for start, end in bounds]
+        individuals = args.individuals or status['individuals']
+        pairs = [(indiv, haplotype)
+                 for indiv in individuals
+                 for haplotype in args.haplotypes]
+        header, results = query(address,
+                                [{'individual': indiv,
+                                  'haplotype': haplotype,
+                                  'regions': regions}
+                                 for indiv, haplotype in pairs])
+        with ExitStack() as stack:
+            writer = sys.stdout if args.output is None else \
+                stack.enter_context(open(args.output, 'w'))
+            writer.write(f'individual\thaplotype\t{header}')
+            for (indiv, haplotype), result in zip(pairs, results):
+                for line in result.splitlines(True):
+                    writer.write(f'{indiv}\t{haplotype}\t{line}')
+
+
+def save_chromosome(chrm: int,
+                    args: argparse.Namespace,
+                    results: List[str],
+                    checkpoints: checkpoint,
+                    profile: profiler):
+    '''
+    commit the output lines of a chromosome, if checkpointing
+    '''
+    if checkpoints is not None:
+        with profile.stage('checkpoint', chrm):
+            checkpoints.save(chrm, results, chromosome_sources(args, chrm))
+
+
+def resume_chromosome(chrm: int,
+                      checkpoints: checkpoint,
+                      profile: profiler) -> List[str]:
+    '''
+    load the committed output lines of a chromosome
+    '''
+    print(f'resuming chromosome {chrm}')
+    with profile.stage('resume', chrm):
+        return checkpoints.load(chrm)
+
+
+# arguments which change the output of a run
+OUTPUT_ARGS = ['modern_vcfs', 'archaic_vcfs', 'archaic_labels', 'bed_files',
+               'output_dir', 'canc_correction', 'sites_bed', 'sites_merge',
+               'individuals_file', 'individuals']
+
+
+# arguments which change the output of each bed file
+INPUT_ARGS = [arg for arg in OUTPUT_ARGS
+              if arg not in ('bed_files', 'output_dir', 'individuals')]
+
+
+def output_fingerprints(args: argparse.Namespace) -> dict:
+    '''
+    digest of the input arguments, the files of every chromosome and the
+    bed file of each output, keyed by bed file
+    '''
+    filenames = []
+    for filename in (args.individuals_file, args.sites_bed):
+        if filename is not None and '{chr}' not in filename:
+            filenames.append(filename)
+    inputs = fingerprint(
+        {'options': {arg: getattr(args, arg) for arg in INPUT_ARGS},
+         'chromosomes': [chromosome_sources(args, chrm)
+                         for chrm in CHROMOSOMES]},
+        filenames)
+    return {bed_file: fingerprint({'inputs': inputs}, [bed_file])
+            for bed_file in args.bed_files}
+
+
+def output_directory(bed_file: str, args: argparse.Namespace) -> str:
+    '''
+    directory of the output of the bed file
+    '''
+    return os.path.dirname(matched_filename(bed_file, args.output_dir))
+
+
+def output_manifests(args: argparse.Namespace) -> dict:
+    '''
+    output manifest of each output directory
+    '''
+    return {directory: output_manifest(directory)
+            for directory in set(output_directory(bed_file, args)
+                                 for bed_file in args.bed_files)}
+
+
+def record_outputs(args: argparse.Namespace,
+                   fingerprints: dict,
+                   manifests: dict):
+    '''
+    record the fingerprints of the outputs written by the run
+    '''
+    updated = set()
+    for bed_file in args.bed_files:
+        directory = output_directory(bed_file, args)
+        manifests[directory].record(
+            matched_filename(bed_file, args.output_dir),
+            fingerprints[bed_file])
+        updated.add(directory)
+    for directory in updated:
+        manifests[directory].save()
+
+
+def run_fingerprint(args: argparse.Namespace) -> str:
+    '''
+    digest of the output arguments and the files used by every chromosome
+    '''
+    filenames = list(args.bed_files)
+    for filename in (args.individuals_file, args.sites_bed):
+        if filename is not None and '{chr}' not in filename:
+            filenames.append(filename)
+    return fingerprint({arg: getattr(args, arg) for arg in OUTPUT_ARGS},
+                       filenames)
+
+
+def chromosome_sources(args: argparse.Namespace, chrm: int) -> list:
+    '''
+    path, size and modification time of the files read for a chromosome
+    '''
+    templates = args.modern_vcfs[:1] + args.archaic_vcfs
+    if args.sites_bed is not None and '{chr}' in args.sites_bed:
+        templates.append(args.sites_bed)
+    return file_sources([template.format(chr=chrm)
+                         for template in templates])
+
+
+# state shared with each worker process, set once by init_worker
+_worker_state = None
+
+
+def init_worker(args: argparse.Namespace,
+                beds: List[bed_structure],
+                indivs: List[str],
+                sites: site_filter = None):
+    global _worker_state
+    _worker_state = (args, beds, indivs, sites)
+
+
+def worker_chromosome(chrm: int) -> Tuple[List[str], tuple]:
+    '''
+    Process the chromosome, returning the output lines and the exported
+    profile of the worker
+    '''
+    profile = run_profiler(_worker_state[0])
+    return (process_chromosome(chrm, *_worker_state, profile),
+            profile.export())
+
+
+def run_profiler(args: argparse.Namespace) -> profiler:
+    '''
+    profiler enabled if a profile report or statistics are requested
+    '''
+    return profiler(args.profile is not None,
+                    cprofile=args.profile_stats is not None)
+
+
+def archaic_labels(args: argparse.Namespace) -> List[str]:
+    '''
+    labels of the archaic vcfs for output columns.  Unless provided, labels
+    are the first part of each filename which is not the chromosome.
+    '''
+    if args.archaic_labels is not None:
+        if len(args.archaic_labels) != len(args.archaic_vcfs):
+            raise ValueError('Expected one archaic label per archaic vcf')
+        return args.archaic_labels
+
+    labels = []
+    for i, template in enumerate(args.archaic_vcfs):
+        tokens = [t for t in os.path.basename(template).split('.')
+                  if '{chr}' not in t and t not in ('vcf', 'gz')]
+        labels.append(tokens[0] if tokens else f'archaic{i+1}')
+
+    if len(set(labels)) != len(labels):
+        labels = [f'archaic{i+1}' for i in range(len(labels))]
+    return labels
+
+
+def cache_dir(args: argparse.Namespace) -> str:
+    '''
+    directory of parsed vcf caches, defaulting to the output directory
+    '''
+    if args.cache_dir is not None:
+        return args.cache_dir
+    if args.output_dir is not None:
+        return os.path.join(args.output_dir, '.vcf_cache')
+    return '.vcf_cache'
+
+
+def vcf_size(template: str, chrm: int) -> int:
+    '''
+    size of the chromosome's vcf on disk, 0 if not found
+    '''
+    try:
+        return os.path.getsize(template.format(chr=chrm))
+    except OSError:
+        return 0
+
+
 def read_args(args: List[str] = None) -> argparse.Namespace:
     '''
     read in command line arguments, returning namespace object
     '''
-    parser = argparse.ArgumentParser(description='Match bed files with vcfs')
+    args = arg_parser().parse_args(args)
+    flatten_args(args, ['bed_files', 'modern_vcfs', 'archaic_vcfs'])
+    return args
+
+
+def arg_parser(**kwargs) -> argparse.ArgumentParser:
+    '''
+    parser of the arguments of a run, kwargs are passed to ArgumentParser
+    '''
+    kwargs.setdefault('description', 'Match bed files with vcfs')
+    parser = argparse.ArgumentParser(**kwargs)
 
     parser.add_argument('--modern_vcfs',
                         default=[],
@@ -85,6 +692,14 @@ def read_args(args: List[str] = None) -> argparse.Namespace:
                         help='List of archaic vcf files to add to database.'
                         'Archaic sites are merged with modern such that only '
                         'sites found in the existing database are retained.'
+                        ' Each archaic vcf adds a block of output columns.'
+                        )
+
+    parser.add_argument('--archaic_labels',
+                        default=None,
+                        nargs='*',
+                        help='Labels of the archaic vcfs used in column '
+                        'names when more than one archaic vcf is provided.'
                         )
 
     parser.add_argument('--bed_files',
@@ -119,16 +734,263 @@ def read_args(args: List[str] = None) -> argparse.Namespace:
                         'when calculating values.'
                         )
 
+    parser.add_argument('--sites_bed',
+                        default=None,
+                        help='If set, retain only the modern vcf sites within '
+                        'the bed regions, as thin_vcf --bed_file.  May be '
+                        'one bed per chromosome, as with --modern_vcfs.')
+
+    parser.add_argument('--sites_merge',
+                        default=None,
+                        type=int,
+                        help='If set to an integer, merge sites bed regions '
+                        'within <sites_merge> away from eachother, as '
+                        'thin_vcf --merge.')
+
+    parser.add_argument('--individuals_file',
+                        default=None,
+                        help='If set, raise an error for bed individuals '
+                        'missing from the file, as when reading a vcf thinned '
+                        'by thin_vcf --individuals_file.')
+
+    parser.add_argument('--cache_dir',
+                        default=None,
+                        help='Directory to cache parsed vcfs for later runs. '
+                        'Defaults to .vcf_cache in the output directory.'
+                        )
+
+    parser.add_argument('--no_cache',
+                        action='store_true',
+                        help='If set, vcfs are parsed without reading or '
+                        'writing the cache.'
+                        )
+
+    parser.add_argument('--rebuild_cache',
+                        action='store_true',
+                        help='If set, vcfs are parsed again and replace any '
+                        'existing cache.'
+                        )
+
+    parser.add_argument('--decompress_threads',
+                        default=1,
+                        type=int,
+                        help='Number of threads to inflate BGZF compressed '
+                        'vcfs.  Other gzip files use a single thread.'
+                        )
+
+    parser.add_argument('--use_index',
+                        action='store_true',
+                        help='Read only the vcf sites covered by the bed '
+                        'files, seeking with a tabix index or a sidecar '
+                        'index built beside bgzip compressed vcfs.')
+
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='If set, sweep the sorted vcfs in chunks '
+                        'instead of loading each chromosome into memory.'
+                        )
+
+    parser.add_argument('--workers',
+                        default=1,
+                        type=int,
+                        help='Number of processes to analyze chromosomes in '
+                        'parallel.  Each worker holds one chromosome of the '
+                        'vcfs in memory.'
+                        )
+
+    parser.add_argument('--bed_threads',
+                        default=1,
+                        type=int,
+                        help='Number of processes to read bed files.'
+                        )
+
+    parser.add_argument('--max_open_files',
+                        default=64,
+                        type=int,
+                        help='Maximum number of output files held open at '
+                        'once.  Output is buffered and written in blocks.'
+                        )
+
+    parser.add_argument('--chromosomes',
+                        default=None,
+                        type=int,
+                        nargs='*',
+                        help='If set, process only these chromosomes, writing '
+                        'partial outputs to combine with the merge command.'
+                        )
+
+    parser.add_argument('--individuals',
+                        default=None,
+                        nargs='*',
+                        help='If set, process only the bed files of these '
+                        'individuals, writing partial outputs to combine '
+                        'with the merge command.'
+                        )
+
+    parser.add_argument('--checkpoint_dir',
+                        default=None,
+                        help='If set, commit the output of each chromosome '
+                        'to this directory.  A restarted run with the same '
+                        'arguments and inputs skips completed chromosomes.'
+                        )
+
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='If set, skip bed files with outputs written '
+                        'by an earlier incremental run from the same bed '
+                        'file, vcfs and arguments.  Only the individuals of '
+                        'the remaining bed files are read.'
+                        )
+
+    parser.add_argument('--profile',
+                        default=None,
+                        help='If set, write the wall time, cpu time, peak '
+                        'memory and item counts of each stage and chromosome '
+                        'to this json file.'
+                        )
+
+    parser.add_argument('--profile_stats',
+                        default=None,
+                        help='If set, profile each stage with cProfile and '
+                        'write the statistics of the stage taking the most '
+                        'time to this file, for reading with pstats.'
+                        )
+
+    return parser
+
+
+def read_serve_args(args: List[str] = None) -> argparse.Namespace:
+    '''
+    read in command line arguments of the serve command, the vcf arguments
+    of a run with the address to serve on
+    '''
+    parser = arg_parser(
+        prog='bed2vcf.py serve',
+        description='Hold the vcfs in memory and answer region queries. '
+        'Bed and output arguments are ignored.')
+    add_address_args(parser)
+
+    parser.add_argument('--verbose',
+                        action='store_true',
+                        help='If set, log each request.'
+                        )
+
     args = parser.parse_args(args)
+    flatten_args(args, ['bed_files', 'modern_vcfs', 'archaic_vcfs'])
+    return args
+
 
-    # need to flatten the file args since they are lists of lists
-    # using multiple args and append
-    to_flatten = ['bed_files', 'modern_vcfs', 'archaic_vcfs']
+def read_query_args(args: List[str] = None) -> argparse.Namespace:
+    '''
+    read in command line arguments of the query command
+    '''
+    parser = argparse.ArgumentParser(
+        prog='bed2vcf.py query',
+        description='Query the vcfs held by bed2vcf.py serve')
+    add_address_args(parser)
+
+    parser.add_argument('--bed_files',
+                        default=None,
+                        action='append',
+                        nargs='*',
+                        help='List of bed files to query, writing the same '
+                        'output as a run.'
+                        )
+
+    parser.add_argument('--output_dir',
+                        default=None,
+                        help='The output directory of bed file queries, '
+                        'beside the bed files if not set.'
+                        )
+
+    parser.add_argument('--regions',
+                        default=None,
+                        help='Bed file of regions to query for each '
+                        'individual and haplotype.'
+                        )
+
+    parser.add_argument('--individuals',
+                        default=None,
+                        nargs='*',
+                        help='Individuals of the regions query, all '
+                        'individuals of the server if not set.'
+                        )
+
+    parser.add_argument('--haplotypes',
+                        default=[1, 2],
+                        type=int,
+                        choices=[1, 2],
+                        nargs='*',
+                        help='Haplotypes of the regions query.'
+                        )
+
+    parser.add_argument('--output',
+                        default=None,
+                        help='Output file of the regions query, standard '
+                        'output if not set.'
+                        )
+
+    parser.add_argument('--shutdown',
+                        action='store_true',
+                        help='If set, stop the server.'
+                        )
+
+    args = parser.parse_args(args)
+    flatten_args(args, ['bed_files'])
+    return args
+
+
+def add_address_args(parser: argparse.ArgumentParser):
+    '''
+    host and port of the query server
+    '''
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Address of the query server.'
+                        )
+
+    parser.add_argument('--port',
+                        default=DEFAULT_PORT,
+                        type=int,
+                        help='Port of the query server, 0 to serve on any '
+                        'free port.'
+                        )
+
+
+def read_merge_args(args: List[str] = None) -> argparse.Namespace:
+    '''
+    read in command line arguments of the merge command
+    '''
+    parser = argparse.ArgumentParser(
+        prog='bed2vcf.py merge',
+        description='Combine the partial outputs of sharded runs')
+
+    parser.add_argument('--bed_files',
+                        default=None,
+                        action='append',
+                        nargs='*',
+                        help='List of bed files of the sharded runs.'
+                        )
+
+    parser.add_argument('--output_dir',
+                        default=None,
+                        help='The output directory of the sharded runs.'
+                        )
+
+    args = parser.parse_args(args)
+    flatten_args(args, ['bed_files'])
+    return args
+
+
+def flatten_args(args: argparse.Namespace, to_flatten: List[str]):
+    '''
+    need to flatten the file args since they are lists of lists
+    using multiple args and append
+    '''
     for flatten in to_flatten:
         arg = getattr(args, flatten)
         if arg is not None:
             setattr(args, flatten, list(chain.from_iterable(arg)))
-    return args
 
 
 if __name__ == '__main__':
@@ -8,49 +8,252 @@ Module for performing analyses with bedfiles
 import pandas as pd
 import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import TextIO, List, Dict, Tuple
+from bed_vcf_match.read_vcf import genotype_database
+from bed_vcf_match.output_pool import output_pool
 
 
 CHROMOSOME = 0
 START = 1
 END = 2
+EMPTY_REGIONS = np.empty((0, 2), dtype=np.int64)
 
 
 class bed_structure():
-    def __init__(self, filename, out_dir=None):
-        with open(filename, 'r') as reader:
-            self.bed = structure_bed(reader)
+    def __init__(self, filename, out_dir=None, archaic_labels=None,
+                 pool: output_pool = None):
+        # regions of each chromosome in file order
+        with open(filename, 'rb') as reader:
+            try:
+                self.bed = read_regions(reader.read())
+            except ValueError as error:
+                raise ValueError(f'{filename}: {error}') from error
+        self.sorted, self.overlapping = check_regions(self.bed)
 
         # split filename into path and file
         self.filename = filename
         t = os.path.split(filename)
 
         # pull out individual, haplotype
+        self.individual = bed_individual(filename)
         tokens = t[1].split('.')
-        self.individual = tokens[0]
         self.haplotype = int(tokens[2][-1])
 
-        # setup output file
-        if out_dir is None:
-            out_dir = t[0]
-        outfile = os.path.join(out_dir, t[1] + ".matched")
-        self.writer = open(outfile, 'w')
-        self.writer.write(summarize_region_header())
-
-    def process_chrom(self, chromosome: int, modern_db, archaic_db):
-        chrm = str(chromosome)
-        if chrm not in self.bed:
-            return
-        for start, end in self.bed[chrm]:
-            self.writer.write(summarize_region(
-                [chromosome, start, end],
-                self.haplotype,
-                self.individual,
-                modern_db,
-                archaic_db))
+        # output file, created by the first write through the pool
+        self.outfile = matched_filename(filename, out_dir)
+        self.header = summarize_region_header(archaic_labels)
+        self.pool = pool
+        self.written = False
+
+    def process_chrom(self, chromosome: int, modern_db, *archaic_dbs):
+        self.write(self.summarize_chrom(chromosome,
+                                        modern_db,
+                                        *archaic_dbs))
+
+    def write(self, lines: str):
+        '''
+        Buffer output lines, preceded by the header on the first write
+        '''
+        if self.pool is None:
+            self.pool = output_pool(max_open=1)
+        if not self.written:
+            lines = self.header + lines
+            self.written = True
+        self.pool.write(self.outfile, lines)
+
+    def summarize_chrom(self, chromosome: int, modern_db, *archaic_dbs) -> str:
+        '''
+        Summarize all regions of the chromosome at once, returning the
+        formatted output lines
+        '''
+        return summarize_beds(chromosome, [self], modern_db, *archaic_dbs)[0]
+
+    def regions(self, chromosome: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the start and end positions of the chromosome's regions
+        '''
+        regions = self.bed.get(str(chromosome), EMPTY_REGIONS)
+        return regions[:, 0], regions[:, 1]
+
+    def sorted_regions(self, chromosome: int) -> Tuple[np.ndarray, ...]:
+        '''
+        Return the start and end positions of the chromosome's regions sorted
+        by start, and the file order of each sorted region
+        '''
+        starts, ends = self.regions(chromosome)
+        if self.sorted:
+            return starts, ends, np.arange(len(starts))
+        order = np.argsort(starts, kind='mergesort')
+        return starts[order], ends[order], order
 
     def close(self):
-        self.writer.close()
+        if self.pool is not None:
+            self.pool.close(self.outfile)
+
+    def __getstate__(self):
+        # the output pool remains with the main process
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+
+class site_index():
+    '''
+    Modern database restricted to a single chromosome and sorted by position.
+    Sorting is performed once so each region is resolved with a binary search
+    into a contiguous slice of sites.  modern_vcf may be a genotype_database
+    or a dataframe from import_vcf, which is decoded once.
+    '''
+    def __init__(self, modern_vcf: genotype_database, chromosome: int):
+        if isinstance(modern_vcf, pd.DataFrame):
+            modern_vcf = genotype_database.from_dataframe(modern_vcf)
+        self.chromosome = chromosome
+        rows = np.flatnonzero(modern_vcf.chrom == chromosome)
+        # mergesort is stable, retaining file order for duplicate positions
+        order = np.argsort(modern_vcf.pos[rows], kind='mergesort')
+        self.sites = modern_vcf.take(rows[order])
+        self.positions = self.sites.pos
+
+    def __len__(self):
+        return len(self.positions)
+
+    def bounds(self, start: int, end: int) -> slice:
+        '''
+        Return the slice of sorted sites with start < position <= end
+        '''
+        lower, upper = np.searchsorted(self.positions, [start, end],
+                                       side='right')
+        return slice(lower, upper)
+
+    def query(self, start: int, end: int) -> genotype_database:
+        '''
+        Return the sites with start < position <= end
+        '''
+        return self.sites.take(self.bounds(start, end))
+
+
+class archaic_sites():
+    '''
+    Archaic vcf joined once to the sorted sites of a site_index.  Holds the
+    joined variants and matching archaic alleles of each modern row, by the
+    allele of the haplotype, and a flag for modern sites found in the
+    archaic vcf, so regions of any bed file only index into the arrays.
+    '''
+    def __init__(self, modern_vcf: site_index, archaic_vcf: pd.DataFrame):
+        self.chromosome = modern_vcf.chromosome
+        self.variants, self.matches, self.matched = join_sites(
+            modern_vcf.sites.keys(), archaic_vcf)
+
+    def __len__(self):
+        return len(self.matched)
+
+
+class individual_sites():
+    '''
+    Per-site indicators of a single individual, shared by the bed files of
+    both haplotypes.  Cumulative sums are computed once, on first use, so
+    each region is the difference of the sums at its boundaries.
+    genotypes: alleles of the individual with shape (sites, 2), -1 for
+    missing
+    archaics: joined variants and matching archaic alleles of join_sites,
+    aligned to genotypes, for each archaic vcf
+    '''
+    def __init__(self,
+                 genotypes: np.ndarray,
+                 archaics: List[Tuple[np.ndarray, np.ndarray]]):
+        self.genotypes = genotypes
+        self.present = genotypes[:, 0] >= 0
+        self.archaics = []
+        for variants, matches in archaics:
+            present = self.present[:, None]
+            self.archaics.append((variants * present, matches * present))
+        self.totals = {}
+
+    @classmethod
+    def from_index(cls,
+                   modern_vcf: site_index,
+                   individual: str,
+                   archaic_vcfs: List[pd.DataFrame],
+                   span: slice = slice(None)) -> 'individual_sites':
+        '''
+        Build the sites of the individual from the span of sites of the
+        site_index.  archaic_vcfs may be dataframes or archaic_sites.
+        '''
+        archaics = []
+        for archaic_vcf in archaic_vcfs:
+            if not isinstance(archaic_vcf, archaic_sites):
+                archaic_vcf = archaic_sites(modern_vcf, archaic_vcf)
+            elif archaic_vcf.chromosome != modern_vcf.chromosome:
+                raise ValueError('Archaic sites of chromosome '
+                                 f'{archaic_vcf.chromosome} do not match '
+                                 f'chromosome {modern_vcf.chromosome}')
+            archaics.append((archaic_vcf.variants[span],
+                             archaic_vcf.matches[span]))
+
+        sites = modern_vcf.sites
+        return cls(sites.genotypes[span, sites.columns[individual], :],
+                   archaics)
+
+    def total(self, name: str, values) -> np.ndarray:
+        '''
+        Return the cumulative sum of values, with a leading 0, cached by name
+        '''
+        if name not in self.totals:
+            if callable(values):
+                values = values()
+            self.totals[name] = np.concatenate(
+                ([0], np.cumsum(values, dtype=np.int64)))
+        return self.totals[name]
+
+    def columns(self,
+                haplotype: int,
+                lower: np.ndarray,
+                upper: np.ndarray) -> List[np.ndarray]:
+        '''
+        Sum the indicators of summarize_regions over sites in [lower, upper)
+        for each region, returning the columns expected by format_regions
+        '''
+        variant = self.genotypes[:, haplotype - 1] == 1
+        names = [('sites', lambda: self.present),
+                 (f'variant{haplotype}', lambda: variant)]
+        for i, (variants, matches) in enumerate(self.archaics):
+            # derived allele of the haplotype after polarizing with CAnc
+            def derived(variants=variants):
+                return np.where(variant, variants[:, 1], variants[:, 0])
+
+            def matched(matches=matches):
+                return np.where(variant, matches[:, 1], matches[:, 0])
+
+            names += [(f'derived{haplotype}_{i}', derived),
+                      (f'archaic_{i}', lambda matches=matches:
+                       matches.sum(axis=1)),
+                      (f'match{haplotype}_{i}', matched)]
+
+        columns = []
+        for name, values in names:
+            totals = self.total(name, values)
+            columns.append(totals[upper] - totals[lower])
+        return columns
+
+
+def bed_individual(filename: str) -> str:
+    '''
+    Return the individual of the bed file, the first part of its name
+    '''
+    return os.path.basename(filename).split('.')[0]
+
+
+def matched_filename(filename: str, out_dir: str = None) -> str:
+    '''
+    Return the output file of the bed file, in out_dir if provided or
+    beside the bed file
+    '''
+    path, name = os.path.split(filename)
+    if out_dir is None:
+        out_dir = path
+    return os.path.join(out_dir, name + '.matched')
 
 
 def structure_bed(reader: TextIO) -> Dict[str, List[Tuple[int, int]]]:
@@ -58,14 +261,99 @@ def structure_bed(reader: TextIO) -> Dict[str, List[Tuple[int, int]]]:
     read in the bed file, returning a dictionary keyed by chromosome
     with a list of (start, end) tuples
     '''
-    result = {}
-    for line in reader:
-        chrom, start, end = line.split()
-        if chrom not in result:
-            result[chrom] = []
-        result[chrom].append((int(start), int(end)))
+    return {chrom: list(map(tuple, regions.tolist()))
+            for chrom, regions in read_regions(reader.read().encode()).items()}
 
-    return result
+
+def read_regions(data: bytes) -> Dict[str, np.ndarray]:
+    '''
+    Parse the bed lines of data, returning a dictionary keyed by chromosome,
+    in order of appearance, of (regions, 2) arrays of start and end in file
+    order.  Fields are separated by whitespace and every line which is not
+    blank must have three fields.
+    '''
+    # count the fields of each line from where whitespace ends
+    chars = np.frombuffer(data, dtype=np.uint8)
+    space = chars <= ord(' ')
+    begins = np.flatnonzero(~space & np.concatenate(([True], space[:-1])))
+    fields = np.bincount(np.searchsorted(np.flatnonzero(chars == ord('\n')),
+                                         begins))
+    invalid = (fields != 0) & (fields != 3)
+    if invalid.any():
+        raise ValueError('Expected 3 fields on line '
+                         f'{np.flatnonzero(invalid)[0] + 1}')
+
+    tokens = data.split()
+    count = len(tokens) // 3
+    if count == 0:
+        return {}
+
+    regions = np.empty((count, 2), dtype=np.int64)
+    for i in range(2):
+        values = b' '.join(tokens[i + 1::3])
+        if not values.replace(b' ', b'').isdigit():
+            raise ValueError('Unable to parse bed positions')
+        regions[:, i] = np.fromstring(values, dtype=np.int64, sep=' ')
+
+    # number chromosomes in order of appearance
+    chroms = tokens[0::3]
+    names = {name: i for i, name in enumerate(dict.fromkeys(chroms))}
+    inverse = np.fromiter(map(names.__getitem__, chroms),
+                          dtype=np.int64,
+                          count=count)
+    if (inverse[1:] < inverse[:-1]).any():
+        regions = regions[np.argsort(inverse, kind='mergesort')]
+    groups = np.split(regions, np.cumsum(np.bincount(inverse))[:-1])
+    return {name.decode(): group for name, group in zip(names, groups)}
+
+
+def check_regions(bed: Dict[str, np.ndarray]) -> Tuple[bool, bool]:
+    '''
+    Return whether the (start, end) regions of every chromosome are sorted
+    by start, and whether any regions of a chromosome overlap and would
+    need merging.  As regions cover start < pos <= end, adjacent regions do
+    not overlap.  Positions must not be negative.
+    '''
+    if not bed:
+        return True, False
+    regions = np.concatenate(list(bed.values()))
+    groups = np.repeat(np.arange(len(bed)),
+                       [len(regions) for regions in bed.values()])
+    starts, ends = regions[:, 0], regions[:, 1]
+    same = groups[1:] == groups[:-1]
+    ordered = not (same & (starts[1:] < starts[:-1])).any()
+    if not ordered:
+        order = np.lexsort((starts, groups))
+        starts, ends = starts[order], ends[order]
+
+    # offset each chromosome past the last so one running max suffices
+    offsets = groups * (regions.max(initial=0) + 1)
+    reach = np.maximum.accumulate(ends + offsets)
+    overlapping = (same & (starts[1:] + offsets[1:] < reach[:-1])).any()
+    return ordered, bool(overlapping)
+
+
+def load_beds(filenames: List[str],
+              out_dir: str = None,
+              archaic_labels: List[str] = None,
+              pool: output_pool = None,
+              threads: int = 1) -> List[bed_structure]:
+    '''
+    Build the bed_structure of each file, reading files concurrently with
+    threads processes
+    '''
+    load = partial(bed_structure, out_dir=out_dir,
+                   archaic_labels=archaic_labels)
+    if threads <= 1:
+        beds = [load(filename) for filename in filenames]
+    else:
+        with ProcessPoolExecutor(threads) as executor:
+            beds = list(executor.map(
+                load, filenames,
+                chunksize=max(1, len(filenames) // (4 * threads))))
+    for bed in beds:
+        bed.pool = pool
+    return beds
 
 
 def read_bed(reader: TextIO) -> pd.io.parsers.TextFileReader:
@@ -82,9 +370,22 @@ def read_bed(reader: TextIO) -> pd.io.parsers.TextFileReader:
                        chunksize=1)
 
 
-def summarize_region_header() -> str:
-    return ('chrom\tstart\tend\ttotal_sites\tmodern_variants\t'
-            'joined_modern_variants\tarchaic_variants\tmatch_variants\n')
+def summarize_region_header(archaic_labels: List[str] = None) -> str:
+    '''
+    Header of summarize_region output.  With more than one archaic vcf, each
+    block of archaic columns is suffixed with the archaic label.
+    '''
+    archaic_columns = ['joined_modern_variants',
+                       'archaic_variants',
+                       'match_variants']
+    if archaic_labels is None or len(archaic_labels) <= 1:
+        columns = archaic_columns
+    else:
+        columns = [f'{column}_{label}'
+                   for label in archaic_labels
+                   for column in archaic_columns]
+    return '\t'.join(['chrom', 'start', 'end', 'total_sites',
+                      'modern_variants'] + columns) + '\n'
 
 
 def summarize_region(bed_line: List[int],
@@ -100,6 +401,15 @@ def summarize_region(bed_line: List[int],
     number of modern and archaic variants, number of matches and fraction
     of sites matching for each archaic vcf provided.
     '''
+    if isinstance(modern_vcf, site_index):
+        return summarize_regions(bed_line[CHROMOSOME],
+                                 bed_line[START:START+1],
+                                 bed_line[END:END+1],
+                                 haplotype,
+                                 individual,
+                                 modern_vcf,
+                                 *archaic_vcfs)
+
     rows = filter_modern_db(modern_vcf,
                             bed_line[CHROMOSOME],
                             bed_line[START],
@@ -123,6 +433,114 @@ def summarize_region(bed_line: List[int],
     return line + '\n'
 
 
+def summarize_beds(chromosome: int,
+                   beds: List[bed_structure],
+                   modern_vcf: site_index,
+                   *archaic_vcfs: pd.DataFrame) -> List[str]:
+    '''
+    Summarize the regions of the chromosome for each bed, as
+    bed_structure.summarize_chrom.  Beds are grouped by individual so the
+    sites of each individual are decoded and summed once for both haplotypes.
+    '''
+    if not isinstance(modern_vcf, site_index) or \
+            modern_vcf.chromosome != chromosome:
+        modern_vcf = site_index(modern_vcf, chromosome)
+    archaic_vcfs = [archaic_vcf if isinstance(archaic_vcf, archaic_sites)
+                    else archaic_sites(modern_vcf, archaic_vcf)
+                    for archaic_vcf in archaic_vcfs]
+
+    groups = {}
+    for i, bed in enumerate(beds):
+        if str(chromosome) in bed.bed:
+            groups.setdefault(bed.individual, []).append(i)
+
+    results = [''] * len(beds)
+    for individual, group in groups.items():
+        sites = individual_sites.from_index(modern_vcf,
+                                            individual,
+                                            archaic_vcfs)
+        for i in group:
+            starts, ends = beds[i].regions(chromosome)
+            lower = np.searchsorted(modern_vcf.positions, starts,
+                                    side='right')
+            upper = np.maximum(
+                np.searchsorted(modern_vcf.positions, ends, side='right'),
+                lower)
+            results[i] = format_regions(
+                chromosome, starts, ends,
+                sites.columns(beds[i].haplotype, lower, upper))
+    return results
+
+
+def summarize_regions(chromosome: int,
+                      starts: np.ndarray,
+                      ends: np.ndarray,
+                      haplotype: int,
+                      individual: str,
+                      modern_vcf: pd.DataFrame,
+                      *archaic_vcfs: pd.DataFrame) -> str:
+    '''
+    Batch version of summarize_region for all regions of a chromosome.
+    Per-site indicators are accumulated once and each region is the
+    difference of the cumulative sums at its boundaries.  Output is identical
+    to joining summarize_region for each start, end pair.
+    archaic_vcfs may be dataframes or archaic_sites prejoined to modern_vcf.
+    '''
+    if isinstance(modern_vcf, site_index):
+        if modern_vcf.chromosome != chromosome:
+            modern_vcf = site_index(modern_vcf.sites, chromosome)
+    else:
+        modern_vcf = site_index(modern_vcf, chromosome)
+
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    lower = np.searchsorted(modern_vcf.positions, starts, side='right')
+    upper = np.maximum(
+        np.searchsorted(modern_vcf.positions, ends, side='right'),
+        lower)
+
+    # only accumulate over the sites covered by any region
+    span = slice(0, 0)
+    if len(starts) > 0:
+        span = slice(lower.min(), upper.max())
+        lower -= span.start
+        upper -= span.start
+
+    sites = individual_sites.from_index(modern_vcf,
+                                        individual,
+                                        archaic_vcfs,
+                                        span)
+    return format_regions(chromosome, starts, ends,
+                          sites.columns(haplotype, lower, upper))
+
+
+def format_regions(chromosome: int,
+                   starts: np.ndarray,
+                   ends: np.ndarray,
+                   columns: List[np.ndarray]) -> str:
+    '''
+    Format the region sums into summarize_region output lines.  The first two
+    columns are the number of sites and variants, followed by triplets of
+    joined variants, archaic alleles and matching alleles for each archaic
+    vcf.  Allele counts are halved as in summarize_region.
+    All lines are formatted by one template from integer columns, halved
+    counts as their quotient and remainder, so counts must not be negative.
+    '''
+    fields = [np.asarray(starts), np.asarray(ends)]
+    formats = ['%d', '%d']
+    for i, column in enumerate(columns):
+        column = np.asarray(column, dtype=np.int64)
+        if i >= 2 and (i - 2) % 3 != 0:
+            fields += [column // 2, column % 2 * 5]
+            formats.append('%d.%d')
+        else:
+            fields.append(column)
+            formats.append('%d')
+    template = f'{chromosome}\t' + '\t'.join(formats) + '\n'
+    return ''.join(map(template.__mod__,
+                       zip(*[field.tolist() for field in fields])))
+
+
 def filter_modern_db(modern_vcf: pd.DataFrame,
                      chrom: int,
                      start: int,
@@ -131,8 +549,18 @@ def filter_modern_db(modern_vcf: pd.DataFrame,
                      individual: str) -> pd.DataFrame:
     '''
     Get matching rows in modern database. Find start < position <= end
+    modern_vcf may be a dataframe or a site_index of a single chromosome
     '''
 
+    if isinstance(modern_vcf, site_index):
+        if modern_vcf.chromosome == chrom:
+            sites = modern_vcf.query(start, end)
+        else:
+            sites = modern_vcf.sites.take(slice(0, 0))
+        result = sites.keys()
+        result['variant'] = sites.haplotype(individual, haplotype)
+        return result.loc[result.variant >= 0]
+
     result = modern_vcf.loc[
         (modern_vcf['chrom'] == chrom) &
         (modern_vcf['pos'] > start) &
@@ -171,3 +599,52 @@ def join_vcf(modern: pd.DataFrame, archaic: pd.DataFrame) -> pd.DataFrame:
         joined.loc[match_neither, ['archaic', 'variant']] = 0
         joined = joined.drop(columns='CAnc')
     return joined.astype({'archaic': int})
+
+
+def join_sites(modern: pd.DataFrame,
+               archaic: pd.DataFrame) -> Tuple[np.ndarray,
+                                               np.ndarray,
+                                               np.ndarray]:
+    '''
+    Align the archaic vcf to the rows of the modern dataframe as join_vcf,
+    returning the joined variants and the matching archaic alleles of each
+    row, with shape (rows, 2) indexed by the allele of the haplotype, and
+    whether the site is in the archaic vcf.  Summed over the columns of a
+    haplotype, they give the joined_modern_variants and match_variants of
+    summarize_region; summed over both alleles, matches gives the archaic
+    alleles.  As in join_vcf, a site matching several archaic rows is
+    counted once for each, and without CAnc an unmatched site is joined
+    with no archaic alleles.
+    '''
+    keys = ['chrom', 'pos', 'ref', 'alt']
+    rows = len(modern)
+    left = pd.DataFrame({key: np.asarray(modern[key]) for key in keys})
+    left['row'] = np.arange(rows)
+    joined = pd.merge(left, archaic, how='inner', on=keys)
+    row = joined['row'].values
+    count = joined['variant'].values.astype(np.int64)
+    matched = np.bincount(row, minlength=rows) > 0
+
+    # polarity is 1 to keep the site as is, -1 when the CAnc matches the
+    # alternative allele and 0 to drop the site
+    if 'CAnc' in joined.columns:
+        canc = joined['CAnc'].values
+        polarity = np.zeros(len(joined), dtype=np.int8)
+        polarity[canc == joined['ref'].values] = 1
+        polarity[canc == joined['alt'].values] = -1
+    else:
+        polarity = np.ones(len(joined), dtype=np.int8)
+
+    def total(weights):
+        return np.bincount(row, weights=weights,
+                           minlength=rows).astype(np.int16)
+
+    forward = polarity == 1
+    reverse = polarity == -1
+    # the derived allele is the alternative unless flipped by CAnc
+    variants = np.stack((total(reverse), total(forward)), axis=1)
+    matches = np.stack((total((2 - count) * reverse),
+                        total(count * forward)), axis=1)
+    if 'CAnc' not in archaic.columns:
+        variants[~matched, 1] = 1
+    return variants, matches, matched
@@ -0,0 +1,224 @@
+'''
+bgzf
+
+Reader for BGZF compressed files, the blocked gzip format of bgzip and
+tabix.  Each block is an independent gzip member of at most 64 KiB, so
+blocks are inflated in parallel by a thread pool while the decompressed
+stream keeps the original order.
+'''
+
+
+import io
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator, Tuple
+
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+FEXTRA = 4
+
+
+def is_bgzf(filename: str) -> bool:
+    '''
+    True if the file starts with a gzip header carrying the BGZF block size
+    '''
+    with open(filename, 'rb') as reader:
+        header = reader.read(18)
+    return (len(header) == 18 and
+            header[:3] == GZIP_MAGIC and
+            header[3] & FEXTRA != 0 and
+            header[12:14] == b'BC' and
+            struct.unpack('<H', header[14:16])[0] == 2)
+
+
+def read_block(reader: BinaryIO) -> Tuple[bytes, int]:
+    '''
+    Read the next raw BGZF block, returning the deflated data and the
+    expected size after inflating.  Returns None at the end of the file.
+    '''
+    header = reader.read(12)
+    if len(header) == 0:
+        return None
+    if len(header) < 12 or header[:3] != GZIP_MAGIC or \
+            header[3] & FEXTRA == 0:
+        raise ValueError('Invalid BGZF block header')
+    extra_length = struct.unpack('<H', header[10:12])[0]
+    extra = reader.read(extra_length)
+
+    # find the BC subfield holding the block size - 1
+    block_size = None
+    i = 0
+    while i + 4 <= len(extra):
+        length = struct.unpack('<H', extra[i+2:i+4])[0]
+        if extra[i:i+2] == b'BC':
+            block_size = struct.unpack('<H', extra[i+4:i+6])[0] + 1
+        i += 4 + length
+    if block_size is None:
+        raise ValueError('BGZF block is missing its block size')
+
+    remaining = reader.read(block_size - 12 - extra_length)
+    if len(remaining) != block_size - 12 - extra_length:
+        raise ValueError('Truncated BGZF block')
+    data = remaining[:-8]
+    size = struct.unpack('<I', remaining[-4:])[0]
+    return data, size
+
+
+def inflate(block: Tuple[bytes, int]) -> bytes:
+    data, size = block
+    result = zlib.decompress(data, -15)
+    if len(result) != size:
+        raise ValueError('BGZF block size does not match its contents')
+    return result
+
+
+def iter_blocks(reader: BinaryIO, threads: int = 1) -> Iterator[bytes]:
+    '''
+    Yield the inflated blocks of the open file in order.  With more than
+    one thread, up to 4 blocks per thread are inflated ahead of the reader.
+    '''
+    for _, data in iter_offset_blocks(reader, threads):
+        yield data
+
+
+def iter_offset_blocks(reader: BinaryIO,
+                       threads: int = 1) -> Iterator[Tuple[int, bytes]]:
+    '''
+    Yield the file offset and inflated data of each block, starting from the
+    current position of the open file
+    '''
+    if threads <= 1:
+        offset = reader.tell()
+        block = read_block(reader)
+        while block is not None:
+            yield offset, inflate(block)
+            offset = reader.tell()
+            block = read_block(reader)
+        return
+
+    with ThreadPoolExecutor(threads) as pool:
+        pending = deque()
+        offset = reader.tell()
+        block = read_block(reader)
+        while block is not None or pending:
+            while block is not None and len(pending) < 4 * threads:
+                pending.append((offset, pool.submit(inflate, block)))
+                offset = reader.tell()
+                block = read_block(reader)
+            block_offset, data = pending.popleft()
+            yield block_offset, data.result()
+
+
+def iter_lines(reader: BinaryIO,
+               offset: int = 0,
+               threads: int = 1) -> Iterator[Tuple[int, bytes]]:
+    '''
+    Yield the virtual offset and contents of each line, starting from the
+    virtual offset.  A virtual offset holds the file offset of a block in the
+    upper 48 bits and the offset within the inflated block in the lower 16.
+    '''
+    reader.seek(offset >> 16)
+    skip = offset & 0xffff
+    line_offset = None
+    partial = b''
+    for block_offset, data in iter_offset_blocks(reader, threads):
+        start = skip
+        skip = 0
+        while start < len(data):
+            if line_offset is None:
+                line_offset = (block_offset << 16) | start
+            end = data.find(b'\n', start)
+            if end == -1:
+                partial += data[start:]
+                break
+            yield line_offset, partial + data[start:end+1]
+            line_offset = None
+            partial = b''
+            start = end + 1
+
+    if partial:
+        yield line_offset, partial
+
+
+class chunk_reader(io.RawIOBase):
+    '''
+    Raw binary stream over an iterator of byte strings
+    '''
+    def __init__(self, chunks: Iterator[bytes]):
+        self.blocks = chunks
+        self.buffer = b''
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.offset >= len(self.buffer):
+            try:
+                self.buffer = next(self.blocks)
+            except StopIteration:
+                return 0
+            self.offset = 0
+
+        count = min(len(buffer), len(self.buffer) - self.offset)
+        buffer[:count] = self.buffer[self.offset:self.offset+count]
+        self.offset += count
+        return count
+
+    def close(self):
+        if not self.closed and hasattr(self.blocks, 'close'):
+            self.blocks.close()
+        super().close()
+
+
+class bgzf_reader(chunk_reader):
+    '''
+    Raw binary stream of the decompressed contents of a BGZF file
+    '''
+    def __init__(self, filename: str, threads: int = 1):
+        self.file = open(filename, 'rb')
+        super().__init__(iter_blocks(self.file, threads))
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+def open_bgzf(filename: str, threads: int = 1) -> io.TextIOWrapper:
+    '''
+    Open the BGZF file for reading as text, inflating with threads
+    '''
+    return io.TextIOWrapper(io.BufferedReader(bgzf_reader(filename, threads),
+                                              buffer_size=1 << 20))
+
+
+# uncompressed bytes per block, as used by bgzip
+BLOCK_DATA_SIZE = 65280
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000'
+                          '000000')
+
+
+def compress_block(data: bytes) -> bytes:
+    '''
+    Compress data, at most 64 KiB, into a single BGZF block
+    '''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = (GZIP_MAGIC + bytes([FEXTRA]) + b'\x00\x00\x00\x00\x00\xff' +
+              struct.pack('<H', 6) + b'BC' + struct.pack('<H', 2) +
+              struct.pack('<H', len(deflated) + 25))
+    return header + deflated + struct.pack('<II',
+                                           zlib.crc32(data) & 0xffffffff,
+                                           len(data))
+
+
+def write_bgzf(filename: str, data: bytes):
+    '''
+    Write data to filename as BGZF blocks, ending with the empty EOF block
+    '''
+    with open(filename, 'wb') as writer:
+        for start in range(0, len(data), BLOCK_DATA_SIZE):
+            writer.write(compress_block(data[start:start+BLOCK_DATA_SIZE]))
+        writer.write(EOF_BLOCK)
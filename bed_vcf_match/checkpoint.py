@@ -0,0 +1,141 @@
+'''
+checkpoint
+
+Output lines of finished chromosomes, committed to a directory so an
+interrupted run can resume.  A manifest records the fingerprint of the run
+and the source files of each chromosome.  Entries are ignored when either
+changes.  Output manifests similarly record the inputs of each output file
+so incremental runs skip outputs which are up to date.
+'''
+
+
+import hashlib
+import json
+import os
+from typing import List
+
+
+MANIFEST = 'manifest.json'
+OUTPUT_MANIFEST = '.matched_manifest.json'
+
+
+class checkpoint():
+    '''
+    Chromosome results of the run identified by fingerprint, stored in
+    directory.  A manifest of another run is discarded.
+    '''
+    def __init__(self, directory: str, fingerprint: str):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        os.makedirs(directory, exist_ok=True)
+
+        self.chromosomes = {}
+        manifest = os.path.join(directory, MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest) as reader:
+                contents = json.load(reader)
+            if contents.get('fingerprint') == fingerprint:
+                self.chromosomes = contents['chromosomes']
+
+    def done(self, chromosome: int, sources: list) -> bool:
+        '''
+        True if the chromosome was committed from the same sources
+        '''
+        entry = self.chromosomes.get(str(chromosome))
+        return entry is not None and entry['sources'] == sources and \
+            os.path.exists(self.part(chromosome))
+
+    def load(self, chromosome: int) -> List[str]:
+        '''
+        Return the committed output lines of each bed
+        '''
+        with open(self.part(chromosome)) as reader:
+            return json.load(reader)
+
+    def save(self, chromosome: int, results: List[str], sources: list):
+        '''
+        Commit the output lines of each bed for the chromosome, then record
+        it in the manifest
+        '''
+        write_atomic(self.part(chromosome), results)
+        self.chromosomes[str(chromosome)] = {'sources': sources}
+        write_atomic(os.path.join(self.directory, MANIFEST),
+                     {'fingerprint': self.fingerprint,
+                      'chromosomes': self.chromosomes})
+
+    def part(self, chromosome: int) -> str:
+        return os.path.join(self.directory, f'chr{chromosome}.json')
+
+
+class output_manifest():
+    '''
+    Fingerprint of the inputs of each output file in directory, with the
+    size and modification time of the output when recorded.  An output is
+    current while both are unchanged.
+    '''
+    def __init__(self, directory: str):
+        self.filename = os.path.join(directory, OUTPUT_MANIFEST)
+        self.outputs = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as reader:
+                self.outputs = json.load(reader)
+
+    def current(self, outfile: str, fingerprint: str) -> bool:
+        '''
+        True if the output was recorded from the same inputs and is unchanged
+        '''
+        entry = self.outputs.get(os.path.basename(outfile))
+        return entry is not None and \
+            entry['fingerprint'] == fingerprint and \
+            entry['output'] == file_sources([outfile])[0]
+
+    def record(self, outfile: str, fingerprint: str):
+        '''
+        Record the fingerprint of a finished output, stored on save
+        '''
+        self.outputs[os.path.basename(outfile)] = {
+            'fingerprint': fingerprint,
+            'output': file_sources([outfile])[0]}
+
+    def save(self):
+        write_atomic(self.filename, self.outputs)
+
+
+def write_atomic(filename: str, contents):
+    '''
+    Write contents as json to a temporary file, replacing filename once it
+    is on disk
+    '''
+    temp = f'{filename}.{os.getpid()}.tmp'
+    with open(temp, 'w') as writer:
+        json.dump(contents, writer)
+        writer.flush()
+        os.fsync(writer.fileno())
+    os.replace(temp, filename)
+
+
+def file_sources(filenames: List[str]) -> list:
+    '''
+    Return the absolute path, size and modification time of each file,
+    with None for missing files
+    '''
+    sources = []
+    for filename in filenames:
+        try:
+            status = os.stat(filename)
+            sources.append([os.path.abspath(filename),
+                            status.st_size,
+                            status.st_mtime_ns])
+        except OSError:
+            sources.append([os.path.abspath(filename), None, None])
+    return sources
+
+
+def fingerprint(options: dict, filenames: List[str]) -> str:
+    '''
+    Return a digest of the options and the sources of the files
+    '''
+    key = json.dumps({'options': options,
+                      'sources': file_sources(filenames)},
+                     sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
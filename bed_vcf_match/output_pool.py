@@ -0,0 +1,86 @@
+'''
+output_pool
+
+Buffered writing of many text outputs through a bounded number of open
+files.  Text is collected per file and written in large blocks, so each
+chromosome of thousands of bed files costs a few large writes and never
+more than max_open file descriptors.
+'''
+
+
+from collections import OrderedDict
+from typing import TextIO
+
+
+class output_pool():
+    '''
+    Text outputs keyed by filename.  Each file is created on its first
+    flush and appended to afterwards.  Text of a file is written once
+    buffer_size characters are pending, and every file is flushed once
+    max_buffered characters are pending overall.  At most max_open handles
+    are kept, closing the least recently used first.
+    '''
+    def __init__(self,
+                 max_open: int = 64,
+                 buffer_size: int = 1 << 20,
+                 max_buffered: int = 1 << 26):
+        if max_open < 1:
+            raise ValueError('At least one open file is required')
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        self.max_buffered = max_buffered
+        self.buffers = {}
+        self.sizes = {}
+        self.buffered = 0
+        self.created = set()
+        self.handles = OrderedDict()
+
+    def write(self, filename: str, text: str):
+        '''
+        Buffer text to append to filename
+        '''
+        self.buffers.setdefault(filename, []).append(text)
+        self.sizes[filename] = self.sizes.get(filename, 0) + len(text)
+        self.buffered += len(text)
+        if self.sizes[filename] >= self.buffer_size:
+            self.flush(filename)
+        elif self.buffered >= self.max_buffered:
+            self.flush()
+
+    def flush(self, filename: str = None):
+        '''
+        Write the buffered text of filename, or of every file if None
+        '''
+        filenames = list(self.buffers) if filename is None else [filename]
+        for filename in filenames:
+            if filename not in self.buffers:
+                continue
+            text = ''.join(self.buffers.pop(filename))
+            self.buffered -= self.sizes.pop(filename)
+            self.handle(filename).write(text)
+
+    def handle(self, filename: str) -> TextIO:
+        '''
+        Return an open handle of filename, truncating it the first time
+        '''
+        if filename in self.handles:
+            self.handles.move_to_end(filename)
+            return self.handles[filename]
+
+        if len(self.handles) >= self.max_open:
+            _, handle = self.handles.popitem(last=False)
+            handle.close()
+        mode = 'a' if filename in self.created else 'w'
+        self.created.add(filename)
+        self.handles[filename] = open(filename, mode)
+        return self.handles[filename]
+
+    def close(self, filename: str = None):
+        '''
+        Flush and close filename, or every file if None
+        '''
+        self.flush(filename)
+        filenames = list(self.handles) if filename is None else [filename]
+        for filename in filenames:
+            if filename in self.handles:
+                self.handles.pop(filename).close()
@@ -0,0 +1,210 @@
+'''
+profiler
+
+Wall time, cpu time, peak memory and item counts of each stage of a run,
+reported as json.  The peak memory of a stage is measured by resetting the
+peak resident set size of the process as the stage starts, supported on
+linux.  Stages may also be profiled with cProfile, keeping the
+statistics of the stage taking the most wall time.
+'''
+
+
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+
+class profiler():
+    '''
+    Record each stage run within profiler.stage.  If not enabled, stages are
+    not measured.  With cprofile, each stage is also profiled by name.
+    Records of other processes are added with merge.
+    Each record holds the peak memory of the stage, peak_rss_mb, or None
+    where the peak cannot be reset, and the peak of the process so far,
+    process_peak_rss_mb.
+    '''
+    def __init__(self, enabled: bool = False, cprofile: bool = False):
+        self.enabled = enabled or cprofile
+        self.cprofile = cprofile
+        self.records = []
+        self.profiles = {}
+        self.stats = {}
+        self.process_peak = 0.0
+
+    @contextmanager
+    def stage(self,
+              name: str,
+              chromosome: int = None,
+              **counts) -> Iterator[Dict[str, int]]:
+        '''
+        Measure the body of the with statement as the named stage, yielding
+        a dict of item counts to fill in.  Stages may not be nested.
+        '''
+        counts = dict(counts)
+        if not self.enabled:
+            yield counts
+            return
+
+        profile = None
+        if self.cprofile:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        # resetting also resets the process peak, so keep it first
+        self.process_peak = max(self.process_peak, peak_rss())
+        reset = reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield counts
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            if profile is not None:
+                profile.disable()
+            peak = peak_rss()
+            self.process_peak = max(self.process_peak, peak)
+            self.records.append({'stage': name,
+                                 'chromosome': chromosome,
+                                 'pid': os.getpid(),
+                                 'wall_seconds': wall,
+                                 'cpu_seconds': cpu,
+                                 'peak_rss_mb': peak if reset else None,
+                                 'process_peak_rss_mb': self.process_peak,
+                                 'counts': counts})
+
+    def export(self) -> Tuple[List[dict], Dict[str, list]]:
+        '''
+        Return the records and raw cProfile statistics to merge into the
+        profiler of another process
+        '''
+        stats = {name: list(raw) for name, raw in self.stats.items()}
+        for name, profile in self.profiles.items():
+            profile.create_stats()
+            stats.setdefault(name, []).append(profile.stats)
+        return self.records, stats
+
+    def merge(self, exported: Tuple[List[dict], Dict[str, list]]):
+        '''
+        Add the exported records and statistics of another profiler
+        '''
+        records, stats = exported
+        self.records.extend(records)
+        for name, raw in stats.items():
+            self.stats.setdefault(name, []).extend(raw)
+
+    def peak_rss(self) -> float:
+        '''
+        Return the peak resident set size of this process in MiB
+        '''
+        return max(self.process_peak, peak_rss())
+
+    def peak_child_rss(self) -> float:
+        '''
+        Return the largest peak resident set size of the other processes
+        in MiB, from their merged records and finished children
+        '''
+        pid = os.getpid()
+        return max([peak_rss(resource.RUSAGE_CHILDREN)] +
+                   [record['process_peak_rss_mb'] for record in self.records
+                    if record['pid'] != pid])
+
+    def totals(self) -> Dict[str, dict]:
+        '''
+        Return the summed times and counts of each stage, with the largest
+        peak memory of the stage
+        '''
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'],
+                                      {'runs': 0,
+                                       'wall_seconds': 0,
+                                       'cpu_seconds': 0,
+                                       'peak_rss_mb': None,
+                                       'counts': {}})
+            total['runs'] += 1
+            total['wall_seconds'] += record['wall_seconds']
+            total['cpu_seconds'] += record['cpu_seconds']
+            if record['peak_rss_mb'] is not None:
+                total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0,
+                                           record['peak_rss_mb'])
+            for key, count in record['counts'].items():
+                total['counts'][key] = total['counts'].get(key, 0) + count
+        return totals
+
+    def hottest(self) -> str:
+        '''
+        Return the name of the stage with the most wall time, or None
+        '''
+        totals = self.totals()
+        if not totals:
+            return None
+        return max(totals, key=lambda name: totals[name]['wall_seconds'])
+
+    def report(self, filename: str):
+        '''
+        Write the records and totals of each stage as json
+        '''
+        with open(filename, 'w') as writer:
+            json.dump({'command': sys.argv,
+                       'peak_rss_mb': self.peak_rss(),
+                       'peak_child_rss_mb': self.peak_child_rss(),
+                       'hottest': self.hottest(),
+                       'totals': self.totals(),
+                       'stages': self.records},
+                      writer,
+                      indent=2)
+
+    def dump_stats(self, filename: str) -> str:
+        '''
+        Write the cProfile statistics of the hottest stage, readable by
+        pstats, returning the name of the stage
+        '''
+        name = self.hottest()
+        raw = list(self.stats.get(name, []))
+        if name in self.profiles:
+            self.profiles[name].create_stats()
+            raw.append(self.profiles[name].stats)
+        if not raw:
+            return None
+        stats = pstats.Stats(*[raw_stats(r) for r in raw])
+        stats.dump_stats(filename)
+        return name
+
+
+class raw_stats():
+    '''
+    Statistics of a finished profile, as loaded by pstats
+    '''
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def reset_peak_rss() -> bool:
+    '''
+    Reset the peak resident set size of this process to its current size,
+    returning False where not supported
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as writer:
+            writer.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss(who: int = resource.RUSAGE_SELF) -> float:
+    '''
+    Return the peak resident set size in MiB, since the last reset on linux
+    '''
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':  # reported in bytes
+        return rss / (1 << 20)
+    return rss / 1024
@@ -0,0 +1,227 @@
+'''
+query_server
+
+Modern and archaic vcfs held in memory by a long running process, answering
+summarize_region queries over localhost http.  The sites of each chromosome
+are sorted and joined once when loaded, so a query only searches the
+positions of its regions.
+
+GET /status returns the loaded chromosomes, individuals and archaic labels.
+POST /query takes a json object of queries,
+    {"queries": [{"individual": "UV1",
+                  "haplotype": 1,
+                  "regions": [[1, 100, 200], ...]}, ...]}
+and returns the output header with the lines of each query,
+    {"header": "chrom\\tstart...", "results": ["1\\t100\\t200...", ...]}
+POST /shutdown stops the server.  Invalid queries return status 400 with an
+error message.
+'''
+
+
+import json
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from bed_vcf_match.analyze_bed import (site_index, archaic_sites,
+                                      summarize_regions,
+                                      summarize_region_header)
+
+
+DEFAULT_PORT = 8765
+
+
+class resident_db():
+    '''
+    Sorted modern sites and joined archaic sites of each loaded chromosome.
+    Queries only read the databases, so may run concurrently.
+    '''
+    def __init__(self, archaic_labels: List[str] = None):
+        self.archaic_labels = list(archaic_labels or [])
+        self.header = summarize_region_header(self.archaic_labels)
+        self.chromosomes = {}
+
+    def add(self, modern_vcf: site_index, archaic_vcfs: List[archaic_sites]):
+        '''
+        Hold the databases of the chromosome of modern_vcf
+        '''
+        self.chromosomes[chromosome_key(modern_vcf.chromosome)] = \
+            (modern_vcf, archaic_vcfs)
+
+    def individuals(self) -> List[str]:
+        '''
+        Individuals found in every loaded chromosome
+        '''
+        found = None
+        for modern_vcf, _ in self.chromosomes.values():
+            columns = modern_vcf.sites.individuals
+            found = columns if found is None else \
+                [indiv for indiv in found if indiv in columns]
+        return found or []
+
+    def status(self) -> dict:
+        return {'chromosomes': list(self.chromosomes),
+                'individuals': self.individuals(),
+                'archaic_labels': self.archaic_labels,
+                'header': self.header}
+
+    def query(self, request: dict) -> List[str]:
+        '''
+        Return the output lines of each query of the request, raising a
+        value error for malformed queries
+        '''
+        if not isinstance(request, dict) or \
+                not isinstance(request.get('queries'), list):
+            raise ValueError('Expected an object with a list of queries')
+        results = []
+        for query in request['queries']:
+            if not isinstance(query, dict):
+                raise ValueError('Expected each query to be an object')
+            results.append(self.summarize(query.get('individual'),
+                                          query.get('haplotype'),
+                                          query.get('regions', [])))
+        return results
+
+    def summarize(self,
+                  individual: str,
+                  haplotype: int,
+                  regions: List[Tuple[int, int, int]]) -> str:
+        '''
+        Return the summarize_region lines of the haplotype of the individual
+        for each (chromosome, start, end) region, in order.  Raises a value
+        error for unknown individuals or chromosomes which are not loaded.
+        '''
+        if haplotype not in (1, 2):
+            raise ValueError(f'Unexpected haplotype {haplotype}')
+        groups = {}
+        for row, region in enumerate(regions):
+            if not isinstance(region, (list, tuple)) or len(region) != 3:
+                raise ValueError(f'Expected chromosome, start and end, '
+                                 f'found {region}')
+            groups.setdefault(chromosome_key(region[0]), []).append(row)
+
+        lines = [None] * len(regions)
+        for chromosome, rows in groups.items():
+            if chromosome not in self.chromosomes:
+                raise ValueError(f'Chromosome {chromosome} is not loaded')
+            modern_vcf, archaic_vcfs = self.chromosomes[chromosome]
+            if individual not in modern_vcf.sites.columns:
+                raise ValueError(f'{individual} not in modern vcf of '
+                                 f'chromosome {chromosome}')
+            try:
+                bounds = np.array([regions[row][1:] for row in rows],
+                                  dtype=np.int64)
+            except (TypeError, ValueError):
+                raise ValueError('Unable to parse region positions')
+            result = summarize_regions(modern_vcf.chromosome,
+                                       bounds[:, 0],
+                                       bounds[:, 1],
+                                       haplotype,
+                                       individual,
+                                       modern_vcf,
+                                       *archaic_vcfs)
+            for row, line in zip(rows, result.splitlines(True)):
+                lines[row] = line
+        return ''.join(lines)
+
+
+class query_handler(BaseHTTPRequestHandler):
+    '''
+    Json requests to the resident_db of the server
+    '''
+    def do_GET(self):
+        if self.path == '/status':
+            self.reply(200, self.server.db.status())
+        else:
+            self.reply(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.path == '/shutdown':
+            self.reply(200, {})
+            # shutdown waits for serve_forever, so call from another thread
+            threading.Thread(target=self.server.shutdown).start()
+        elif self.path == '/query':
+            try:
+                results = self.server.db.query(json.loads(body))
+            except ValueError as error:
+                self.reply(400, {'error': str(error)})
+                return
+            self.reply(200, {'header': self.server.db.header,
+                             'results': results})
+        else:
+            self.reply(404, {'error': f'Unknown path {self.path}'})
+
+    def reply(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class query_server(ThreadingHTTPServer):
+    '''
+    Http server of the resident_db, bound to localhost by default.  Use
+    port 0 to pick a free port, given by server_address.
+    '''
+    daemon_threads = True
+
+    def __init__(self,
+                 db: resident_db,
+                 host: str = '127.0.0.1',
+                 port: int = DEFAULT_PORT,
+                 verbose: bool = False):
+        super().__init__((host, port), query_handler)
+        self.db = db
+        self.verbose = verbose
+
+
+def chromosome_key(chromosome) -> object:
+    '''
+    Chromosomes are ints when numeric, as in the vcf databases
+    '''
+    if isinstance(chromosome, (int, np.integer)):
+        return int(chromosome)
+    chromosome = str(chromosome)
+    return int(chromosome) if chromosome.isdigit() else chromosome
+
+
+def request(address: str, path: str, body: dict = None,
+            timeout: float = None) -> dict:
+    '''
+    Send body as json to the server at address, host:port, returning the
+    decoded reply.  GET is used without a body.  Errors reported by the
+    server raise a value error.
+    '''
+    data = None if body is None else json.dumps(body).encode()
+    message = urllib.request.Request(
+        f'http://{address}{path}',
+        data=data,
+        headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(message, timeout=timeout) as reply:
+            return json.load(reply)
+    except urllib.error.HTTPError as error:
+        try:
+            reason = json.load(error)['error']
+        except (ValueError, KeyError):
+            reason = str(error)
+        raise ValueError(reason) from error
+
+
+def query(address: str, queries: List[dict],
+          timeout: float = None) -> Tuple[str, List[str]]:
+    '''
+    Return the output header and lines of each query sent to the server
+    '''
+    reply = request(address, '/query', {'queries': queries}, timeout)
+    return reply['header'], reply['results']
@@ -6,14 +6,121 @@ Read a vcf file into pandas data frame
 
 
 import pandas as pd
-from typing import TextIO, List
+from typing import Callable, TextIO, List, Iterator, Tuple
 import numpy as np
+import gzip
+import os
+import re
+from bed_vcf_match.bgzf import is_bgzf, open_bgzf
+
+
+# genotype codes used while decoding, indexes into HAPLOTYPE_ALLELES
+GENOTYPE_CODES = {'0|0': 0, '0|1': 1, '1|0': 2, '1|1': 3, './.': 4,
+                  '0/0': 5, '0/1': 5, '1/0': 5, '1/1': 5}
+MISSING_CODE = 4
+UNPHASED_CODE = 5
+# alleles of haplotype 1 and 2 for each code, -1 is a missing genotype
+HAPLOTYPE_ALLELES = np.array([[0, 0], [0, 1], [1, 0], [1, 1],
+                              [0, 0], [-1, -1]], dtype=np.int8)
+# genotype strings of import_vcf for each code
+GENOTYPE_STRINGS = np.array(['0|0', '0|1', '1|0', '1|1', 0, np.nan],
+                            dtype=object)
+# bytes of lines parsed at once, the field offsets take twice as many
+PARSE_BYTES = 1 << 22
+# bytes of lines read from a vcf at once, the text is held twice while read
+CHUNK_BYTES = 1 << 22
+
+
+class genotype_database():
+    '''
+    Modern vcf with genotypes decoded once into a compact integer array.
+    genotypes has shape (sites, individuals, 2) holding the allele of each
+    haplotype, ./. is stored as 0|0 and unphased or absent genotypes as -1.
+    '''
+    def __init__(self,
+                 chrom: np.ndarray,
+                 pos: np.ndarray,
+                 ref: np.ndarray,
+                 alt: np.ndarray,
+                 individuals: List[str],
+                 genotypes: np.ndarray):
+        self.chrom = chrom
+        self.pos = pos
+        self.ref = ref
+        self.alt = alt
+        self.individuals = list(individuals)
+        self.columns = {indiv: i for i, indiv in enumerate(self.individuals)}
+        self.genotypes = genotypes
+
+    def __len__(self):
+        return len(self.pos)
+
+    def take(self, rows) -> 'genotype_database':
+        '''
+        Return a new database with the selected rows, rows may be a slice
+        or an array of indices
+        '''
+        return genotype_database(self.chrom[rows],
+                                 self.pos[rows],
+                                 self.ref[rows],
+                                 self.alt[rows],
+                                 self.individuals,
+                                 self.genotypes[rows])
+
+    def haplotype(self, individual: str, haplotype: int) -> np.ndarray:
+        '''
+        Return the alleles of the individual's haplotype (1 or 2)
+        '''
+        return self.genotypes[:, self.columns[individual], haplotype - 1]
+
+    def keys(self) -> pd.DataFrame:
+        '''
+        Return the chrom, pos, ref and alt columns as a dataframe
+        '''
+        return pd.DataFrame({'chrom': self.chrom,
+                             'pos': self.pos,
+                             'ref': self.ref,
+                             'alt': self.alt})
+
+    @classmethod
+    def from_dataframe(cls, frame: pd.DataFrame) -> 'genotype_database':
+        '''
+        Decode a modern dataframe from import_vcf
+        '''
+        keys = ['chrom', 'pos', 'ref', 'alt']
+        indivs = [c for c in frame.columns if c not in keys]
+        codes = dict(GENOTYPE_CODES)
+        codes[0] = MISSING_CODE  # import_vcf stores ./. as 0
+        genotypes = np.full((len(frame), len(indivs), 2), -1, dtype=np.int8)
+        for i, indiv in enumerate(indivs):
+            genotypes[:, i, :] = HAPLOTYPE_ALLELES[
+                frame[indiv].map(codes).fillna(UNPHASED_CODE)
+                .values.astype(np.int64)]
+        return cls(frame['chrom'].values,
+                   frame['pos'].values.astype(np.int64),
+                   frame['ref'].values,
+                   frame['alt'].values,
+                   indivs,
+                   genotypes)
+
+
+def open_vcf(vcf: str, threads: int = 1) -> TextIO:
+    '''
+    open the vcf for reading as text, decompressing gzipped files.
+    BGZF files are inflated in parallel with threads.
+    '''
+    if os.path.splitext(vcf)[1] == '.gz':
+        if threads > 1 and is_bgzf(vcf):
+            return open_bgzf(vcf, threads)
+        return gzip.open(vcf, 'rt')
+    return open(vcf)
 
 
 def import_vcf(vcf_reader: TextIO,
                dataframe: pd.DataFrame = None,
                check_phasing: bool = False,
-               individuals: List[str] = None) -> pd.DataFrame:
+               individuals: List[str] = None,
+               chunk_bytes: int = CHUNK_BYTES) -> pd.DataFrame:
     '''
     Read in all lines of the provided, open vcf file and concatenate with
     provided pandas dataframe
@@ -24,6 +131,7 @@ def import_vcf(vcf_reader: TextIO,
     genotypes.
     individuals: if specified, limit the imported data to only the provided
     individuals.  Individuals not found in the file raise value errors
+    Lines are parsed about chunk_bytes at a time.
     '''
     header_lines = 1  # 1-based indexing on error reporting
     for line in vcf_reader:
@@ -43,33 +151,37 @@ def import_vcf(vcf_reader: TextIO,
         indivs = [indiv for indiv in set(individuals)]
 
     header = [h.lower() for h in header[:9]] + header[9:]
-    usecols = [header[i] for i in [0, 1, 3, 4]] + indivs
-
-    # precompute this as a dictionary for hopefully faster operations
-    phase_decoder = {}
-    for i in range(2):
-        for j in range(2):
-            phase_decoder[f'{i}|{j}'] = f'{i}|{j}'
-            phase_decoder[f'{i}/{j}'] = np.nan
-    phase_decoder['./.'] = 0
-
-    new_frame = pd.read_csv(vcf_reader,
-                            delimiter='\t',
-                            header=None,
-                            names=header,
-                            usecols=usecols)
-
-    new_frame = new_frame.loc[(new_frame.ref.str.len() == 1)
-                              & (new_frame.alt.str.len() == 1)]
-
-    new_frame[indivs] = new_frame[indivs].applymap(phase_decoder.get)
-
-    if check_phasing:
-        if new_frame.isna().any(axis=None):
-            nanrow = new_frame[new_frame.isna().any(axis=1)].iloc[0]
-            nanind = nanrow.loc[nanrow.isna()].index[0]
-            raise ValueError('Unexpected unphased haplotype for '
-                             f'{nanind} on position {nanrow.pos}')
+    columns = [i for i, h in enumerate(header) if i >= 9 and h in indivs]
+    indivs = [header[i] for i in columns]
+
+    chunks = []
+    offset = 0
+    for data in read_lines(vcf_reader, chunk_bytes):
+        rows, *sites = parse_sites(data, len(header), columns)
+        if check_phasing:
+            check_phased(sites[-1], indivs, sites[1])
+        chunks.append((rows + offset, *sites))
+        offset += data.count(b'\n') + (not data.endswith(b'\n'))
+        del data  # before reading the next chunk
+    if not chunks:
+        chunks.append(parse_sites(b'', len(header), columns))
+
+    # chromosomes are strings unless every chunk is numeric
+    chroms = [chunk[1] for chunk in chunks]
+    if any(chrom.dtype == object for chrom in chroms):
+        chroms = [chrom.astype(str).astype(object) for chrom in chroms]
+    chrom = np.concatenate(chroms)
+    rows, _, pos, ref, alt, codes = [
+        np.concatenate([chunk[i] for chunk in chunks]) for i in range(6)]
+
+    new_frame = pd.DataFrame({header[0]: chrom,
+                              header[1]: pos,
+                              header[3]: ref,
+                              header[4]: alt},
+                             index=rows)
+    for i, indiv in enumerate(indivs):
+        new_frame[indiv] = GENOTYPE_STRINGS[codes[:, i]]
+    new_frame = new_frame.infer_objects()
 
     if dataframe is not None:
         return pd.concat([dataframe, new_frame], sort=False)
@@ -80,6 +192,290 @@ def import_vcf(vcf_reader: TextIO,
     return new_frame
 
 
+def import_genotypes(vcf_reader: TextIO,
+                     check_phasing: bool = False,
+                     individuals: List[str] = None,
+                     chunk_bytes: int = CHUNK_BYTES,
+                     site_filter: Callable = None) -> genotype_database:
+    '''
+    Read in all lines of the provided, open vcf file into a
+    genotype_database.  Only biallelic SNPs are retained.
+    check_phasing: if true, raises value error for any unphased haplotype
+    that is not ./.  If false, unphased haplotypes are stored as missing.
+    individuals: if specified, limit the imported data to only the provided
+    individuals.  Individuals not found in the file raise value errors
+    Lines are decoded one chunk at a time so only about chunk_bytes of
+    lines are held in memory, however many samples the vcf has.
+    site_filter: if specified, called with the chromosome and position
+    arrays of each chunk, returning a mask of the sites to keep.  Removed
+    sites are not checked for phasing.
+    '''
+    chunks = list(iter_genotypes(vcf_reader,
+                                 check_phasing=check_phasing,
+                                 individuals=individuals,
+                                 chunk_bytes=chunk_bytes,
+                                 site_filter=site_filter))
+    if len(chunks) == 1:
+        return chunks[0]
+
+    return genotype_database(
+        np.concatenate([c.chrom for c in chunks]),
+        np.concatenate([c.pos for c in chunks]),
+        np.concatenate([c.ref for c in chunks]),
+        np.concatenate([c.alt for c in chunks]),
+        chunks[0].individuals,
+        np.concatenate([c.genotypes for c in chunks]))
+
+
+def iter_genotypes(vcf_reader: TextIO,
+                   check_phasing: bool = False,
+                   individuals: List[str] = None,
+                   chunk_bytes: int = CHUNK_BYTES,
+                   site_filter: Callable = None
+                   ) -> Iterator[genotype_database]:
+    '''
+    Read the open vcf file as in import_genotypes, yielding a
+    genotype_database for about every chunk_bytes of lines.  At least one,
+    possibly empty, database is produced.
+    '''
+    for line in vcf_reader:
+        if line[1] == '#':  # comment string
+            continue
+
+        if line[0] == '#':  # header string
+            header = line[1:].rstrip().split('\t')
+            break
+
+    indivs = header[9:]
+    if individuals is not None:
+        for indiv in individuals:
+            if indiv not in indivs:
+                raise ValueError(f'{indiv} not in file!')
+        # retain file order
+        indivs = [indiv for indiv in indivs if indiv in set(individuals)]
+
+    columns = [i for i, h in enumerate(header) if i >= 9 and h in indivs]
+
+    empty = True
+    chrom_type = None  # decided by the first chunk
+    for data in read_lines(vcf_reader, chunk_bytes):
+        _, chrom, pos, ref, alt, codes = parse_sites(
+            data, len(header), columns, site_filter, chrom_type)
+        del data  # before reading the next chunk
+        if chrom_type is None:
+            chrom_type = str if chrom.dtype == object else int
+
+        if check_phasing:
+            check_phased(codes, indivs, pos)
+
+        empty = False
+        yield genotype_database(chrom, pos, ref, alt, indivs,
+                                HAPLOTYPE_ALLELES[codes])
+
+    if empty:
+        yield genotype_database(np.array([], dtype=np.int64),
+                                np.array([], dtype=np.int64),
+                                np.array([], dtype='U1'),
+                                np.array([], dtype='U1'),
+                                indivs,
+                                np.empty((0, len(indivs), 2), dtype=np.int8))
+
+
+def read_lines(vcf_reader: TextIO, chunk_bytes: int) -> Iterator[bytes]:
+    '''
+    Yield the remaining lines of the open vcf as bytes, whole lines of about
+    chunk_bytes at a time, without blank lines
+    '''
+    while True:
+        data = vcf_reader.read(max(chunk_bytes, 1))
+        if data and not data.endswith('\n'):
+            data += vcf_reader.readline()
+        if not data:
+            return
+        data = skip_blank(data.encode())
+        if data:
+            yield data
+
+
+def skip_blank(data: bytes) -> bytes:
+    '''
+    Remove blank lines from data
+    '''
+    if b'\n\n' in data or data.startswith(b'\n'):
+        data = re.sub(b'\n+', b'\n', data).lstrip(b'\n')
+    return data
+
+
+def parse_sites(data: bytes,
+                fields: int,
+                columns: List[int],
+                site_filter: Callable = None,
+                chrom_type: type = None) -> Tuple[np.ndarray, ...]:
+    '''
+    Parse vcf lines with the given number of fields from raw bytes.
+    Returns the row number, chrom, pos, ref and alt of each SNP passing the
+    site_filter, and the genotype codes of the sample columns.  Genotypes
+    are decoded from the three bytes of each field, fields that are not
+    exactly a phased or unphased biallelic genotype or ./. are unphased.
+    Chromosomes are integers if every chromosome of data is numeric, unless
+    chrom_type, int or str, is given to match earlier chunks.  Chromosomes
+    which are not numeric raise a value error for int.
+    Lines are parsed PARSE_BYTES at a time to bound the field offsets held.
+    '''
+    data = skip_blank(data)
+    if data and not data.endswith(b'\n'):
+        data += b'\n'
+
+    blocks = []
+    begin = 0
+    row = 0
+    while begin < len(data) or not blocks:
+        end = data.rfind(b'\n', begin, begin + PARSE_BYTES) + 1
+        if end <= begin:  # a line longer than PARSE_BYTES
+            end = data.find(b'\n', begin) + 1
+        block = data[begin:end]
+        rows, *sites = parse_block(block, fields, columns, site_filter,
+                                   chrom_type)
+        blocks.append((rows + row, *sites))
+        row += block.count(b'\n')
+        begin = end
+
+    if len(blocks) == 1:
+        return blocks[0]
+    # chromosomes are strings unless every block is numeric
+    chroms = [block[1] for block in blocks]
+    if any(chrom.dtype == object for chrom in chroms):
+        chroms = [chrom.astype(str).astype(object) for chrom in chroms]
+    return tuple(np.concatenate(chroms) if i == 1 else
+                 np.concatenate([block[i] for block in blocks])
+                 for i in range(6))
+
+
+def parse_block(data: bytes,
+                fields: int,
+                columns: List[int],
+                site_filter: Callable = None,
+                chrom_type: type = None) -> Tuple[np.ndarray, ...]:
+    '''
+    Parse the newline terminated lines of data as parse_sites.  Offsets are
+    only computed for the fields which are read.
+    '''
+    chars = np.frombuffer(data, dtype=np.uint8)
+
+    delimiters = chars == ord('\t')
+    delimiters |= chars == ord('\n')
+    ends = np.flatnonzero(delimiters)
+    del delimiters
+    if len(ends) % fields == 0:
+        ends = ends.reshape(-1, fields)
+    if ends.ndim != 2 or (chars[ends[:, -1]] != ord('\n')).any() or \
+            data.count(b'\n') != len(ends):
+        lines = data.split(b'\n')
+        line = next(line for line in lines if line.count(b'\t') != fields - 1)
+        raise ValueError(f'Expected {fields} fields on line '
+                         f'{line.decode(errors="replace")}')
+
+    def starts(column):
+        if column > 0:
+            return ends[:, column - 1] + 1
+        result = np.zeros(len(ends), dtype=ends.dtype)
+        result[1:] = ends[:-1, -1] + 1
+        return result
+
+    def chrom_strings():
+        return parse_strings(chars, starts(0), ends[:, 0]) \
+            .astype(str).astype(object)
+
+    if chrom_type is str:
+        chrom = chrom_strings()
+    else:
+        try:
+            chrom = parse_ints(chars, starts(0), ends[:, 0])
+        except ValueError:
+            chrom = chrom_strings()
+            if chrom_type is int:
+                name = next(c for c in chrom if not c.isdigit())
+                raise ValueError(f'Expected numeric chromosomes as in '
+                                 f'earlier lines, found {name}')
+    pos = parse_ints(chars, starts(1), ends[:, 1])
+
+    ref, alt = starts(3), starts(4)
+    keep = (ends[:, 3] - ref == 1) & (ends[:, 4] - alt == 1)
+    if site_filter is not None:
+        keep &= site_filter(chrom, pos)
+    rows = np.flatnonzero(keep)
+
+    # genotype fields are read from their first three bytes
+    columns = np.asarray(columns, dtype=int)
+    offsets = ends[rows[:, None], columns - 1] + 1
+    exact = ends[rows[:, None], columns] - offsets == 3
+    first = chars[offsets]
+    offsets += 1
+    separator = chars[np.minimum(offsets, len(chars) - 1)]
+    offsets += 1
+    second = chars[np.minimum(offsets, len(chars) - 1)]
+    missing = exact & (first == ord('.')) & (separator == ord('/')) & \
+        (second == ord('.'))
+    first -= ord('0')
+    second -= ord('0')
+    phased = exact & (first <= 1) & (second <= 1) & (separator == ord('|'))
+    codes = np.full(exact.shape, UNPHASED_CODE, dtype=np.int8)
+    codes[phased] = (2 * first + second)[phased]
+    codes[missing] = MISSING_CODE
+
+    return (rows,
+            chrom[rows],
+            pos[rows],
+            chars[ref[rows]].view('S1').astype('U1'),
+            chars[alt[rows]].view('S1').astype('U1'),
+            codes)
+
+
+def check_phased(codes: np.ndarray, indivs: List[str], pos: np.ndarray):
+    '''
+    Raise a value error naming the first unphased genotype code
+    '''
+    unphased = codes == UNPHASED_CODE
+    if unphased.any():
+        row, col = np.argwhere(unphased)[0]
+        raise ValueError('Unexpected unphased haplotype for '
+                         f'{indivs[col]} on position {pos[row]}')
+
+
+def parse_strings(data: np.ndarray,
+                  starts: np.ndarray,
+                  ends: np.ndarray) -> np.ndarray:
+    '''
+    Return data[starts:ends] for each start and end as a bytes array
+    '''
+    width = max((ends - starts).max(initial=0), 1)
+    index = starts[:, None] + np.arange(width)
+    valid = index < ends[:, None]
+    chars = np.where(valid, data[np.where(valid, index, 0)], 0)
+    return np.ascontiguousarray(chars, dtype=np.uint8).view(f'S{width}') \
+        .ravel()
+
+
+def parse_ints(data: np.ndarray,
+               starts: np.ndarray,
+               ends: np.ndarray) -> np.ndarray:
+    '''
+    Parse the decimal digits of data[starts:ends] for each start and end
+    '''
+    width = (ends - starts).max(initial=0)
+    index = starts[:, None] + np.arange(width)
+    valid = index < ends[:, None]
+    digits = data[np.where(valid, index, 0)].astype(np.int64) - ord('0')
+    if ((digits < 0) | (digits > 9))[valid].any():
+        raise ValueError('Unable to parse position')
+    digits[~valid] = 0
+    # right align the digits of shorter fields
+    shift = width - (ends - starts)
+    powers = 10 ** np.maximum(width - 1 - np.arange(width) - shift[:, None],
+                              0)
+    return (digits * powers).sum(axis=1)
+
+
 def import_archaic_vcf(vcf_reader: TextIO,
                        dataframe: pd.DataFrame = None,
                        include_canc: bool = False) -> pd.DataFrame:
@@ -94,48 +490,129 @@ def import_archaic_vcf(vcf_reader: TextIO,
         usecols += ['infor']
     header = ['chrom', 'pos', 'id', 'ref', 'alt', 'qual',
               'filter', 'infor', 'format', 'variant']
-    result = pd.read_csv(vcf_reader,
+    result = process_archaic(pd.read_csv(vcf_reader,
+                                         delimiter='\t',
+                                         header=None,
+                                         names=header,
+                                         usecols=usecols,
+                                         comment='#'),
+                             include_canc)
+
+    if dataframe is not None:
+        return pd.concat([dataframe, result], sort=False)
+
+    return result
+
+
+def iter_archaic_vcf(vcf_reader: TextIO,
+                     include_canc: bool = False,
+                     chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+    '''
+    Read the open vcf file as in import_archaic_vcf, yielding a dataframe
+    for every chunksize lines
+    '''
+    usecols = ['chrom', 'pos', 'ref', 'alt', 'variant']
+    if include_canc:
+        usecols += ['infor']
+    header = ['chrom', 'pos', 'id', 'ref', 'alt', 'qual',
+              'filter', 'infor', 'format', 'variant']
+    chunks = pd.read_csv(vcf_reader,
                          delimiter='\t',
                          header=None,
                          names=header,
                          usecols=usecols,
-                         comment='#')
+                         comment='#',
+                         chunksize=chunksize)
+    while True:
+        try:
+            yield process_archaic(next(chunks), include_canc)
+        except StopIteration:
+            return
+
 
+def process_archaic(result: pd.DataFrame,
+                    include_canc: bool = False) -> pd.DataFrame:
+    '''
+    Retain SNPs of the raw archaic dataframe, converting genotypes to
+    the number of alt alleles and extracting CAnc if requested.
+    '''
     result = result.loc[(result.ref.str.len() == 1)
                         & (result.alt.str.len() == 1)]
     if include_canc:
-        result = result.loc[result.infor.str.contains('CAnc')]
+        has_canc, canc = info_values(result.infor.values, 'CAnc')
+        result = result.loc[has_canc]
 
         # extract CAnc into separate column, drop info
-        def extract_canc(info):
-            for token in info.split(';'):
-                tokens = token.split('=')
-                if tokens[0] == 'CAnc':
-                    return tokens[1]
         result.insert(len(result.columns),
                       "CAnc",
-                      result.infor.map(extract_canc))
+                      canc[has_canc])
         result = result.drop(columns='infor')
 
-    phase_decoder = {}
-    for i in range(2):
-        for j in range(2):
-            phase_decoder[f'{i}|{j}'] = i + j
-            phase_decoder[f'{i}/{j}'] = i + j
-    phase_decoder['./.'] = 0
+    # ./. is -1 to filter later
+    result.variant = archaic_alleles(result.variant.values,
+                                     missing=-1 if include_canc else 0)
 
     if include_canc:
-        phase_decoder['./.'] = -1  # to filter later
+        result = result.loc[result.variant != -1]
 
-    def process_phase(x):
-        return phase_decoder[x[:3]]
+    return result
 
-    result.variant = result.variant.map(process_phase)
 
-    if include_canc:
-        result = result.loc[result.variant != -1]
+def info_values(info: np.ndarray, key: str) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Scan the info strings as one byte array.  Returns whether each string
+    contains key, and the value of its first key=value entry, or None.
+    '''
+    data = np.frombuffer(('\n'.join(info) + '\n').encode(), dtype=np.uint8)
+    ends = np.flatnonzero(data == ord('\n'))
+    pattern = np.frombuffer(key.encode(), dtype=np.uint8)
+    length = max(len(data) - len(pattern), 0)
+    found = np.ones(length, dtype=bool)
+    for i, char in enumerate(pattern):
+        found &= data[i:length + i] == char
+    found = np.flatnonzero(found)
+    contains = np.zeros(len(info), dtype=bool)
+    contains[np.searchsorted(ends, found)] = True
 
-    if dataframe is not None:
-        return pd.concat([dataframe, result], sort=False)
+    # entries begin a string or follow ; and are followed by =
+    after = found + len(pattern)
+    before = data[np.maximum(found - 1, 0)]
+    entries = found[(data[after] == ord('=')) &
+                    ((found == 0) | (before == ord(';'))
+                     | (before == ord('\n')))]
+    rows, first = np.unique(np.searchsorted(ends, entries), return_index=True)
+    starts = entries[first] + len(pattern) + 1
+    delimiters = np.flatnonzero((data == ord(';')) | (data == ord('='))
+                                | (data == ord('\n')))
+    stops = delimiters[np.searchsorted(delimiters, starts)]
 
-    return result
+    # gather values into fixed width byte strings
+    width = max((stops - starts).max(initial=0), 1)
+    index = starts[:, None] + np.arange(width)
+    chars = np.where(index < stops[:, None],
+                     data[np.minimum(index, len(data) - 1)], 0)
+    chars = np.ascontiguousarray(chars, dtype=np.uint8) \
+        .view(f'S{width}').ravel()
+    values = np.full(len(info), None, dtype=object)
+    try:
+        values[rows] = chars.astype(str)
+    except UnicodeDecodeError:
+        values[rows] = np.char.decode(chars, 'utf-8')
+    return contains, values
+
+
+def archaic_alleles(genotypes: np.ndarray, missing: int = 0) -> np.ndarray:
+    '''
+    Return the number of alt alleles from the first three characters of each
+    genotype, phased or not.  ./. is returned as missing.
+    '''
+    chars = np.asarray(genotypes).astype('S3').view(np.uint8) \
+        .reshape(-1, 3)
+    alleles = chars[:, [0, 2]].astype(np.int64) - ord('0')
+    called = ((alleles >= 0) & (alleles <= 1)).all(axis=1) & \
+        ((chars[:, 1] == ord('|')) | (chars[:, 1] == ord('/')))
+    absent = (chars == np.frombuffer(b'./.', dtype=np.uint8)).all(axis=1)
+    if not (called | absent).all():
+        row = np.flatnonzero(~(called | absent))[0]
+        raise ValueError(f'Unable to decode genotype {genotypes[row]}')
+    return np.where(called, alleles.sum(axis=1), missing)
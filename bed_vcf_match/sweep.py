@@ -0,0 +1,172 @@
+'''
+sweep
+
+Streaming analysis of bed regions.  Modern and archaic vcfs are read in
+position order, one chunk at a time, and the counts of summarize_regions are
+accumulated for the regions of every bed file as the chunks pass.  Memory
+depends on the chunk size and the number of regions, not the chromosome.
+'''
+
+
+import numpy as np
+import pandas as pd
+from typing import Iterator, List
+from bed_vcf_match.read_vcf import genotype_database
+from bed_vcf_match.analyze_bed import (bed_structure, join_sites,
+                                       individual_sites, format_regions)
+
+
+class archaic_stream():
+    '''
+    Archaic vcf chunks of a single chromosome, read in position order and
+    released as the modern sites advance.
+    '''
+    def __init__(self, chunks: Iterator[pd.DataFrame], chromosome: int):
+        self.chunks = chunks
+        self.chromosome = chromosome
+        self.pending = []
+        self.empty = None
+        self.last_position = -1
+        self.done = False
+
+    def until(self, position: int) -> pd.DataFrame:
+        '''
+        Return the archaic sites at or before position.  Sites at position
+        are also kept for the next call, as the next modern chunk may start
+        at the same position.
+        '''
+        while not self.done and self.last_position <= position:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.done = True
+                break
+            if self.empty is None:
+                self.empty = chunk.iloc[0:0]
+            chunk = chunk.loc[chunk.chrom == self.chromosome]
+            if len(chunk) > 0:
+                if chunk.pos.values[0] < self.last_position or \
+                        not np.all(np.diff(chunk.pos.values) >= 0):
+                    raise ValueError('Archaic vcf is not sorted by position')
+                self.last_position = chunk.pos.values[-1]
+                self.pending.append(chunk)
+
+        if len(self.pending) == 0:
+            return self.empty
+        sites = pd.concat(self.pending)
+        self.pending = [sites.loc[sites.pos >= position]]
+        return sites.loc[sites.pos <= position]
+
+
+class region_sweep():
+    '''
+    Accumulates the summarize_regions columns of every bed file while
+    chunks of sorted modern sites are added.
+    '''
+    def __init__(self,
+                 chromosome: int,
+                 beds: List[bed_structure],
+                 archaic_count: int):
+        self.chromosome = chromosome
+        self.beds = beds
+        self.last_position = -1
+        self.starts = []
+        self.ends = []
+        self.orders = []
+        self.max_ends = []
+        self.first_open = []
+        self.columns = []
+        for bed in beds:
+            # regions are processed sorted by start
+            starts, ends, order = bed.sorted_regions(chromosome)
+            self.orders.append(order)
+            self.starts.append(starts)
+            self.ends.append(ends)
+            # running max of ends finds regions which are finished
+            self.max_ends.append(np.maximum.accumulate(ends)
+                                 if len(order) > 0 else ends)
+            self.first_open.append(0)
+            self.columns.append(np.zeros((2 + 3 * archaic_count,
+                                          len(starts)),
+                                         dtype=np.int64))
+
+    def add(self, sites: genotype_database, archaics: List[pd.DataFrame]):
+        '''
+        Add a chunk of modern sites of the chromosome, sorted by position
+        and continuing from the previous chunk.  archaics are the archaic
+        sites covering the chunk for each archaic vcf.
+        '''
+        if len(sites) == 0:
+            return
+        positions = sites.pos
+        if positions[0] < self.last_position or \
+                not np.all(np.diff(positions) >= 0):
+            raise ValueError('Modern vcf is not sorted by position')
+        self.last_position = positions[-1]
+
+        keys = sites.keys()
+        joined = []
+        for archaic in archaics:
+            variants, matches, _ = join_sites(keys, archaic)
+            joined.append((variants, matches))
+
+        individuals = {}
+        for i, bed in enumerate(self.beds):
+            # regions with start < position <= end overlap the chunk
+            first = self.first_open[i] + np.searchsorted(
+                self.max_ends[i][self.first_open[i]:], positions[0])
+            last = np.searchsorted(self.starts[i], positions[-1])
+            self.first_open[i] = first
+            if first >= last:
+                continue
+
+            lower = np.searchsorted(positions, self.starts[i][first:last],
+                                    side='right')
+            upper = np.maximum(
+                np.searchsorted(positions, self.ends[i][first:last],
+                                side='right'),
+                lower)
+            if bed.individual not in individuals:
+                individuals[bed.individual] = individual_sites(
+                    sites.genotypes[:, sites.columns[bed.individual], :],
+                    joined)
+            columns = individuals[bed.individual].columns(bed.haplotype,
+                                                          lower,
+                                                          upper)
+            self.columns[i][:, first:last] += np.array(columns)
+
+    def summaries(self) -> List[str]:
+        '''
+        Return the output lines of each bed, in the original region order
+        '''
+        results = []
+        for i, bed in enumerate(self.beds):
+            if str(self.chromosome) not in bed.bed:
+                results.append('')
+                continue
+            columns = np.empty_like(self.columns[i])
+            columns[:, self.orders[i]] = self.columns[i]
+            starts, ends = bed.regions(self.chromosome)
+            results.append(format_regions(self.chromosome, starts, ends,
+                                          list(columns)))
+        return results
+
+
+def sweep_chromosome(chromosome: int,
+                     beds: List[bed_structure],
+                     modern_chunks: Iterator[genotype_database],
+                     *archaic_chunks: Iterator[pd.DataFrame]) -> List[str]:
+    '''
+    Stream the modern and archaic chunks of a chromosome, returning the
+    output lines of each bed as bed_structure.summarize_chrom would.
+    '''
+    archaics = [archaic_stream(chunks, chromosome)
+                for chunks in archaic_chunks]
+    sweep = region_sweep(chromosome, beds, len(archaics))
+    for sites in modern_chunks:
+        sites = sites.take(np.flatnonzero(sites.chrom == chromosome))
+        if len(sites) == 0:
+            continue
+        sweep.add(sites,
+                  [archaic.until(sites.pos[-1]) for archaic in archaics])
+    return sweep.summaries()
@@ -0,0 +1,243 @@
+'''
+vcf_cache
+
+Persistent cache of parsed vcfs.  The arrays of a parsed vcf are stored as
+numpy files, keyed by the source file and import options, and memory mapped
+on later runs instead of decompressing and parsing the vcf again.  Each vcf
+keeps a single entry of each kind, replaced when parsed with other options.
+'''
+
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Callable, List, TextIO, Tuple
+from bed_vcf_match.read_vcf import (genotype_database, open_vcf,
+                                    import_genotypes, import_archaic_vcf)
+from bed_vcf_match.vcf_index import merge_regions, open_regions
+
+
+class vcf_cache():
+    '''
+    Load vcfs through a cache directory.  If directory is None, vcfs are
+    always parsed.  With rebuild, existing entries are replaced.  BGZF vcfs
+    are inflated with threads when parsed.  If regions, a tuple of
+    chromosome, starts and ends, are given, only sites within the regions
+    are read from indexed vcfs.  Saving an entry removes the other entries
+    of the same vcf and kind, so the directory holds the vcfs as last parsed.
+    '''
+    def __init__(self,
+                 directory: str = None,
+                 rebuild: bool = False,
+                 threads: int = 1):
+        self.directory = directory
+        self.rebuild = rebuild
+        self.threads = threads
+
+    def load_genotypes(self,
+                       vcf: str,
+                       check_phasing: bool = False,
+                       individuals: List[str] = None,
+                       regions: Tuple = None,
+                       site_filter: Callable = None) -> genotype_database:
+        '''
+        Return the genotype_database of the vcf as import_genotypes.  A
+        site_filter must provide a digest method to key the cache.
+        '''
+        def parse():
+            with self.open(vcf, regions) as reader:
+                return import_genotypes(reader,
+                                        check_phasing=check_phasing,
+                                        individuals=individuals,
+                                        site_filter=site_filter)
+
+        if self.directory is None:
+            return parse()
+
+        if individuals is not None:
+            individuals = sorted(set(individuals))
+        entry = self.entry(vcf,
+                           kind='genotypes',
+                           check_phasing=check_phasing,
+                           individuals=individuals,
+                           regions=region_digest(regions),
+                           sites=None if site_filter is None
+                           else site_filter.digest())
+
+        arrays = self.cached(entry)
+        if arrays is not None:
+            return genotype_database(arrays['chrom'],
+                                     arrays['pos'],
+                                     arrays['ref'],
+                                     arrays['alt'],
+                                     arrays['individuals'],
+                                     arrays['genotypes'])
+
+        result = parse()
+        self.save(entry, vcf, 'genotypes', {'chrom': result.chrom,
+                                            'pos': result.pos,
+                                            'ref': result.ref,
+                                            'alt': result.alt,
+                                            'individuals': result.individuals,
+                                            'genotypes': result.genotypes})
+        return result
+
+    def load_archaic(self,
+                     vcf: str,
+                     include_canc: bool = False,
+                     regions: Tuple = None) -> pd.DataFrame:
+        '''
+        Return the dataframe of the archaic vcf as import_archaic_vcf
+        '''
+        def parse():
+            with self.open(vcf, regions) as reader:
+                return import_archaic_vcf(reader, include_canc=include_canc)
+
+        if self.directory is None:
+            return parse()
+
+        entry = self.entry(vcf,
+                           kind='archaic',
+                           include_canc=include_canc,
+                           regions=region_digest(regions))
+
+        arrays = self.cached(entry)
+        if arrays is not None:
+            result = pd.DataFrame({c: arrays[c] for c in arrays['columns']})
+            if include_canc:
+                # restore missing CAnc values
+                canc = result.CAnc.values.astype(object)
+                canc[canc == ''] = None
+                result['CAnc'] = canc
+            return result
+
+        result = parse()
+        arrays = {c: result[c].values for c in result.columns}
+        arrays['columns'] = list(result.columns)
+        if include_canc:
+            arrays['CAnc'] = result.CAnc.fillna('').values
+        self.save(entry, vcf, 'archaic', arrays)
+        return result
+
+    def open(self, vcf: str, regions: Tuple = None) -> TextIO:
+        '''
+        Open the vcf, limited to the regions if provided
+        '''
+        if regions is None:
+            return open_vcf(vcf, self.threads)
+        return open_regions(vcf, *regions, threads=self.threads)
+
+    def cached(self, entry: str) -> dict:
+        '''
+        Return the arrays of the entry, or None if it must be parsed.  The
+        entry may be removed by another run while loading.
+        '''
+        if self.rebuild or not os.path.isdir(entry):
+            return None
+        try:
+            return load_arrays(entry)
+        except FileNotFoundError:
+            return None
+
+    def save(self, entry: str, vcf: str, kind: str, arrays: dict):
+        '''
+        Save the arrays of the vcf as the entry, removing the other entries
+        of the vcf and kind
+        '''
+        source = [os.path.abspath(vcf), kind]
+        save_arrays(entry, dict(arrays, source=source))
+        prefix = f'{os.path.basename(vcf)}.'
+        for name in os.listdir(self.directory):
+            other = os.path.join(self.directory, name)
+            if other == entry or not name.startswith(prefix) or \
+                    name.endswith('.tmp'):
+                continue
+            try:
+                with open(os.path.join(other, 'lists.json')) as reader:
+                    if json.load(reader).get('source') != source:
+                        continue
+            except (OSError, ValueError):
+                continue
+            shutil.rmtree(other, ignore_errors=True)
+
+    def entry(self, vcf: str, **options) -> str:
+        '''
+        Return the cache directory of the vcf, keyed by the source path, size
+        and modification time and the import options
+        '''
+        status = os.stat(vcf)
+        key = json.dumps({'path': os.path.abspath(vcf),
+                          'size': status.st_size,
+                          'mtime': status.st_mtime_ns,
+                          'options': options},
+                         sort_keys=True)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(self.directory,
+                            f'{os.path.basename(vcf)}.{digest}')
+
+
+def region_digest(regions: Tuple) -> str:
+    '''
+    Return a key for the chromosome and merged positions of the regions
+    '''
+    if regions is None:
+        return None
+    chromosome, starts, ends = regions
+    starts, ends = merge_regions(starts, ends)
+    digest = hashlib.sha1(str(chromosome).encode())
+    digest.update(starts.tobytes())
+    digest.update(ends.tobytes())
+    return digest.hexdigest()
+
+
+def save_arrays(directory: str, arrays: dict):
+    '''
+    Save the arrays as numpy files in directory.  Lists are stored as json
+    and object arrays as unicode strings.  The directory is written under a
+    temporary name and renamed once complete.
+    '''
+    temp = f'{directory}.{os.getpid()}.tmp'
+    os.makedirs(temp, exist_ok=True)
+    lists = {}
+    for name, array in arrays.items():
+        if isinstance(array, list):
+            lists[name] = array
+            continue
+        array = np.asarray(array)
+        if array.dtype == object:
+            lists[f'{name}.object'] = True
+            array = array.astype(str)
+        np.save(os.path.join(temp, f'{name}.npy'), array)
+
+    with open(os.path.join(temp, 'lists.json'), 'w') as writer:
+        json.dump(lists, writer)
+
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    try:
+        os.rename(temp, directory)
+    except OSError:
+        # another process finished the same entry first
+        shutil.rmtree(temp, ignore_errors=True)
+
+
+def load_arrays(directory: str) -> dict:
+    '''
+    Memory map the arrays saved by save_arrays
+    '''
+    with open(os.path.join(directory, 'lists.json')) as reader:
+        lists = json.load(reader)
+    result = {name: value for name, value in lists.items()
+              if not name.endswith('.object')}
+    for filename in os.listdir(directory):
+        name, extension = os.path.splitext(filename)
+        if extension != '.npy':
+            continue
+        array = np.load(os.path.join(directory, filename), mmap_mode='r')
+        if f'{name}.object' in lists:
+            array = array.astype(object)
+        result[name] = array
+    return result
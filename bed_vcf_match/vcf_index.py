@@ -0,0 +1,368 @@
+'''
+vcf_index
+
+Random access to the sites of BGZF compressed vcfs within a set of regions.
+Virtual offsets are found from a tabix (.tbi or .csi) index when present,
+otherwise from a sidecar index of the first line of each block, built on
+first use and stored beside the vcf.
+'''
+
+
+import gzip
+import io
+import os
+import struct
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterator, TextIO, Tuple
+from bed_vcf_match.bgzf import chunk_reader, is_bgzf, iter_lines
+from bed_vcf_match.read_vcf import open_vcf
+
+
+SIDECAR_SUFFIX = '.bvi.npz'
+# tabix linear index windows are 16 kbp
+TABIX_SHIFT = 14
+
+
+class vcf_index(ABC):
+    '''
+    Virtual offsets to seek to for positions of each contig
+    '''
+    @abstractmethod
+    def offset(self, contig: str, position: int) -> int:
+        '''
+        Return a virtual offset at or before the first line of the contig at
+        or after position, or None if the contig is absent
+        '''
+
+
+class tabix_index(vcf_index):
+    '''
+    Linear index of a .tbi file
+    '''
+    def __init__(self, names: Dict[str, int], linear: list):
+        self.names = names
+        self.linear = linear
+
+    def offset(self, contig: str, position: int) -> int:
+        if contig not in self.names:
+            return None
+        offsets = self.linear[self.names[contig]]
+        if len(offsets) == 0:
+            return None
+        # vcf positions are 1-based, tabix windows are 0-based
+        window = min(max(position - 1, 0) >> TABIX_SHIFT, len(offsets) - 1)
+        return int(offsets[window])
+
+
+class csi_index(vcf_index):
+    '''
+    Binning index of a .csi file, using the smallest offset of each bin
+    '''
+    def __init__(self,
+                 names: Dict[str, int],
+                 bins: list,
+                 min_shift: int,
+                 depth: int):
+        self.names = names
+        self.bins = bins
+        self.min_shift = min_shift
+        self.depth = depth
+
+    def offset(self, contig: str, position: int) -> int:
+        if contig not in self.names:
+            return None
+        bins = self.bins[self.names[contig]]
+        if len(bins) == 0:
+            return None
+        # start from the leaf bin of the position and move to parents
+        position = max(position - 1, 0)
+        first = ((1 << 3 * self.depth) - 1) // 7
+        bin_id = first + (position >> self.min_shift)
+        while bin_id not in bins and bin_id > 0:
+            bin_id = (bin_id - 1) >> 3
+        return bins.get(bin_id, min(bins.values()))
+
+
+class sidecar_index(vcf_index):
+    '''
+    Position and virtual offset of the first line of each block and of each
+    contig
+    '''
+    def __init__(self, positions: Dict[str, np.ndarray],
+                 offsets: Dict[str, np.ndarray]):
+        self.positions = positions
+        self.offsets = offsets
+
+    def offset(self, contig: str, position: int) -> int:
+        if contig not in self.positions:
+            return None
+        # lines at position may begin before a block starting with position
+        i = np.searchsorted(self.positions[contig], position, side='left')
+        return int(self.offsets[contig][max(i - 1, 0)])
+
+
+def read_names(reader: BinaryIO) -> Dict[str, int]:
+    '''
+    Read the tabix header following the number of references, returning
+    the index of each contig name
+    '''
+    # format, col_seq, col_beg, col_end, meta, skip
+    reader.read(24)
+    length = struct.unpack('<i', reader.read(4))[0]
+    names = reader.read(length).split(b'\x00')
+    return {name.decode(): i for i, name in enumerate(names) if name}
+
+
+def read_tabix(filename: str) -> tabix_index:
+    '''
+    Read the linear index of a .tbi file
+    '''
+    with gzip.open(filename, 'rb') as reader:
+        if reader.read(4) != b'TBI\x01':
+            raise ValueError(f'{filename} is not a tabix index')
+        references = struct.unpack('<i', reader.read(4))[0]
+        names = read_names(reader)
+        linear = []
+        for _ in range(references):
+            bins = struct.unpack('<i', reader.read(4))[0]
+            for _ in range(bins):
+                _, chunks = struct.unpack('<Ii', reader.read(8))
+                reader.read(16 * chunks)
+            intervals = struct.unpack('<i', reader.read(4))[0]
+            offsets = np.frombuffer(reader.read(8 * intervals),
+                                    dtype='<u8').copy()
+            # windows before the first line are empty
+            nonzero = np.flatnonzero(offsets)
+            if len(nonzero) > 0:
+                offsets[:nonzero[0]] = offsets[nonzero[0]]
+            linear.append(offsets)
+    return tabix_index(names, linear)
+
+
+def read_csi(filename: str) -> csi_index:
+    '''
+    Read the bin offsets of a .csi file.  Indices without contig names
+    return None.
+    '''
+    with gzip.open(filename, 'rb') as reader:
+        if reader.read(4) != b'CSI\x01':
+            raise ValueError(f'{filename} is not a csi index')
+        min_shift, depth, length = struct.unpack('<iii', reader.read(12))
+        if length < 28:
+            return None
+        names = read_names(io.BytesIO(reader.read(length)))
+        references = struct.unpack('<i', reader.read(4))[0]
+        # skip the pseudo bin holding read counts
+        last_bin = ((1 << 3 * (depth + 1)) - 1) // 7 - 1
+        bins = []
+        for _ in range(references):
+            offsets = {}
+            for _ in range(struct.unpack('<i', reader.read(4))[0]):
+                bin_id, offset, chunks = struct.unpack('<IQi',
+                                                       reader.read(16))
+                reader.read(16 * chunks)
+                if bin_id <= last_bin:
+                    offsets[bin_id] = offset
+            bins.append(offsets)
+    return csi_index(names, bins, min_shift, depth)
+
+
+def build_sidecar(vcf: str, threads: int = 1) -> sidecar_index:
+    '''
+    Scan the BGZF vcf, recording the first line of each block and contig.
+    Returns None if a contig is not sorted by position or not contiguous.
+    '''
+    positions = {}
+    offsets = {}
+    contig = None
+    last_block = None
+    last_position = None
+    with open(vcf, 'rb') as reader:
+        for offset, line in iter_lines(reader, threads=threads):
+            if line.startswith(b'#'):
+                continue
+            fields = line.split(b'\t', 2)
+            name, position = fields[0].decode(), int(fields[1])
+            if name != contig:
+                if name in positions:
+                    return None
+                contig = name
+                positions[contig] = []
+                offsets[contig] = []
+            elif position < last_position:
+                return None
+            if offset >> 16 != last_block or not positions[contig]:
+                positions[contig].append(position)
+                offsets[contig].append(offset)
+            last_block = offset >> 16
+            last_position = position
+
+    return sidecar_index(
+        {c: np.array(p, dtype=np.int64) for c, p in positions.items()},
+        {c: np.array(o, dtype=np.uint64) for c, o in offsets.items()})
+
+
+def save_sidecar(filename: str, index: sidecar_index, vcf: str):
+    '''
+    Store the sidecar with the size and modification time of the vcf
+    '''
+    status = os.stat(vcf)
+    arrays = {'source': np.array([status.st_size, status.st_mtime_ns],
+                                 dtype=np.int64),
+              'contigs': np.array(list(index.positions), dtype=str)}
+    for i, contig in enumerate(index.positions):
+        arrays[f'positions{i}'] = index.positions[contig]
+        arrays[f'offsets{i}'] = index.offsets[contig]
+    temp = f'{filename}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as writer:
+        np.savez(writer, **arrays)
+    os.replace(temp, filename)
+
+
+def load_sidecar(filename: str, vcf: str) -> sidecar_index:
+    '''
+    Load a sidecar index, returning None if it is missing or out of date
+    '''
+    if not os.path.exists(filename):
+        return None
+    status = os.stat(vcf)
+    with np.load(filename) as arrays:
+        if list(arrays['source']) != [status.st_size, status.st_mtime_ns]:
+            return None
+        contigs = list(arrays['contigs'])
+        return sidecar_index(
+            {str(c): arrays[f'positions{i}'] for i, c in enumerate(contigs)},
+            {str(c): arrays[f'offsets{i}'] for i, c in enumerate(contigs)})
+
+
+def load_index(vcf: str, threads: int = 1) -> vcf_index:
+    '''
+    Return the index of a BGZF vcf: a tabix index if one is newer than the
+    vcf, otherwise the sidecar index, building it if needed.  Returns None
+    for files that are not BGZF or cannot be indexed.
+    '''
+    if os.path.splitext(vcf)[1] != '.gz' or not is_bgzf(vcf):
+        return None
+
+    modified = os.stat(vcf).st_mtime_ns
+    for suffix, reader in (('.tbi', read_tabix), ('.csi', read_csi)):
+        filename = vcf + suffix
+        if os.path.exists(filename) and \
+                os.stat(filename).st_mtime_ns >= modified:
+            index = reader(filename)
+            if index is not None:
+                return index
+
+    filename = vcf + SIDECAR_SUFFIX
+    index = load_sidecar(filename, vcf)
+    if index is None:
+        index = build_sidecar(vcf, threads)
+        if index is not None:
+            try:
+                save_sidecar(filename, index, vcf)
+            except OSError:
+                pass  # the index is still used for this run
+    return index
+
+
+def merge_regions(starts: np.ndarray,
+                  ends: np.ndarray,
+                  distance: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Merge regions, selecting start < pos <= end, into sorted disjoint
+    regions covering the same positions.  If distance is provided, regions
+    are also merged if start_i - end_i-1 <= distance.
+    '''
+    order = np.argsort(starts, kind='mergesort')
+    starts = np.asarray(starts, dtype=np.int64)[order]
+    ends = np.asarray(ends, dtype=np.int64)[order]
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return starts, ends
+
+    # a region begins where it starts after every earlier region ends
+    reach = np.maximum.accumulate(ends)
+    begins = np.ones(len(starts), dtype=bool)
+    if distance is None:
+        begins[1:] = starts[1:] >= reach[:-1]
+    else:
+        begins[1:] = starts[1:] - reach[:-1] > distance
+    groups = np.cumsum(begins) - 1
+    merged_ends = np.zeros(groups[-1] + 1, dtype=np.int64)
+    np.maximum.at(merged_ends, groups, ends)
+    return starts[begins], merged_ends
+
+
+def iter_region_lines(vcf: str,
+                      index: vcf_index,
+                      contig: str,
+                      starts: np.ndarray,
+                      ends: np.ndarray,
+                      threads: int = 1) -> Iterator[bytes]:
+    '''
+    Yield the header lines of the vcf, then each line of the contig within
+    the merged regions.  Reading continues through nearby regions and seeks
+    past gaps.
+    '''
+    with open(vcf, 'rb') as reader:
+        lines = iter_lines(reader)
+        for _, line in lines:
+            if not line.startswith(b'#'):
+                break
+            yield line
+        lines.close()
+
+        current = None  # offset and line read past the last region
+        seen = False
+        for start, end in zip(*merge_regions(starts, ends)):
+            offset = index.offset(contig, int(start) + 1)
+            if offset is None:
+                break
+            if current is None or offset > current[0]:
+                lines.close()
+                lines = iter_lines(reader, offset, threads)
+                current = next(lines, None)
+
+            while current is not None:
+                line = current[1]
+                fields = line.split(b'\t', 2)
+                if line.startswith(b'#') or fields[0].decode() != contig:
+                    if seen:  # past the end of the contig
+                        current = None
+                        break
+                    current = next(lines, None)
+                    continue
+                seen = True
+                position = int(fields[1])
+                if position > end:
+                    break
+                if position > start:
+                    yield line
+                current = next(lines, None)
+
+            if current is None:  # later regions follow the lines read
+                break
+
+        lines.close()
+
+
+def open_regions(vcf: str,
+                 chromosome: int,
+                 starts: np.ndarray,
+                 ends: np.ndarray,
+                 threads: int = 1) -> TextIO:
+    '''
+    Open the vcf as text holding its header and only the lines of the
+    chromosome within the regions.  Vcfs that cannot be indexed are opened
+    in full.
+    '''
+    index = load_index(vcf, threads)
+    if index is None:
+        return open_vcf(vcf, threads)
+
+    return io.TextIOWrapper(io.BufferedReader(
+        chunk_reader(iter_region_lines(vcf, index, str(chromosome),
+                                       starts, ends, threads)),
+        buffer_size=1 << 20))
@@ -0,0 +1,6 @@
+'''
+benchmark
+
+Throughput benchmarks of bed_vcf_match on synthetic data.  Run with
+python -m benchmark from the top level directory.
+'''
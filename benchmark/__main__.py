@@ -0,0 +1,283 @@
+'''
+Time the main stages of bed_vcf_match at several scales of synthetic data,
+reporting wall time and peak traced memory of each stage as json.  A wide
+vcf checks the memory of reading a few individuals of many samples.
+
+python -m benchmark --scales 1000 10000 --samples 20 --output bench.json
+'''
+
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+from typing import List, Callable
+import numpy as np
+
+from bed_vcf_match import read_vcf, analyze_bed
+from benchmark import generate
+import thin_vcf
+import pandas as pd
+
+
+# largest peak memory of reading a wide vcf, relative to the bytes of
+# lines read at once
+WIDE_MEMORY_RATIO = 8
+
+
+def measure(function: Callable, repeat: int = 1) -> dict:
+    '''
+    Run the function, returning the best wall time of repeat calls and the
+    peak memory traced during the first call
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    times = [time.perf_counter() - start]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def run_scale(directory: str,
+              sites: int,
+              samples: int,
+              regions: int,
+              repeat: int) -> List[dict]:
+    '''
+    Generate a dataset and time each stage on it
+    '''
+    paths = generate.write_dataset(directory, sites, samples, regions)
+    beds = [analyze_bed.bed_structure(bed, directory)
+            for bed in paths['beds']]
+    individuals = sorted(set(bed.individual for bed in beds))
+    bed = beds[0]
+    starts, ends = bed.regions(1)
+
+    def read(path):
+        with open(path) as reader:
+            return reader.read()
+    modern_text = read(paths['modern'])
+    archaic_text = read(paths['archaic'])
+
+    # inputs of later stages
+    modern_frame = read_vcf.import_vcf(StringIO(modern_text),
+                                       individuals=individuals)
+    modern_db = read_vcf.import_genotypes(StringIO(modern_text),
+                                          individuals=individuals)
+    archaic_frame = read_vcf.import_archaic_vcf(StringIO(archaic_text),
+                                                include_canc=True)
+    index = analyze_bed.site_index(modern_db, 1)
+    sites_table = analyze_bed.archaic_sites(index, archaic_frame)
+    region_rows = analyze_bed.filter_modern_db(
+        modern_frame, 1, starts[0], ends[-1], bed.haplotype, bed.individual)
+    thin_bed = np.atleast_2d(
+        thin_vcf.read_bed(StringIO(read(paths['beds'][0])), 10))
+
+    def thin():
+        parser = thin_vcf.line_parser(thin_bed.copy(), individuals[:2])
+        for line in StringIO(modern_text):
+            parser.process_line(line)
+
+    def summarize_region():
+        for start, end in list(zip(starts, ends))[:100]:
+            analyze_bed.summarize_region([1, start, end],
+                                         bed.haplotype,
+                                         bed.individual,
+                                         modern_frame,
+                                         archaic_frame)
+
+    stages = {
+        'import_vcf': lambda: read_vcf.import_vcf(
+            StringIO(modern_text), individuals=individuals),
+        'import_genotypes': lambda: read_vcf.import_genotypes(
+            StringIO(modern_text), individuals=individuals),
+        'import_archaic_vcf': lambda: read_vcf.import_archaic_vcf(
+            StringIO(archaic_text), include_canc=True),
+        'summarize_region_x100': summarize_region,
+        'summarize_beds': lambda: analyze_bed.summarize_beds(
+            1, beds, index, sites_table),
+        'process_chrom': lambda: bed.summarize_chrom(
+            1, index, sites_table),
+        'join_vcf': lambda: analyze_bed.join_vcf(region_rows,
+                                                 archaic_frame),
+        'thin_vcf.line_parser': thin,
+    }
+
+    results = []
+    for name, function in stages.items():
+        result = {'stage': name,
+                  'sites': sites,
+                  'samples': samples,
+                  'regions': regions,
+                  'bed_files': len(beds)}
+        result.update(measure(function, repeat))
+        results.append(result)
+        print(f'{name:>24} {sites:>9} sites {result["seconds"]:9.4f} s '
+              f'{result["peak_bytes"] / 2**20:9.1f} MiB',
+              file=sys.stderr, flush=True)
+
+    for bed in beds:
+        bed.close()
+    return results
+
+
+def run_wide(directory: str,
+             sites: int,
+             samples: int,
+             individuals: int,
+             repeat: int,
+             chunk_bytes: int = read_vcf.CHUNK_BYTES) -> List[dict]:
+    '''
+    Time reading some individuals of a vcf with many samples, against
+    reading the same columns with pandas.  The peak memory relative to the
+    bytes of lines read at once, the vcf or a chunk if smaller, is the
+    memory_ratio.  The vcf is read from a file as StringIO holds 4 bytes
+    per character.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'wide.vcf')
+    with open(path, 'w') as writer:
+        writer.write(generate.modern_vcf(sites, samples))
+    size = os.path.getsize(path)
+    selected = generate.sample_names(samples)[:individuals]
+    usecols = [0, 1, 3, 4] + list(range(9, 9 + individuals))
+
+    def import_genotypes():
+        with open(path) as reader:
+            read_vcf.import_genotypes(reader, individuals=selected,
+                                      chunk_bytes=chunk_bytes)
+
+    stages = {
+        'import_genotypes_wide': import_genotypes,
+        'read_csv_wide': lambda: pd.read_csv(
+            path, sep='\t', comment='#', header=None, usecols=usecols),
+    }
+
+    results = []
+    for name, function in stages.items():
+        result = {'stage': name,
+                  'sites': sites,
+                  'samples': samples,
+                  'individuals': individuals,
+                  'chunk_bytes': chunk_bytes,
+                  'vcf_bytes': size}
+        result.update(measure(function, repeat))
+        result['memory_ratio'] = result['peak_bytes'] / \
+            min(size, chunk_bytes)
+        results.append(result)
+        print(f'{name:>24} {samples:>9} samples {result["seconds"]:9.4f} s '
+              f'{result["peak_bytes"] / 2**20:9.1f} MiB',
+              file=sys.stderr, flush=True)
+    return results
+
+
+def check_memory(results: List[dict]) -> List[str]:
+    '''
+    Return a message for each wide vcf read above WIDE_MEMORY_RATIO
+    '''
+    return [f'{result["stage"]} peak memory is {result["memory_ratio"]:.1f}'
+            f' times the bytes read at once, above {WIDE_MEMORY_RATIO}'
+            for result in results
+            if result['stage'] == 'import_genotypes_wide' and
+            result['memory_ratio'] > WIDE_MEMORY_RATIO]
+
+
+def commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = read_args()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for sites in args.scales:
+            results += run_scale(os.path.join(directory, str(sites)),
+                                 sites,
+                                 args.samples,
+                                 args.regions,
+                                 args.repeat)
+        if args.wide_samples > 0:
+            results += run_wide(os.path.join(directory, 'wide'),
+                                args.wide_sites,
+                                args.wide_samples,
+                                args.wide_individuals,
+                                args.repeat)
+
+    report = {'commit': commit(),
+              'python': platform.python_version(),
+              'results': results}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as writer:
+            json.dump(report, writer, indent=2)
+
+    errors = check_memory(results)
+    for error in errors:
+        print(error, file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+
+def read_args(args: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Benchmark bed_vcf_match on synthetic data')
+    parser.add_argument('--scales',
+                        default=[1000, 10000, 100000],
+                        type=int,
+                        nargs='*',
+                        help='Number of modern sites of each dataset.')
+    parser.add_argument('--samples',
+                        default=20,
+                        type=int,
+                        help='Number of modern samples.')
+    parser.add_argument('--regions',
+                        default=200,
+                        type=int,
+                        help='Number of regions of each bed file.')
+    parser.add_argument('--wide_sites',
+                        default=4000,
+                        type=int,
+                        help='Number of sites of the wide vcf, several '
+                        'chunks of lines.')
+    parser.add_argument('--wide_samples',
+                        default=2500,
+                        type=int,
+                        help='Number of samples of the wide vcf, 0 to skip '
+                        'the memory check.')
+    parser.add_argument('--wide_individuals',
+                        default=100,
+                        type=int,
+                        help='Number of individuals read from the wide vcf.')
+    parser.add_argument('--repeat',
+                        default=3,
+                        type=int,
+                        help='Report the best time of repeat runs.')
+    parser.add_argument('--output',
+                        default=None,
+                        help='Json report file, default is stdout.')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+'''
+generate
+
+Deterministic generators of synthetic modern and archaic vcfs and merged
+bed files.  The same seed always produces the same files.
+'''
+
+
+import numpy as np
+import os
+from typing import List, Dict
+
+
+def sample_names(samples: int) -> List[str]:
+    return [f'UV{i}' for i in range(samples)]
+
+
+def site_positions(sites: int,
+                   seed: int = 0,
+                   spacing: int = 50) -> np.ndarray:
+    '''
+    sorted, unique positions with an average spacing between sites
+    '''
+    rng = np.random.RandomState(seed)
+    return np.cumsum(rng.randint(1, 2 * spacing, sites)) + 10000
+
+
+def modern_vcf(sites: int,
+               samples: int,
+               chromosome: int = 1,
+               seed: int = 0,
+               multiallelic: float = 0.02,
+               missing: float = 0.01) -> str:
+    '''
+    Modern vcf text with phased GT fields for each sample.  A fraction of
+    sites are multiallelic or indels and a fraction of genotypes are ./.
+    '''
+    rng = np.random.RandomState(seed)
+    positions = site_positions(sites, seed)
+    bases = np.array(list('ACGT'))
+    refs = rng.randint(0, 4, sites)
+    alts = bases[(refs + rng.randint(1, 4, sites)) % 4].astype(object)
+    refs = bases[refs]
+    noisy = rng.rand(sites) < multiallelic
+    alts[noisy] = alts[noisy] + ',T'
+
+    genotypes = np.array(['0|0', '0|1', '1|0', '1|1', './.'])
+    codes = rng.randint(0, 4, (sites, samples))
+    codes[rng.rand(sites, samples) < missing] = 4
+    calls = genotypes[codes]
+
+    lines = ['##fileformat=VCFv4.1\n',
+             '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' +
+             '\t'.join(sample_names(samples)) + '\n']
+    for i in range(sites):
+        lines.append(f'{chromosome}\t{positions[i]}\t.\t{refs[i]}\t'
+                     f'{alts[i]}\t.\tPASS\t.\tGT\t' +
+                     '\t'.join(calls[i]) + '\n')
+    return ''.join(lines)
+
+
+def archaic_vcf(sites: int,
+                chromosome: int = 1,
+                seed: int = 0,
+                coverage: float = 0.7,
+                canc: float = 0.9) -> str:
+    '''
+    Archaic vcf text for a single individual, covering a fraction of the
+    modern sites generated with the same seed.  A fraction of sites have a
+    CAnc INFO field, matching the ref, alt or neither allele.
+    '''
+    modern_rng = np.random.RandomState(seed)
+    positions = site_positions(sites, seed)
+    bases = np.array(list('ACGT'))
+    refs = modern_rng.randint(0, 4, sites)
+    alts = bases[(refs + modern_rng.randint(1, 4, sites)) % 4]
+    refs = bases[refs]
+
+    rng = np.random.RandomState(seed + 1)
+    covered = rng.rand(sites) < coverage
+    has_canc = rng.rand(sites) < canc
+    ancestral = np.where(rng.rand(sites) < 0.5, refs,
+                         np.where(rng.rand(sites) < 0.8, alts, 'N'))
+    genotypes = np.array(['0/0', '0/1', '1/1', './.'])[
+        rng.choice(4, sites, p=[0.5, 0.2, 0.25, 0.05])]
+
+    lines = ['##fileformat=VCFv4.1\n',
+             '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'
+             'Altai\n']
+    for i in np.flatnonzero(covered):
+        info = f'AC=1;CAnc={ancestral[i]};GAnc=N' if has_canc[i] \
+            else 'AC=1'
+        lines.append(f'{chromosome}\t{positions[i]}\t.\t{refs[i]}\t'
+                     f'{alts[i]}\t.\t.\t{info}\tGT:DP\t{genotypes[i]}:10\n')
+    return ''.join(lines)
+
+
+def bed_regions(regions: int,
+                positions: np.ndarray,
+                chromosome: int = 1,
+                seed: int = 0,
+                length: int = 5000) -> str:
+    '''
+    Merged bed text of sorted, non overlapping regions spanning the
+    provided site positions
+    '''
+    rng = np.random.RandomState(seed)
+    starts = np.sort(rng.randint(positions[0], positions[-1], regions))
+    ends = starts + rng.randint(1, length, regions)
+    # merge overlaps to mimic bedtools merge output
+    ends = np.maximum.accumulate(ends)
+    keep = np.concatenate(([True], starts[1:] > ends[:-1]))
+    group = np.cumsum(keep) - 1
+    merged_ends = np.zeros(keep.sum(), dtype=ends.dtype)
+    np.maximum.at(merged_ends, group, ends)
+    return ''.join(f'{chromosome}\t{start}\t{end}\n'
+                   for start, end in zip(starts[keep], merged_ends))
+
+
+def write_dataset(directory: str,
+                  sites: int,
+                  samples: int,
+                  regions: int,
+                  seed: int = 0) -> Dict[str, object]:
+    '''
+    Write a modern vcf, archaic vcf and one bed per haplotype of each sample
+    to directory, returning the paths.  The bed filenames follow the
+    <individual>.<population>.<name>_hap<haplotype>.bed pattern.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    paths = {'modern': os.path.join(directory, 'modern.vcf'),
+             'archaic': os.path.join(directory, 'archaic.vcf'),
+             'beds': []}
+    with open(paths['modern'], 'w') as writer:
+        writer.write(modern_vcf(sites, samples, seed=seed))
+    with open(paths['archaic'], 'w') as writer:
+        writer.write(archaic_vcf(sites, seed=seed))
+    positions = site_positions(sites, seed)
+    for i, name in enumerate(sample_names(samples)):
+        for haplotype in (1, 2):
+            path = os.path.join(directory,
+                                f'{name}.PNG.calls_hap{haplotype}.bed')
+            with open(path, 'w') as writer:
+                writer.write(bed_regions(regions, positions,
+                                         seed=seed + 2 * i + haplotype))
+            paths['beds'].append(path)
+    return paths
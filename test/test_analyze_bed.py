@@ -1,6 +1,10 @@
-from bed_vcf_match import analyze_bed
+from bed_vcf_match import analyze_bed, output_pool
+import os
+import pytest
 from io import StringIO
 import pandas as pd
+import numpy as np
+from numpy.testing import assert_array_equal as aae
 from pandas.util.testing import assert_frame_equal
 
 
@@ -17,6 +21,19 @@ def test_read_bed():
         assert list(line.values[0]) == expected[i]
 
 
+def test_summarize_region_header():
+    expected = ('chrom\tstart\tend\ttotal_sites\tmodern_variants\t'
+                'joined_modern_variants\tarchaic_variants\tmatch_variants\n')
+    assert analyze_bed.summarize_region_header() == expected
+    assert analyze_bed.summarize_region_header(['altai']) == expected
+    assert analyze_bed.summarize_region_header(['altai', 'den']) == (
+        'chrom\tstart\tend\ttotal_sites\tmodern_variants\t'
+        'joined_modern_variants_altai\tarchaic_variants_altai\t'
+        'match_variants_altai\t'
+        'joined_modern_variants_den\tarchaic_variants_den\t'
+        'match_variants_den\n')
+
+
 def test_filter_modern_db():
     modern = StringIO(
         'chrom,pos,ref,alt,UV1,UV2\n'
@@ -67,6 +84,40 @@ def test_filter_modern_db():
     assert len(rows) == 0
 
 
+def test_site_index():
+    modern = StringIO(
+        'chrom,pos,ref,alt,UV1,UV2\n'
+        '1,110,C,G,nan,1|1\n'
+        '2,200,C,G,1|1,nan\n'
+        '1,100,A,T,0|1,0|0\n'
+        '1,105,A,T,nan,1|0\n'
+    )
+    database = pd.read_csv(modern)
+    index = analyze_bed.site_index(database, 1)
+    assert len(index) == 3
+    assert list(index.positions) == [100, 105, 110]
+    assert index.bounds(99, 110) == slice(0, 3)
+    assert index.bounds(100, 109) == slice(1, 2)
+    assert index.bounds(110, 200) == slice(3, 3)
+    assert list(index.query(99, 105).pos) == [100, 105]
+
+    # filtering matches the unsorted dataframe
+    for args in [(1, 99, 110, 1, 'UV2'),
+                 (1, 100, 110, 2, 'UV2'),
+                 (1, 99, 110, 1, 'UV1'),
+                 (2, 199, 210, 1, 'UV1')]:
+        expected = analyze_bed.filter_modern_db(database, *args)
+        rows = analyze_bed.filter_modern_db(
+            analyze_bed.site_index(database, args[0]), *args)
+        assert list(rows['pos']) == sorted(expected['pos'])
+        assert list(rows['variant']) == \
+            list(expected.sort_values('pos')['variant'])
+
+    # other chromosome
+    rows = analyze_bed.filter_modern_db(index, 2, 199, 210, 1, 'UV1')
+    assert len(rows) == 0
+
+
 def test_join_vcfs():
     modern = StringIO(
         'chrom,pos,individual,haplotype,variant,ref,alt\n'
@@ -232,3 +283,266 @@ def test_summarize_region():
     summary = analyze_bed.summarize_region([1, 99, 120], 1, 'UV2',
                                            modern, archaic1, archaic2)
     assert summary == '1\t99\t120\t5\t4\t4\t0.0\t0.0\t4\t1.5\t1.0\n'
+
+
+def test_summarize_regions():
+    modern = StringIO(
+        'chrom,pos,ref,alt,UV1,UV2\n'
+        '1,100,A,T,0|1,0|0\n'
+        '1,105,A,T,nan,1|0\n'
+        '1,110,C,G,./.,1|1\n'
+        '1,115,A,T,1|1,1|0\n'
+        '1,120,C,G,nan,1|1\n'
+        '2,100,C,G,nan,1|1\n'
+    )
+    modern = pd.read_csv(modern)
+    # import_vcf stores ./. as 0
+    modern.loc[modern.UV1 == './.', 'UV1'] = 0
+
+    archaic1 = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,variant\n'
+        '1,100,A,T,1\n'
+        '1,105,A,T,2\n'
+        '1,110,C,G,0\n'
+        '1,115,A,G,2\n'
+    ))
+    archaic2 = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,variant,CAnc\n'
+        '1,100,A,T,1,T\n'
+        '1,105,A,T,2,A\n'
+        '1,110,C,G,0,G\n'
+        '1,115,A,T,2,C\n'
+        '1,120,C,G,1,G\n'
+    ))
+
+    regions = [(99, 120), (100, 110), (104, 105), (120, 130), (0, 99),
+               (110, 100)]
+    starts = [r[0] for r in regions]
+    ends = [r[1] for r in regions]
+    for individual in ['UV1', 'UV2']:
+        for haplotype in [1, 2]:
+            for archaics in [[], [archaic1], [archaic2],
+                             [archaic1, archaic2]]:
+                expected = ''.join(
+                    analyze_bed.summarize_region(
+                        [1, start, end], haplotype, individual,
+                        modern, *archaics)
+                    for start, end in regions)
+                summary = analyze_bed.summarize_regions(
+                    1, starts, ends, haplotype, individual,
+                    modern, *archaics)
+                assert summary == expected
+
+    summary = analyze_bed.summarize_regions(
+        3, [99], [120], 1, 'UV2', modern, archaic1)
+    assert summary == '3\t99\t120\t0\t0\t0\t0.0\t0.0\n'
+
+
+def test_archaic_sites():
+    modern = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,UV1\n'
+        '1,110,C,G,0|1\n'
+        '1,100,A,T,0|1\n'
+        '1,105,A,T,1|0\n'
+        '1,115,A,T,1|1\n'
+    ))
+    archaic = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,variant,CAnc\n'
+        '1,100,A,T,1,T\n'
+        '1,105,A,T,2,A\n'
+        '1,110,C,G,0,A\n'
+        '1,115,A,C,2,A\n'
+    ))
+    index = analyze_bed.site_index(modern, 1)
+    sites = analyze_bed.archaic_sites(index, archaic)
+    assert len(sites) == 4
+    # by reference and alternative allele of the haplotype
+    aae(sites.variants, [[1, 0], [0, 1], [0, 0], [0, 0]])
+    aae(sites.matches, [[1, 0], [0, 2], [0, 0], [0, 0]])
+    assert list(sites.matched) == [True, True, True, False]
+
+    sites = analyze_bed.archaic_sites(index, archaic.drop(columns='CAnc'))
+    aae(sites.variants, [[0, 1], [0, 1], [0, 1], [0, 1]])
+    aae(sites.matches, [[0, 1], [0, 2], [0, 0], [0, 0]])
+
+    # prejoined sites match joining each region
+    for archaic_vcf in [archaic, archaic.drop(columns='CAnc')]:
+        sites = analyze_bed.archaic_sites(index, archaic_vcf)
+        for start, end in [(99, 115), (100, 110), (0, 104)]:
+            assert analyze_bed.summarize_region(
+                [1, start, end], 2, 'UV1', index, sites) == \
+                analyze_bed.summarize_region(
+                    [1, start, end], 2, 'UV1', modern, archaic_vcf)
+
+
+def test_duplicate_archaic_sites():
+    modern = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,UV1\n'
+        '1,100,A,T,0|1\n'
+        '1,105,A,T,1|0\n'
+        '1,110,C,G,1|1\n'
+        '1,115,A,T,0|0\n'
+    ))
+    archaic = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,variant,CAnc\n'
+        '1,100,A,T,1,T\n'
+        '1,100,A,T,2,A\n'
+        '1,105,A,T,2,A\n'
+        '1,105,A,T,2,A\n'
+        '1,105,A,T,1,A\n'
+        '1,110,C,G,1,G\n'
+        '1,110,C,G,1,A\n'
+    ))
+    index = analyze_bed.site_index(modern, 1)
+    # as join_vcf, a site is counted once for each archaic row it matches
+    for archaic_vcf in [archaic, archaic.drop(columns='CAnc')]:
+        sites = analyze_bed.archaic_sites(index, archaic_vcf)
+        for haplotype in (1, 2):
+            for start, end in [(99, 115), (99, 100), (100, 110)]:
+                expected = analyze_bed.summarize_region(
+                    [1, start, end], haplotype, 'UV1', modern, archaic_vcf)
+                assert analyze_bed.summarize_region(
+                    [1, start, end], haplotype, 'UV1', index, sites) == \
+                    expected
+    assert analyze_bed.summarize_region(
+        [1, 99, 115], 2, 'UV1', index,
+        analyze_bed.archaic_sites(index, archaic.drop(columns='CAnc'))) == \
+        '1\t99\t115\t4\t2\t4\t5.0\t2.5\n'
+
+
+def test_summarize_beds(tmp_path):
+    modern = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,UV1,UV2\n'
+        '1,100,A,T,0|1,0|0\n'
+        '1,105,A,T,nan,1|0\n'
+        '1,110,C,G,1|0,1|1\n'
+        '1,115,A,T,1|1,1|0\n'
+        '2,100,C,G,0|1,1|1\n'
+    ))
+    archaic = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,variant,CAnc\n'
+        '1,100,A,T,1,T\n'
+        '1,105,A,T,2,A\n'
+        '1,115,A,T,2,A\n'
+    ))
+    beds = []
+    for name in ['UV1.PNG.x_hap1.bed', 'UV2.PNG.x_hap2.bed',
+                 'UV1.PNG.x_hap2.bed']:
+        bed_file = tmp_path / name
+        bed_file.write_text('1\t99\t120\n'
+                            '1\t104\t110\n'
+                            '2\t0\t200\n')
+        beds.append(analyze_bed.bed_structure(str(bed_file)))
+    bed_file = tmp_path / 'UV2.PNG.x_hap1.bed'
+    bed_file.write_text('2\t0\t200\n')
+    beds.append(analyze_bed.bed_structure(str(bed_file)))
+
+    index = analyze_bed.site_index(modern, 1)
+    sites = analyze_bed.archaic_sites(index, archaic)
+    results = analyze_bed.summarize_beds(1, beds, index, sites)
+    for bed, result in zip(beds, results):
+        starts, ends = bed.regions(1)
+        assert result == analyze_bed.summarize_regions(
+            1, starts, ends, bed.haplotype, bed.individual,
+            modern, archaic)
+    assert results[3] == ''
+    assert results[0] == ('1\t99\t120\t3\t2\t2\t1.5\t1.5\n'
+                          '1\t104\t110\t1\t1\t0\t0.0\t0.0\n')
+
+    # output is written through the pool on close, after the header
+    for bed, result in zip(beds, results):
+        bed.write(result)
+    assert not os.path.exists(beds[0].outfile)
+    for bed in beds:
+        bed.close()
+    with open(beds[0].outfile) as reader:
+        assert reader.read() == beds[0].header + results[0]
+    with open(beds[3].outfile) as reader:
+        assert reader.read() == beds[3].header
+
+
+def test_individual_sites():
+    genotypes = np.array([[0, 1], [1, 1], [-1, -1], [1, 0]])
+    sites = analyze_bed.individual_sites(
+        genotypes,
+        [(np.array([[0, 1], [1, 0], [0, 1], [0, 0]]),
+          np.array([[0, 2], [1, 0], [0, 2], [0, 0]]))])
+    lower = np.array([0, 1])
+    upper = np.array([4, 2])
+    columns = sites.columns(1, lower, upper)
+    aae(columns, [[3, 1], [2, 1], [0, 0], [3, 1], [0, 0]])
+    columns = sites.columns(2, lower, upper)
+    aae(columns, [[3, 1], [2, 1], [1, 0], [3, 1], [2, 0]])
+    # shared sums are computed once
+    assert sorted(sites.totals) == ['archaic_0', 'derived1_0', 'derived2_0',
+                                    'match1_0', 'match2_0', 'sites',
+                                    'variant1', 'variant2']
+
+
+def test_read_regions():
+    bed = analyze_bed.read_regions(b'1\t5\t6\n\n2 3 4\r\n1\t0\t1')
+    assert list(bed) == ['1', '2']
+    aae(bed['1'], [[5, 6], [0, 1]])
+    aae(bed['2'], [[3, 4]])
+    assert analyze_bed.read_regions(b'') == {}
+    assert analyze_bed.read_regions(b'\n\n') == {}
+
+    for data in [b'1 2 3 4\n1 2\n', b'1 2\n', b'1 2 3\n1 2 3 4 5 6\n']:
+        with pytest.raises(ValueError, match='Expected 3 fields on line'):
+            analyze_bed.read_regions(data)
+    with pytest.raises(ValueError, match='Unable to parse'):
+        analyze_bed.read_regions(b'1 2 3\n1 a 3\n')
+
+
+def test_check_regions():
+    def check(**regions):
+        return analyze_bed.check_regions(
+            {name: np.array(r).reshape(-1, 2) for name, r in regions.items()})
+
+    assert check() == (True, False)
+    # touching regions do not overlap
+    assert check(a=[[0, 5], [5, 10]], b=[[0, 10]]) == (True, False)
+    # regions of different chromosomes do not overlap
+    assert check(a=[[0, 10]], b=[[5, 10]]) == (True, False)
+    assert check(a=[[5, 10], [0, 5]]) == (False, False)
+    assert check(a=[[0, 10], [2, 3], [9, 12]]) == (True, True)
+    assert check(a=[[9, 12], [0, 10]], b=[]) == (False, True)
+
+
+def test_load_beds(tmp_path):
+    filenames = []
+    for i, text in enumerate(['1\t10\t20\n2\t0\t5\n1\t0\t10\n',
+                              '1\t0\t10\n1\t5\t20\n',
+                              '3\t0\t1\n']):
+        filename = tmp_path / f'UV{i}.PNG.x_hap1.bed'
+        filename.write_text(text)
+        filenames.append(str(filename))
+        with open(filename) as reader:
+            assert {c: [tuple(r) for r in regions]
+                    for c, regions in analyze_bed.read_regions(
+                        text.encode()).items()} == \
+                analyze_bed.structure_bed(reader)
+
+    pool = output_pool.output_pool()
+    serial = analyze_bed.load_beds(filenames, pool=pool)
+    beds = analyze_bed.load_beds(filenames, pool=pool, threads=2)
+    for bed, expected in zip(beds, serial):
+        assert bed.pool is pool
+        assert bed.outfile == expected.outfile
+        assert list(bed.bed) == list(expected.bed)
+        for chrom in expected.bed:
+            aae(bed.bed[chrom], expected.bed[chrom])
+
+    assert [(b.sorted, b.overlapping) for b in beds] == \
+        [(False, False), (True, True), (True, False)]
+    starts, ends, order = beds[0].sorted_regions(1)
+    aae(starts, [0, 10])
+    aae(ends, [10, 20])
+    aae(order, [1, 0])
+    starts, ends, order = beds[1].sorted_regions(2)
+    assert len(starts) == len(ends) == len(order) == 0
+
+    bad = tmp_path / 'UV3.PNG.x_hap1.bed'
+    bad.write_text('1\t0\t10\n1\t5\n')
+    with pytest.raises(ValueError, match='UV3.*line 2'):
+        analyze_bed.load_beds([str(bad)])
@@ -1,15 +1,42 @@
 import bed2vcf as main
+from benchmark import generate
+from bed_vcf_match import analyze_bed, query_server
+from io import StringIO
+from unittest import mock
+import os
+import pandas as pd
+import pytest
+import threading
 
 
 def arg_helper(args, nondefault={}):
     defaults = {
         'archaic_vcfs': [],
+        'archaic_labels': None,
         'modern_vcfs': [],
         'bed_files': None,
         'output_dir': None,
         'vcf_output': False,
         'bed_output': False,
         'canc_correction': False,
+        'cache_dir': None,
+        'no_cache': False,
+        'rebuild_cache': False,
+        'decompress_threads': 1,
+        'use_index': False,
+        'sites_bed': None,
+        'sites_merge': None,
+        'individuals_file': None,
+        'stream': False,
+        'workers': 1,
+        'bed_threads': 1,
+        'max_open_files': 64,
+        'chromosomes': None,
+        'individuals': None,
+        'checkpoint_dir': None,
+        'incremental': False,
+        'profile': None,
+        'profile_stats': None,
     }
     for k, v in nondefault.items():
         defaults[k] = v
@@ -18,6 +45,126 @@ def arg_helper(args, nondefault={}):
         assert v == defaults[k]
 
 
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    '''
+    Generated vcfs of every chromosome and beds of each haplotype, with the
+    outputs of a serial run
+    '''
+    directory = tmp_path_factory.mktemp('dataset')
+    sites = 40
+    beds = {}
+    for chrm in main.CHROMOSOMES:
+        with open(directory / f'chr{chrm}.vcf', 'w') as writer:
+            writer.write(generate.modern_vcf(sites, 2, chrm, seed=chrm))
+        with open(directory / f'arch{chrm}.vcf', 'w') as writer:
+            writer.write(generate.archaic_vcf(sites, chrm, seed=chrm))
+        positions = generate.site_positions(sites, chrm)
+        for i, name in enumerate(generate.sample_names(2)):
+            for haplotype in (1, 2):
+                bed_file = str(directory /
+                               f'{name}.PNG.calls_hap{haplotype}.bed')
+                beds[bed_file] = beds.get(bed_file, '') + \
+                    generate.bed_regions(3, positions, chrm,
+                                         seed=chrm + 2 * i + haplotype)
+    for bed_file, regions in beds.items():
+        with open(bed_file, 'w') as writer:
+            writer.write(regions)
+
+    args = ['--bed_files', *beds,
+            '--modern_vcfs', str(directory / 'chr{chr}.vcf'),
+            '--archaic_vcfs', str(directory / 'arch{chr}.vcf'),
+            '--no_cache']
+    expected = run_main(args, directory / 'serial')
+    return directory, args, expected
+
+
+def run_main(args, output_dir, *options):
+    '''
+    Run bed2vcf with the arguments, returning the outputs by filename
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    with mock.patch('sys.argv', ['bed2vcf.py', *args,
+                                 '--output_dir', str(output_dir),
+                                 *options]):
+        main.main()
+    return read_outputs(output_dir)
+
+
+def read_outputs(output_dir):
+    outputs = {}
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.endswith('.matched'):
+            with open(os.path.join(output_dir, filename), 'rb') as reader:
+                outputs[filename] = reader.read()
+    return outputs
+
+
+@pytest.mark.parametrize('options', [
+    ['--workers', '2'],
+    ['--stream'],
+    ['--incremental'],
+])
+def test_main(dataset, tmp_path, options):
+    _, args, expected = dataset
+    assert len(expected) == 4
+    assert all(output.count(b'\n') > 22 for output in expected.values())
+    assert run_main(args, tmp_path, *options) == expected
+
+
+def test_main_resume(dataset, tmp_path, capsys):
+    directory, args, expected = dataset
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    options = ['--workers', '2', '--checkpoint_dir', checkpoint_dir]
+
+    # interrupt the run with an invalid vcf
+    modern_vcf = directory / 'chr5.vcf'
+    original = modern_vcf.read_text()
+    modern_vcf.write_text(original + '5\t1\n')
+    try:
+        with pytest.raises(ValueError):
+            run_main(args, tmp_path / 'out', *options)
+    finally:
+        modern_vcf.write_text(original)
+
+    # every other chromosome is resumed
+    capsys.readouterr()
+    assert run_main(args, tmp_path / 'out', *options) == expected
+    assert 'resuming with 21 completed chromosomes' in \
+        capsys.readouterr().out
+
+
+def test_main_incremental(dataset, tmp_path, capsys):
+    directory, args, expected = dataset
+    output_dir = tmp_path / 'out'
+    assert run_main(args, output_dir, '--incremental') == expected
+
+    def mtimes():
+        return {filename: os.stat(output_dir / filename).st_mtime_ns
+                for filename in read_outputs(output_dir)}
+
+    written = mtimes()
+    capsys.readouterr()
+    assert run_main(args, output_dir, '--incremental') == expected
+    assert 'found 4 outputs up to date' in capsys.readouterr().out
+    assert mtimes() == written
+
+    # only the output of the changed bed is written
+    bed_file = directory / 'UV1.PNG.calls_hap2.bed'
+    original = bed_file.read_text()
+    bed_file.write_text(original + '1\t10000\t20000\n')
+    try:
+        outputs = run_main(args, output_dir, '--incremental')
+        assert 'found 3 outputs up to date' in capsys.readouterr().out
+        assert [filename for filename, mtime in mtimes().items()
+                if mtime != written[filename]] == \
+            ['UV1.PNG.calls_hap2.bed.matched']
+        assert outputs == run_main(args, tmp_path / 'serial')
+    finally:
+        bed_file.write_text(original)
+    assert outputs != expected
+
+
 def test_read_args():
     # test defaults
     args = main.read_args([])
@@ -35,6 +182,30 @@ def test_read_args():
     args = main.read_args('--vcf_output'.split())
     arg_helper(args.__dict__, {'vcf_output': True})
 
+    args = main.read_args('--cache_dir test --no_cache'.split())
+    arg_helper(args.__dict__, {'cache_dir': 'test', 'no_cache': True})
+
+    args = main.read_args('--rebuild_cache'.split())
+    arg_helper(args.__dict__, {'rebuild_cache': True})
+
+    args = main.read_args('--decompress_threads 4'.split())
+    arg_helper(args.__dict__, {'decompress_threads': 4})
+
+    args = main.read_args('--use_index'.split())
+    arg_helper(args.__dict__, {'use_index': True})
+
+    args = main.read_args('--sites_bed test.bed --sites_merge 10 '
+                          '--individuals_file test.txt'.split())
+    arg_helper(args.__dict__, {'sites_bed': 'test.bed',
+                               'sites_merge': 10,
+                               'individuals_file': 'test.txt'})
+
+    args = main.read_args('--stream'.split())
+    arg_helper(args.__dict__, {'stream': True})
+
+    args = main.read_args('--workers 4'.split())
+    arg_helper(args.__dict__, {'workers': 4})
+
     # vcfs and bed files
     arg_name = ['bed_files', 'modern_vcfs', 'archaic_vcfs']
     arg_values = ['file1', 'file2 file3']
@@ -50,3 +221,181 @@ def test_read_args():
         args = main.read_args(
             f'--{l} {arg_values[0]} --{l} {arg_values[1]}'.split())
         arg_helper(args.__dict__, {l: ' '.join(arg_values).split()})
+
+
+def test_archaic_labels():
+    args = main.read_args(
+        '--archaic_vcfs dir/chr{chr}.altai_neand.vcf.gz '
+        'dir/chr{chr}.den_filtered.vcf.gz'.split())
+    assert main.archaic_labels(args) == ['altai_neand', 'den_filtered']
+
+    args = main.read_args(
+        '--archaic_vcfs chr{chr}.vcf.gz other/chr{chr}.vcf.gz'.split())
+    assert main.archaic_labels(args) == ['archaic1', 'archaic2']
+
+    args = main.read_args(
+        '--archaic_vcfs a{chr}.vcf b{chr}.vcf '
+        '--archaic_labels altai denisova'.split())
+    arg_helper(args.__dict__,
+               {'archaic_vcfs': ['a{chr}.vcf', 'b{chr}.vcf'],
+                'archaic_labels': ['altai', 'denisova']})
+    assert main.archaic_labels(args) == ['altai', 'denisova']
+
+    args = main.read_args(
+        '--archaic_vcfs a{chr}.vcf b{chr}.vcf '
+        '--archaic_labels altai'.split())
+    with pytest.raises(ValueError):
+        main.archaic_labels(args)
+
+
+def test_shards():
+    args = main.read_args(
+        '--bed_files d/UV1.PNG.x_hap1.bed d/UV1.PNG.x_hap2.bed '
+        'd/UV2.PNG.x_hap1.bed --chromosomes 3 1 3'.split())
+    arg_helper(args.__dict__,
+               {'bed_files': ['d/UV1.PNG.x_hap1.bed', 'd/UV1.PNG.x_hap2.bed',
+                              'd/UV2.PNG.x_hap1.bed'],
+                'chromosomes': [3, 1, 3]})
+    assert main.shard_chromosomes(args) == [1, 3]
+    assert main.shard_beds(args) == args.bed_files
+
+    args = main.read_args('--bed_files d/UV1.PNG.x_hap1.bed '
+                          'd/UV2.PNG.x_hap1.bed --individuals UV2'.split())
+    assert main.shard_chromosomes(args) == list(range(1, 23))
+    assert main.shard_beds(args) == ['d/UV2.PNG.x_hap1.bed']
+
+    args.individuals = ['UV3']
+    with pytest.raises(ValueError) as e:
+        main.shard_beds(args)
+    assert 'UV3 not in bed files!' in str(e)
+
+    args.chromosomes = [23]
+    with pytest.raises(ValueError) as e:
+        main.shard_chromosomes(args)
+    assert 'Unexpected chromosome 23' in str(e)
+
+
+def test_merge_shards(tmp_path):
+    bed_files = [str(tmp_path / f'UV{i}.PNG.x_hap1.bed') for i in range(2)]
+    args = main.read_merge_args(['--bed_files', *bed_files])
+    assert args.bed_files == bed_files
+    assert args.output_dir is None
+
+    class bed():
+        header = 'chrom\tstart\n'
+
+    for i, bed_file in enumerate(bed_files):
+        bed.outfile = bed_file + '.matched'
+        for chrm in range(1, 22):
+            main.write_chromosome([bed], [f'{chrm}\t{i}\n'], chrm, True)
+
+    with pytest.raises(ValueError) as e:
+        main.merge_shards(args)
+    assert 'Missing 2 partial outputs' in str(e)
+    assert 'UV1.PNG.x_hap1.bed.matched.chr22.part' in str(e)
+
+    for i, bed_file in enumerate(bed_files):
+        bed.outfile = bed_file + '.matched'
+        main.write_chromosome([bed], [''], 22, True)
+    main.merge_shards(args)
+    for i, bed_file in enumerate(bed_files):
+        with open(bed_file + '.matched') as reader:
+            assert reader.read() == 'chrom\tstart\n' + ''.join(
+                f'{chrm}\t{i}\n' for chrm in range(1, 22))
+
+    with open(main.part_filename(bed_files[1] + '.matched', 5), 'w') as out:
+        out.write('chrom\tend\n')
+    with pytest.raises(ValueError) as e:
+        main.merge_shards(args)
+    assert 'does not match the header of chromosome 1' in str(e)
+    assert [f for f in tmp_path.iterdir() if f.suffix == '.tmp'] == []
+
+
+def test_serve_args():
+    args = main.read_serve_args(
+        '--modern_vcfs chr{chr}.vcf --port 0 --chromosomes 1'.split())
+    arg_helper({k: v for k, v in args.__dict__.items()
+                if k not in ('host', 'port', 'verbose')},
+               {'modern_vcfs': ['chr{chr}.vcf'], 'chromosomes': [1]})
+    assert (args.host, args.port, args.verbose) == ('127.0.0.1', 0, False)
+
+    args = main.read_query_args(
+        '--bed_files a.bed b.bed --regions r.bed --haplotypes 2'.split())
+    assert args.bed_files == ['a.bed', 'b.bed']
+    assert args.regions == 'r.bed'
+    assert args.haplotypes == [2]
+    assert args.individuals is None
+    assert args.port == main.DEFAULT_PORT
+    assert not args.shutdown
+    with pytest.raises(SystemExit):
+        main.read_query_args('--haplotypes 3'.split())
+
+
+def test_output_fingerprints(tmp_path):
+    bed_files = [str(tmp_path / f'UV{i}.PNG.x_hap1.bed') for i in range(2)]
+    for bed_file in bed_files:
+        with open(bed_file, 'w') as writer:
+            writer.write('1\t0\t10\n')
+    args = main.read_args(['--bed_files', *bed_files,
+                           '--modern_vcfs', str(tmp_path / 'chr{chr}.vcf'),
+                           '--incremental'])
+    fingerprints = main.output_fingerprints(args)
+    assert list(fingerprints) == bed_files
+    assert fingerprints[bed_files[0]] != fingerprints[bed_files[1]]
+    # unchanged by the output directory or other bed files
+    args.output_dir = str(tmp_path / 'out')
+    args.bed_files = bed_files[:1]
+    assert main.output_fingerprints(args) == {
+        bed_files[0]: fingerprints[bed_files[0]]}
+
+    # changed by options and vcfs
+    args.canc_correction = True
+    assert main.output_fingerprints(args)[bed_files[0]] != \
+        fingerprints[bed_files[0]]
+    args.canc_correction = False
+    with open(tmp_path / 'chr5.vcf', 'w') as writer:
+        writer.write('vcf')
+    assert main.output_fingerprints(args)[bed_files[0]] != \
+        fingerprints[bed_files[0]]
+
+    manifests = main.output_manifests(args)
+    assert list(manifests) == [args.output_dir]
+    os.makedirs(args.output_dir)
+    outfile = os.path.join(args.output_dir, 'UV0.PNG.x_hap1.bed.matched')
+    with open(outfile, 'w') as writer:
+        writer.write('output')
+    fingerprints = main.output_fingerprints(args)
+    main.record_outputs(args, fingerprints, manifests)
+    manifest = main.output_manifest(args.output_dir)
+    assert manifest.current(outfile, fingerprints[bed_files[0]])
+
+
+def test_query_databases(tmp_path):
+    modern = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,UV1\n'
+        '1,100,A,T,0|1\n'
+        '1,110,C,G,1|0\n'
+        '2,100,C,G,0|1\n'
+    ))
+    db = query_server.resident_db()
+    db.add(analyze_bed.site_index(modern, 1), [])
+    server = query_server.query_server(db, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    host, port = server.server_address[:2]
+
+    # regions of chromosomes the server has not loaded are skipped
+    bed_file = str(tmp_path / 'UV1.PNG.x_hap2.bed')
+    with open(bed_file, 'w') as writer:
+        writer.write('1\t99\t110\n2\t0\t200\n1\t0\t100\n')
+    try:
+        main.query_databases(main.read_query_args(
+            ['--host', host, '--port', str(port), '--bed_files', bed_file]))
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    with open(bed_file + '.matched') as reader:
+        assert reader.read() == analyze_bed.summarize_region_header() + \
+            db.summarize('UV1', 2, [(1, 99, 110), (1, 0, 100)])
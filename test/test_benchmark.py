@@ -0,0 +1,56 @@
+from benchmark import generate
+from benchmark.__main__ import run_wide, check_memory
+from bed_vcf_match import read_vcf, analyze_bed
+from io import StringIO
+import numpy as np
+
+
+def test_generators_deterministic():
+    assert generate.modern_vcf(50, 3, seed=2) == \
+        generate.modern_vcf(50, 3, seed=2)
+    assert generate.modern_vcf(50, 3, seed=2) != \
+        generate.modern_vcf(50, 3, seed=3)
+    assert generate.archaic_vcf(50, seed=2) == \
+        generate.archaic_vcf(50, seed=2)
+
+
+def test_generators_parse():
+    modern = read_vcf.import_genotypes(
+        StringIO(generate.modern_vcf(200, 4, multiallelic=0.1)),
+        check_phasing=True)
+    assert modern.individuals == ['UV0', 'UV1', 'UV2', 'UV3']
+    assert 150 < len(modern) < 200  # multiallelic sites are removed
+    assert np.all(np.diff(modern.pos) > 0)
+
+    archaic = read_vcf.import_archaic_vcf(
+        StringIO(generate.archaic_vcf(200)), include_canc=True)
+    # archaic sites are a subset of modern sites with the same alleles
+    index = analyze_bed.site_index(modern, 1)
+    sites = analyze_bed.archaic_sites(index, archaic)
+    assert sites.matched.sum() > 50
+
+    bed = generate.bed_regions(20, modern.pos)
+    regions = np.array([line.split('\t')[1:] for line in bed.split('\n')
+                        if line], dtype=int)
+    assert np.all(regions[:, 0] < regions[:, 1])
+    assert np.all(regions[1:, 0] > regions[:-1, 1])
+
+
+def test_write_dataset(tmp_path):
+    paths = generate.write_dataset(str(tmp_path), 100, 2, 5)
+    assert len(paths['beds']) == 4
+    bed = analyze_bed.bed_structure(paths['beds'][3])
+    assert bed.individual == 'UV1'
+    assert bed.haplotype == 2
+    bed.close()
+
+
+def test_wide_memory(tmp_path):
+    results = run_wide(str(tmp_path), 1500, 2500, 100, 1)
+    # the vcf is read in several chunks
+    assert results[0]['vcf_bytes'] > 3 * read_vcf.CHUNK_BYTES
+    assert [result['stage'] for result in results] == \
+        ['import_genotypes_wide', 'read_csv_wide']
+    assert check_memory(results) == []
+    results[0]['memory_ratio'] = 20
+    assert len(check_memory(results)) == 1
@@ -0,0 +1,74 @@
+from bed_vcf_match import bgzf, read_vcf
+from io import BytesIO
+import gzip
+import pytest
+
+
+def make_data(lines=20000):
+    return ''.join(f'1\t{i}\t.\tA\tT\t.\t.\t.\tGT\t0|1\t1|1\n'
+                   for i in range(lines)).encode()
+
+
+def test_write_read_blocks(tmp_path):
+    data = make_data()
+    filename = str(tmp_path / 'test.vcf.gz')
+    bgzf.write_bgzf(filename, data)
+
+    assert bgzf.is_bgzf(filename)
+    # readable by gzip as concatenated members
+    with gzip.open(filename) as reader:
+        assert reader.read() == data
+
+    for threads in [1, 3]:
+        with open(filename, 'rb') as reader:
+            blocks = list(bgzf.iter_blocks(reader, threads))
+        assert len(blocks) == len(data) // bgzf.BLOCK_DATA_SIZE + 2
+        assert blocks[-1] == b''
+        assert b''.join(blocks) == data
+
+        with bgzf.open_bgzf(filename, threads) as reader:
+            assert reader.read() == data.decode()
+
+        with bgzf.open_bgzf(filename, threads) as reader:
+            assert list(reader) == data.decode().splitlines(True)
+
+
+def test_offset_blocks(tmp_path):
+    filename = str(tmp_path / 'test.vcf.gz')
+    bgzf.write_bgzf(filename, make_data(40000))
+    with open(filename, 'rb') as reader:
+        expected = list(bgzf.iter_offset_blocks(reader))
+    assert expected[0][0] == 0
+    for threads in [2, 3]:
+        # more blocks than are inflated ahead of the reader
+        assert len(expected) > 4 * threads
+        with open(filename, 'rb') as reader:
+            assert list(bgzf.iter_offset_blocks(reader, threads)) == \
+                expected
+
+
+def test_is_bgzf(tmp_path):
+    filename = str(tmp_path / 'test.vcf.gz')
+    with gzip.open(filename, 'wb') as writer:
+        writer.write(make_data(10))
+    assert not bgzf.is_bgzf(filename)
+
+    # plain gzip still opens through the gzip module
+    with read_vcf.open_vcf(filename, threads=4) as reader:
+        assert reader.read() == make_data(10).decode()
+
+    bgzf.write_bgzf(filename, make_data(10))
+    with read_vcf.open_vcf(filename, threads=4) as reader:
+        assert isinstance(reader.buffer.raw, bgzf.bgzf_reader)
+        assert reader.read() == make_data(10).decode()
+
+
+def test_read_block_errors():
+    block = bgzf.compress_block(b'test')
+    assert bgzf.inflate(bgzf.read_block(BytesIO(block))) == b'test'
+    assert bgzf.read_block(BytesIO(b'')) is None
+
+    with pytest.raises(ValueError):
+        bgzf.read_block(BytesIO(block[:-3]))
+    with pytest.raises(ValueError):
+        bgzf.read_block(BytesIO(b'\x1f\x8b\x08\x00' + block[4:]))
@@ -0,0 +1,76 @@
+from bed_vcf_match import checkpoint
+import json
+import os
+
+
+def test_checkpoint(tmp_path):
+    vcf = tmp_path / 'chr1.vcf'
+    vcf.write_text('vcf')
+    sources = checkpoint.file_sources([str(vcf)])
+    assert sources == [[str(vcf), 3, os.stat(vcf).st_mtime_ns]]
+
+    directory = str(tmp_path / 'checkpoint')
+    points = checkpoint.checkpoint(directory, 'run')
+    assert not points.done(1, sources)
+    points.save(1, ['a\n', 'b\n'], sources)
+    assert points.done(1, sources)
+    assert not points.done(2, sources)
+    assert sorted(os.listdir(directory)) == ['chr1.json', 'manifest.json']
+
+    # restarted run
+    points = checkpoint.checkpoint(directory, 'run')
+    assert points.done(1, sources)
+    assert points.load(1) == ['a\n', 'b\n']
+
+    # changed source
+    vcf.write_text('vcf2')
+    assert not points.done(1, checkpoint.file_sources([str(vcf)]))
+
+    # missing part
+    os.remove(os.path.join(directory, 'chr1.json'))
+    assert not points.done(1, sources)
+
+    # different run
+    points.save(1, ['a\n'], sources)
+    points = checkpoint.checkpoint(directory, 'other')
+    assert not points.done(1, sources)
+    points.save(2, ['c\n'], sources)
+    with open(os.path.join(directory, 'manifest.json')) as reader:
+        manifest = json.load(reader)
+    assert manifest['fingerprint'] == 'other'
+    assert list(manifest['chromosomes']) == ['2']
+
+
+def test_fingerprint(tmp_path):
+    bed = tmp_path / 'test.bed'
+    bed.write_text('1\t10\t20\n')
+    first = checkpoint.fingerprint({'canc': False}, [str(bed)])
+    assert first == checkpoint.fingerprint({'canc': False}, [str(bed)])
+    assert first != checkpoint.fingerprint({'canc': True}, [str(bed)])
+    bed.write_text('1\t10\t30\n')
+    assert first != checkpoint.fingerprint({'canc': False}, [str(bed)])
+    assert checkpoint.file_sources([str(tmp_path / 'missing')])[0][1:] == \
+        [None, None]
+
+
+def test_output_manifest(tmp_path):
+    outfile = str(tmp_path / 'UV1.bed.matched')
+    manifest = checkpoint.output_manifest(str(tmp_path))
+    assert not manifest.current(outfile, 'a')
+
+    with open(outfile, 'w') as writer:
+        writer.write('output')
+    manifest.record(outfile, 'a')
+    assert manifest.current(outfile, 'a')
+    assert not manifest.current(outfile, 'b')
+    manifest.save()
+
+    manifest = checkpoint.output_manifest(str(tmp_path))
+    assert manifest.current(outfile, 'a')
+    assert list(manifest.outputs) == ['UV1.bed.matched']
+
+    # modified or missing outputs are not current
+    os.utime(outfile, ns=(0, 0))
+    assert not manifest.current(outfile, 'a')
+    os.remove(outfile)
+    assert not manifest.current(outfile, 'a')
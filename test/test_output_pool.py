@@ -0,0 +1,43 @@
+from bed_vcf_match.output_pool import output_pool
+import pytest
+
+
+def test_output_pool(tmp_path):
+    pool = output_pool(max_open=2, buffer_size=10, max_buffered=20)
+    files = [str(tmp_path / f'out{i}') for i in range(4)]
+
+    pool.write(files[0], 'abc\n')
+    assert not (tmp_path / 'out0').exists()
+    pool.write(files[0], 'defghi\n')
+    # buffer full, created and written
+    assert (tmp_path / 'out0').exists()
+    assert pool.buffered == 0
+
+    for i in range(1, 4):
+        pool.write(files[i], f'{i}' * 8)
+    # all buffers flushed above max_buffered, through two handles
+    assert list(pool.handles) == files[2:]
+    assert pool.buffered == 0
+    # least recently used are closed
+    assert (tmp_path / 'out0').read_text() == 'abc\ndefghi\n'
+    assert (tmp_path / 'out1').read_text() == '1' * 8
+
+    pool.write(files[0], 'j\n')
+    pool.write(files[1], 'k\n')
+    pool.close(files[0])
+    assert (tmp_path / 'out0').read_text() == 'abc\ndefghi\nj\n'
+    assert (tmp_path / 'out1').read_text() == '1' * 8
+    pool.close()
+    for i in range(2, 4):
+        assert (tmp_path / f'out{i}').read_text() == f'{i}' * 8
+    assert (tmp_path / 'out1').read_text() == '1' * 8 + 'k\n'
+    assert len(pool.handles) == 0
+
+    # a new pool replaces existing files
+    pool = output_pool()
+    pool.write(files[0], 'new\n')
+    pool.close()
+    assert (tmp_path / 'out0').read_text() == 'new\n'
+
+    with pytest.raises(ValueError):
+        output_pool(max_open=0)
@@ -0,0 +1,83 @@
+from bed_vcf_match.profiler import profiler, reset_peak_rss
+import json
+import numpy as np
+import pstats
+import pytest
+
+
+def busy():
+    return sum(i * i for i in range(20000))
+
+
+def test_disabled():
+    profile = profiler()
+    with profile.stage('test', 1, sites=3) as counts:
+        counts['regions'] = 2
+    assert profile.records == []
+    assert profile.hottest() is None
+
+
+def test_stages(tmp_path):
+    profile = profiler(True)
+    for chromosome in [1, 2]:
+        with profile.stage('read', chromosome, sites=3) as counts:
+            counts['regions'] = chromosome
+        with profile.stage('busy', chromosome):
+            busy()
+
+    assert [r['stage'] for r in profile.records] == \
+        ['read', 'busy', 'read', 'busy']
+    assert profile.records[2]['chromosome'] == 2
+    assert profile.records[2]['counts'] == {'sites': 3, 'regions': 2}
+    assert profile.records[1]['peak_rss_mb'] > 0
+
+    totals = profile.totals()
+    assert totals['read']['runs'] == 2
+    assert totals['read']['counts'] == {'sites': 6, 'regions': 3}
+    assert profile.hottest() == 'busy'
+
+    filename = str(tmp_path / 'report.json')
+    profile.report(filename)
+    with open(filename) as reader:
+        report = json.load(reader)
+    assert report['hottest'] == 'busy'
+    assert len(report['stages']) == 4
+    assert report['totals']['busy']['runs'] == 2
+
+
+def test_stage_peak_rss():
+    if not reset_peak_rss():
+        pytest.skip('peak memory can not be reset')
+    profile = profiler(True)
+    with profile.stage('large'):
+        np.ones(1 << 25).sum()  # 256 MiB
+    with profile.stage('small'):
+        busy()
+    large, small = profile.records
+    assert large['peak_rss_mb'] - small['peak_rss_mb'] > 200
+    assert small['process_peak_rss_mb'] == large['process_peak_rss_mb'] \
+        >= large['peak_rss_mb']
+    assert profile.peak_rss() >= large['peak_rss_mb']
+    assert profile.totals()['large']['peak_rss_mb'] == large['peak_rss_mb']
+
+
+def test_stats(tmp_path):
+    worker = profiler(cprofile=True)
+    with worker.stage('busy', 1):
+        busy()
+
+    profile = profiler(True, cprofile=True)
+    with profile.stage('read', 2):
+        pass
+    with profile.stage('busy', 2):
+        busy()
+    profile.merge(worker.export())
+    assert len(profile.records) == 3
+    assert profile.totals()['busy']['runs'] == 2
+
+    filename = str(tmp_path / 'stats')
+    assert profile.dump_stats(filename) == 'busy'
+    stats = pstats.Stats(filename)
+    calls = [calls for (_, _, name), (calls, *_) in stats.stats.items()
+             if name == 'busy']
+    assert calls == [2]
@@ -0,0 +1,99 @@
+from bed_vcf_match import query_server, analyze_bed
+from io import StringIO
+import pandas as pd
+import threading
+import pytest
+
+
+@pytest.fixture
+def server():
+    modern = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,UV1,UV2\n'
+        '1,100,A,T,0|1,0|0\n'
+        '1,105,A,T,nan,1|0\n'
+        '1,110,C,G,1|0,1|1\n'
+        '1,115,A,T,1|1,1|0\n'
+        '2,100,C,G,0|1,1|1\n'
+    ))
+    archaic = pd.read_csv(StringIO(
+        'chrom,pos,ref,alt,variant,CAnc\n'
+        '1,100,A,T,1,T\n'
+        '1,105,A,T,2,A\n'
+        '1,115,A,T,2,A\n'
+        '2,100,C,G,2,C\n'
+    ))
+    db = query_server.resident_db()
+    for chrom in (1, 2):
+        index = analyze_bed.site_index(modern, chrom)
+        db.add(index, [analyze_bed.archaic_sites(index, archaic)])
+
+    server = query_server.query_server(db, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    host, port = server.server_address[:2]
+    yield f'{host}:{port}', modern, archaic
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_status(server):
+    address, _, _ = server
+    status = query_server.request(address, '/status')
+    assert status == {'chromosomes': [1, 2],
+                      'individuals': ['UV1', 'UV2'],
+                      'archaic_labels': [],
+                      'header': analyze_bed.summarize_region_header()}
+
+
+def test_query(server):
+    address, modern, archaic = server
+    regions = [['1', 99, 120], [2, 0, 200], [1, 104, 110], ['1', 200, 300]]
+    queries = [{'individual': indiv, 'haplotype': haplotype,
+                'regions': regions}
+               for indiv in ('UV1', 'UV2') for haplotype in (1, 2)]
+    header, results = query_server.query(address, queries)
+    assert header == analyze_bed.summarize_region_header()
+    for query, result in zip(queries, results):
+        # lines follow the order of the regions
+        assert result == ''.join(
+            analyze_bed.summarize_region([int(chrom), start, end],
+                                         query['haplotype'],
+                                         query['individual'],
+                                         modern, archaic)
+            for chrom, start, end in regions)
+    assert results[0].startswith('1\t99\t120\t3\t2\t2\t1.5\t1.5\n')
+
+    assert query_server.query(address, []) == (header, [])
+    _, results = query_server.query(
+        address, [{'individual': 'UV1', 'haplotype': 1, 'regions': []}])
+    assert results == ['']
+
+
+@pytest.mark.parametrize('queries,message', [
+    ([{'individual': 'UV3', 'haplotype': 1, 'regions': [[1, 0, 1]]}],
+     'UV3 not in modern vcf of chromosome 1'),
+    ([{'individual': 'UV1', 'haplotype': 1, 'regions': [[3, 0, 1]]}],
+     'Chromosome 3 is not loaded'),
+    ([{'individual': 'UV1', 'haplotype': 3, 'regions': []}],
+     'Unexpected haplotype 3'),
+    ([{'individual': 'UV1', 'haplotype': 1, 'regions': [[1, 0]]}],
+     'Expected chromosome, start and end'),
+    ([{'individual': 'UV1', 'haplotype': 1, 'regions': [[1, 'a', 2]]}],
+     'Unable to parse region positions'),
+    (['UV1'], 'Expected each query to be an object'),
+])
+def test_query_errors(server, queries, message):
+    address, _, _ = server
+    with pytest.raises(ValueError, match=message):
+        query_server.query(address, queries)
+
+    with pytest.raises(ValueError, match='Unknown path'):
+        query_server.request(address, '/other')
+    # the server continues after errors
+    assert query_server.request(address, '/status')['chromosomes'] == [1, 2]
+
+
+def test_shutdown(server):
+    address, _, _ = server
+    assert query_server.request(address, '/shutdown', {}) == {}
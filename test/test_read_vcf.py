@@ -1,6 +1,7 @@
 from bed_vcf_match import read_vcf
 from io import StringIO
 import numpy as np
+from numpy.testing import assert_array_equal as aae
 import pytest
 
 
@@ -299,3 +300,168 @@ def test_import_archaic_vcf_header():
         ['G']
     assert list(df['alt']) ==\
         ['A']
+
+
+def test_import_genotypes():
+    vcf = StringIO(
+        '##comment\n'
+        '#chrom\tpos\tid\tref\talt\tqual\tfilter\tinfor\tformat\tUV1\tUV2'
+        '\tUV3\n'
+        '8\t10346\t.\tA\tG\t.\tPASS\t.\tGT\t0|1\t0|0\t1|1\n'
+        '8\t1036\t.\tC\tG\t.\tPASS\t.\tGT\t0|0\t1/0\t1|0\n'
+        '8\t1037\t.\tC\tGA\t.\tPASS\t.\tGT\t0|0\t1|0\t1|0\n'
+        '8\t1336\t.\tG\tT\t.\tPASS\t.\tGT\t1/0\t./.\t0|1\n'
+    )
+    db = read_vcf.import_genotypes(vcf, individuals=['UV3', 'UV2'],
+                                   chunk_bytes=100)
+    assert db.individuals == ['UV2', 'UV3']
+    assert list(db.chrom) == [8, 8, 8]
+    assert list(db.pos) == [10346, 1036, 1336]
+    assert list(db.ref) == 'A C G'.split()
+    assert list(db.alt) == 'G G T'.split()
+    assert db.genotypes.dtype == np.int8
+    assert db.genotypes.shape == (3, 2, 2)
+    assert list(db.haplotype('UV2', 1)) == [0, -1, 0]
+    assert list(db.haplotype('UV2', 2)) == [0, -1, 0]
+    assert list(db.haplotype('UV3', 1)) == [1, 1, 0]
+    assert list(db.haplotype('UV3', 2)) == [1, 0, 1]
+
+    vcf.seek(0)
+    with pytest.raises(ValueError) as e:
+        read_vcf.import_genotypes(vcf, check_phasing=True)
+    assert 'Unexpected unphased haplotype for UV2 on position 1036' in str(e)
+
+    vcf.seek(0)
+    with pytest.raises(ValueError) as e:
+        read_vcf.import_genotypes(vcf, individuals=['UV4'])
+    assert 'UV4 not in file!' in str(e)
+
+    # removed sites are not checked for phasing
+    vcf.seek(0)
+    db = read_vcf.import_genotypes(
+        vcf, check_phasing=True, chunk_bytes=100,
+        site_filter=lambda chrom, pos: (chrom == 8) & (pos > 10000))
+    assert list(db.pos) == [10346]
+
+    # matches decoding the string database
+    vcf.seek(0)
+    frame = read_vcf.import_vcf(vcf)
+    db = read_vcf.genotype_database.from_dataframe(frame)
+    assert db.individuals == ['UV1', 'UV2', 'UV3']
+    assert list(db.haplotype('UV1', 2)) == [1, 0, -1]
+    assert list(db.haplotype('UV2', 1)) == [0, -1, 0]
+    assert list(db.haplotype('UV3', 2)) == [1, 0, 1]
+
+
+def test_chunked_chromosomes():
+    header = ('#chrom\tpos\tid\tref\talt\tqual\tfilter\tinfor\tformat'
+              '\tUV1\n')
+    lines = ['{}\t{}\t.\tA\tG\t.\tPASS\t.\tGT\t0|1\n'.format(chrom, pos)
+             for chrom, pos in [('1', 10), ('1', 20), ('', ''),
+                                ('2', 30), ('X', 40)]]
+    lines[2] = '\n'
+    vcf = header + ''.join(lines)
+
+    # chunks read as a single file
+    whole = read_vcf.import_vcf(StringIO(vcf))
+    for chunk_bytes in (1, 30, 60):
+        df = read_vcf.import_vcf(StringIO(vcf), chunk_bytes=chunk_bytes)
+        assert list(df.index) == list(whole.index) == [0, 1, 2, 3]
+        assert list(df['chrom']) == list(whole['chrom']) == \
+            ['1', '1', '2', 'X']
+        assert list(df['pos']) == [10, 20, 30, 40]
+
+    # chromosomes of later chunks match the first chunk
+    db = read_vcf.import_genotypes(StringIO(header + lines[-1] + lines[0]),
+                                   chunk_bytes=1)
+    assert list(db.chrom) == ['X', '1']
+    with pytest.raises(ValueError) as e:
+        read_vcf.import_genotypes(StringIO(vcf), chunk_bytes=60)
+    assert 'Expected numeric chromosomes as in earlier lines, found X' \
+        in str(e)
+    db = read_vcf.import_genotypes(StringIO(vcf), chunk_bytes=1000)
+    assert list(db.chrom) == ['1', '1', '2', 'X']
+
+
+def test_read_lines():
+    vcf = StringIO(''.join(f'1\t{i}\n' for i in range(10, 100)) + '\n\n')
+    chunks = list(read_vcf.read_lines(vcf, 100))
+    # whole lines of about 100 bytes
+    assert all(100 <= len(chunk) < 106 for chunk in chunks[:-1])
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+    assert b''.join(chunks).decode() == \
+        ''.join(f'1\t{i}\n' for i in range(10, 100))
+
+
+def test_parse_sites():
+    data = ('1\t10\t.\tA\tG\tGT\t0|1\t1/1\n'
+            '1\t20\t.\tAT\tG\tGT\t0|1\t1|1\n'
+            '\n'
+            '2\t30\t.\tC\tT\tGT\t./.\t1|1:5\n'
+            '2\t40\t.\tC\tT\tGT\t1|0\t2|1').encode()
+    rows, chrom, pos, ref, alt, codes = read_vcf.parse_sites(data, 8, [6, 7])
+    aae(rows, [0, 2, 3])
+    aae(chrom, [1, 2, 2])
+    aae(pos, [10, 30, 40])
+    aae(ref, ['A', 'C', 'C'])
+    aae(alt, ['G', 'T', 'T'])
+    aae(codes, [[1, read_vcf.UNPHASED_CODE],
+                [read_vcf.MISSING_CODE, read_vcf.UNPHASED_CODE],
+                [2, read_vcf.UNPHASED_CODE]])
+
+    rows, chrom, pos, _, _, codes = read_vcf.parse_sites(
+        data.replace(b'2\t', b'X\t'), 8, [7],
+        site_filter=lambda chrom, pos: pos > 30)
+    assert list(chrom) == ['X']
+    aae(pos, [40])
+    assert codes.shape == (1, 1)
+
+    with pytest.raises(ValueError) as e:
+        read_vcf.parse_sites(data + b'\t0|0\n', 8, [6])
+    assert 'Expected 8 fields on line' in str(e)
+
+
+def test_parse_blocks(monkeypatch):
+    data = ''.join(f'{chrom}\t{pos}\t.\t{ref}\tG\tGT\t0|1\t1/1\n' +
+                   '\n' * (pos % 3 == 0)
+                   for chrom, pos, ref in zip('1111122X22', range(10, 20),
+                                              'AAATAAAAAA')).encode()
+    expected = read_vcf.parse_sites(data, 8, [7, 6])
+    assert expected[1].dtype == object
+    # lines are parsed in several blocks, including lines longer than one
+    for size in [1, 30, 60, 100]:
+        monkeypatch.setattr(read_vcf, 'PARSE_BYTES', size)
+        for result, array in zip(read_vcf.parse_sites(data, 8, [7, 6]),
+                                 expected):
+            aae(result, array)
+    monkeypatch.setattr(read_vcf, 'PARSE_BYTES', 60)
+    chrom = read_vcf.parse_sites(data.replace(b'X', b'2'), 8, [7])[1]
+    assert list(chrom) == [1, 1, 1, 1, 1, 2, 2, 2, 2, 2]
+    with pytest.raises(ValueError) as e:
+        read_vcf.parse_sites(data, 8, [7], chrom_type=int)
+    assert 'found X' in str(e)
+
+
+def test_info_values():
+    info = np.array(['AC=1;CAnc=A;X=1', 'CAnc=T', 'AC=2', 'TS=1;CAncX=2',
+                     'CAncX=1;CAnc=GA=C', 'XCAnc=A', 'CAnc=', 'a;CAnc=é'],
+                    dtype=object)
+    contains, values = read_vcf.info_values(info, 'CAnc')
+    aae(contains, [True, True, False, True, True, True, True, True])
+    assert list(values) == ['A', 'T', None, None, 'GA', None, '', 'é']
+
+    contains, values = read_vcf.info_values(np.array([], dtype=object),
+                                            'CAnc')
+    assert len(contains) == 0 and len(values) == 0
+
+
+def test_archaic_alleles():
+    genotypes = np.array(['0/0', '0|1:32', '1/0', '1|1', './.:1'],
+                         dtype=object)
+    aae(read_vcf.archaic_alleles(genotypes), [0, 1, 1, 2, 0])
+    aae(read_vcf.archaic_alleles(genotypes, missing=-1), [0, 1, 1, 2, -1])
+
+    for genotype in ['0', '2|1', '0-1', './1']:
+        with pytest.raises(ValueError) as e:
+            read_vcf.archaic_alleles(np.array([genotype], dtype=object))
+        assert f'Unable to decode genotype {genotype}' in str(e)
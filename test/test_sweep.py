@@ -0,0 +1,98 @@
+from bed_vcf_match import sweep, read_vcf
+from bed_vcf_match.analyze_bed import bed_structure, site_index, archaic_sites
+from io import StringIO
+import numpy as np
+import pytest
+
+
+def make_vcfs(seed=0, sites=200):
+    rng = np.random.RandomState(seed)
+    positions = np.sort(rng.choice(np.arange(100, 5000), sites,
+                                   replace=False))
+    positions[10] = positions[9]  # duplicate position
+    modern = ('##comment\n'
+              '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'
+              'UV1\tUV2\n')
+    archaic = ''
+    for pos in positions:
+        ref, alt = rng.choice(list('ACGT'), 2, replace=False)
+        genotypes = ['%d|%d' % tuple(rng.randint(0, 2, 2)) for _ in '12']
+        modern += f'1\t{pos}\t.\t{ref}\t{alt}\t.\t.\t.\tGT\t' + \
+            '\t'.join(genotypes) + '\n'
+        if rng.rand() < 0.7:
+            canc = rng.choice([ref, alt, 'N'])
+            genotype = rng.choice(['0/0', '0/1', '1/1', './.'])
+            archaic += (f'1\t{pos}\t.\t{ref}\t{alt}\t.\t.\tCAnc={canc}\t.\t'
+                        f'{genotype}:\n')
+            if pos % 5 == 0:  # duplicate archaic site
+                archaic += (f'1\t{pos}\t.\t{ref}\t{alt}\t.\t.\tCAnc={alt}\t'
+                            '.\t0/1:\n')
+    return modern, archaic
+
+
+def make_beds(tmp_path):
+    beds = []
+    bed_file = tmp_path / 'UV1.PNG.x_hap1.bed'
+    bed_file.write_text('1\t100\t900\n'
+                        '1\t50\t2000\n'  # unsorted, overlapping
+                        '1\t1500\t1600\n'
+                        '1\t2500\t4800\n'
+                        '1\t4800\t4900\n'
+                        '1\t5000\t6000\n'
+                        '2\t100\t500\n')
+    beds.append(bed_structure(str(bed_file)))
+    bed_file = tmp_path / 'UV2.PNG.x_hap2.bed'
+    bed_file.write_text('1\t0\t10000\n')
+    beds.append(bed_structure(str(bed_file)))
+    bed_file = tmp_path / 'UV2.PNG.x_hap1.bed'
+    bed_file.write_text('2\t0\t10000\n')
+    beds.append(bed_structure(str(bed_file)))
+    return beds
+
+
+@pytest.mark.parametrize('include_canc', [False, True])
+@pytest.mark.parametrize('chunksize,chunk_bytes',
+                         [(7, 300), (50, 2000), (1000, 1 << 20)])
+def test_sweep_chromosome(tmp_path, include_canc, chunksize, chunk_bytes):
+    modern, archaic = make_vcfs()
+    beds = make_beds(tmp_path)
+
+    modern_db = site_index(read_vcf.import_genotypes(StringIO(modern)), 1)
+    archaic_db = archaic_sites(
+        modern_db,
+        read_vcf.import_archaic_vcf(StringIO(archaic),
+                                    include_canc=include_canc))
+    expected = [bed.summarize_chrom(1, modern_db, archaic_db)
+                for bed in beds]
+
+    result = sweep.sweep_chromosome(
+        1,
+        beds,
+        read_vcf.iter_genotypes(StringIO(modern), chunk_bytes=chunk_bytes),
+        read_vcf.iter_archaic_vcf(StringIO(archaic),
+                                  include_canc=include_canc,
+                                  chunksize=chunksize))
+    assert result == expected
+    assert result[2] == ''
+
+    for bed in beds:
+        bed.close()
+
+
+def test_sweep_unsorted(tmp_path):
+    modern = ('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'
+              'UV1\tUV2\n'
+              '1\t200\t.\tA\tT\t.\t.\t.\tGT\t0|1\t0|0\n'
+              '1\t100\t.\tA\tT\t.\t.\t.\tGT\t0|1\t0|0\n')
+    archaic = '1\t100\t.\tA\tT\t.\t.\t.\t.\t0/1:\n'
+    beds = make_beds(tmp_path)
+    with pytest.raises(ValueError) as e:
+        sweep.sweep_chromosome(
+            1,
+            beds,
+            read_vcf.iter_genotypes(StringIO(modern)),
+            read_vcf.iter_archaic_vcf(StringIO(archaic)))
+    assert 'Modern vcf is not sorted by position' in str(e)
+
+    for bed in beds:
+        bed.close()
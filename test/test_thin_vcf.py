@@ -1,13 +1,19 @@
 import thin_vcf as main
 import numpy as np
 from numpy.testing import assert_array_equal as aae
-from io import StringIO
+from io import BytesIO, StringIO
+import pytest
 
 
 def arg_helper(args, nondefault={}):
     defaults = {
+        'input': None,
+        'decompress_threads': 1,
+        'block': False,
+        'threads': 1,
         'bed_file': None,
         'merge': None,
+        'position_only': False,
         'individuals_file': None,
     }
     for k, v in nondefault.items():
@@ -26,12 +32,25 @@ def test_read_args():
     args = main.read_args('--bed_file test'.split())
     arg_helper(args.__dict__, {'bed_file': 'test'})
 
+    args = main.read_args('--block'.split())
+    arg_helper(args.__dict__, {'block': True})
+
+    args = main.read_args('--threads 4'.split())
+    arg_helper(args.__dict__, {'threads': 4})
+
     args = main.read_args('--merge 1'.split())
     arg_helper(args.__dict__, {'merge': 1})
 
+    args = main.read_args('--position_only'.split())
+    arg_helper(args.__dict__, {'position_only': True})
+
     args = main.read_args('--individuals_file test'.split())
     arg_helper(args.__dict__, {'individuals_file': 'test'})
 
+    args = main.read_args('--input test.vcf.gz --decompress_threads 4'.split())
+    arg_helper(args.__dict__, {'input': 'test.vcf.gz',
+                               'decompress_threads': 4})
+
 
 def test_read_bed_basic():
     bed = StringIO(
@@ -299,3 +318,207 @@ def test_line_parser_both():
     assert p.process_line(
         '3 61 a b c d e f g ./. 0|0 1|1\n'.replace(' ', '\t')) == \
         ''
+
+
+def test_read_blocks():
+    data = b'a\tb\n' * 5 + b'end'
+    blocks = list(main.read_blocks(BytesIO(data), 5))
+    assert blocks[0] == b'a\tb\n'
+    assert all(block.endswith(b'\n') for block in blocks[:-1])
+    assert blocks[-1] == b'end'
+    assert b''.join(blocks) == data
+
+    assert list(main.read_blocks(BytesIO(b'a\n'), 100)) == [b'a\n']
+    assert list(main.read_blocks(BytesIO(b''), 100)) == []
+
+
+def test_parse_ints():
+    data = np.frombuffer(b'1\t22\t333\t4444', dtype=np.uint8)
+    aae(main.parse_ints(data, np.array([0, 2, 5, 9]),
+                        np.array([1, 4, 8, 13])),
+        [1, 22, 333, 4444])
+
+
+def test_process_block():
+    lines = ('##stuff\n'
+             '#c p a b c d e f g u1 u2 u3\n'
+             '3 1 a b c d e f g ./. 0|0 1|1\n'
+             '3 11 a b c d e f g ./. 0|1 1|1\n'
+             '3 35 a b c d e f g 0|0 1|0 1|1\n'
+             '3 36 a b c d e f g 0|0 1|0 1|1 \n'
+             '3 61 a b c d e f g ./. 0|0 1|1').replace(' ', '\t') \
+        .replace('\t\n', ' \n').splitlines(True)
+
+    for bed in [None, np.array([[10, 20], [30, 50]]),
+                np.array([[10, 40], [30, 35]])]:
+        for indivs in [None, ['u1', 'u3'], ['u3']]:
+            copy = None if bed is None else bed.copy()
+            p = main.line_parser(copy, indivs)
+            expected = ''.join(p.process_line(line) for line in lines)
+
+            copy = None if bed is None else bed.copy()
+            p = main.line_parser(copy, indivs)
+            assert p.process_block(''.join(lines).encode()).decode() == \
+                expected
+
+            # lines split across blocks keep the bed position
+            copy = None if bed is None else bed.copy()
+            p = main.line_parser(copy, indivs)
+            result = b''.join(p.process_block(''.join(lines[i:i+2]).encode())
+                              for i in range(0, len(lines), 2))
+            assert result.decode() == expected
+
+
+def test_read_bed_index():
+    bed = StringIO(
+        '2\t30\t40\n'
+        '1\t100\t105\n'
+        '2\t10\t20\n'
+        '1\t104\t115\n'
+        '2\t15\t18\n'
+        '1\t116\t120\n'
+    )
+    output = main.read_bed_index(bed)
+    assert list(output) == ['1', '2']
+    aae(output['1'], [[100, 115], [116, 120]])
+    aae(output['2'], [[10, 20], [30, 40]])
+
+    bed.seek(0)
+    output = main.read_bed_index(bed, 1)
+    aae(output['1'], [[100, 120]])
+    aae(output['2'], [[10, 20], [30, 40]])
+
+    bed.seek(0)
+    output = main.read_bed_index(bed, 10)
+    aae(output['2'], [[10, 40]])
+
+    output = main.read_bed_index(StringIO('1\t100\t105\n'))
+    aae(output['1'], [[100, 105]])
+
+
+def test_in_regions():
+    regions = np.array([[10, 20], [30, 50]])
+    aae(main.in_regions(regions, np.array([1, 10, 11, 20, 21, 35, 50, 51])),
+        [False, False, True, True, False, True, True, False])
+
+
+def test_line_parser_contigs():
+    bed = {'1': np.array([[10, 20], [30, 50]]),
+           '2': np.array([[0, 5]])}
+    lines = ('##stuff\n'
+             '#c p a b c d e f g u1 u2 u3\n'
+             '1 11 a b c d e f g ./. 0|1 1|1\n'
+             '1 35 a b c d e f g 0|0 1|0 1|1\n'
+             '2 3 a b c d e f g 0|0 1|0 1|1\n'
+             '1 15 a b c d e f g ./. 0|1 1|1\n'
+             '3 15 a b c d e f g ./. 0|1 1|1\n'
+             '2 6 a b c d e f g ./. 0|1 1|1\n').replace(' ', '\t') \
+        .splitlines(True)
+
+    p = main.line_parser(bed, None)
+    assert ''.join(p.process_line(line) for line in lines) == \
+        ''.join(lines[:6])
+
+    p = main.line_parser(bed, ['u3'])
+    expected = ''.join(p.process_line(line) for line in lines)
+    assert expected == ('##stuff\n'
+                        '#c p a b c d e f g u3\n'
+                        '1 11 a b c d e f g 1|1\n'
+                        '1 35 a b c d e f g 1|1\n'
+                        '2 3 a b c d e f g 1|1\n'
+                        '1 15 a b c d e f g 1|1\n').replace(' ', '\t')
+
+    for indivs in [None, ['u3']]:
+        p = main.line_parser(bed, indivs)
+        expected = ''.join(p.process_line(line) for line in lines)
+        p = main.line_parser(bed, indivs)
+        assert p.process_block(''.join(lines).encode()).decode() == \
+            expected
+
+
+def test_filter_parallel():
+    header = ('##stuff\n'
+              '#c p a b c d e f g u1 u2 u3\n').replace(' ', '\t')
+    lines = [f'3\t{i}\ta\tb\tc\td\te\tf\tg\t./.\t0|{i % 2}\t1|1\n'
+             for i in range(0, 2000, 3)]
+    data = (header + ''.join(lines)).encode()
+
+    for bed, indivs in [(None, None),
+                        (np.array([[10, 20], [30, 500], [700, 1200]]), None),
+                        (np.array([[10, 20], [30, 500]]), ['u2', 'u3']),
+                        ({'3': np.array([[100, 200]]),
+                          '4': np.array([[0, 2000]])}, ['u2'])]:
+        copy = bed if bed is None or isinstance(bed, dict) else bed.copy()
+        p = main.line_parser(copy, indivs)
+        expected = ''.join(p.process_line(line)
+                           for line in data.decode().splitlines(True))
+
+        copy = bed if bed is None or isinstance(bed, dict) else bed.copy()
+        p = main.line_parser(copy, indivs)
+        writer = BytesIO()
+        main.filter_parallel(BytesIO(data), writer, p, 2, size=500)
+        assert writer.getvalue().decode() == expected
+
+
+def test_site_filter(tmp_path):
+    bed = tmp_path / 'sites.bed'
+    bed.write_text('1\t10\t20\n'
+                   '1\t25\t30\n')
+    sites = main.site_filter(main.read_sites(str(bed)))
+    # a single chromosome is still matched by chromosome
+    aae(sites(np.array([1, 2, 1, 1]), np.array([10, 11, 22, 30])),
+        [False, False, False, True])
+    digest = sites.digest()
+    assert main.site_filter(main.read_sites(str(bed), 5)).digest() != digest
+    sites = main.site_filter(main.read_sites(str(bed), 5))
+    aae(sites(np.array([1, 2, 1, 1]), np.array([10, 11, 22, 30])),
+        [False, False, True, True])
+
+    # unless asked to match by position only
+    sites = main.site_filter(main.read_sites(str(bed), position_only=True))
+    assert sites.digest() != digest
+    aae(sites(np.array([1, 2, 1, 1]), np.array([10, 11, 22, 30])),
+        [False, True, False, True])
+
+    bed.write_text('1\t10\t20\n'
+                   'X\t0\t30\n')
+    sites = main.site_filter(main.read_sites(str(bed)))
+    aae(sites(np.array(['1', 'X', '2', 'X']), np.array([15, 15, 15, 31])),
+        [True, True, False, False])
+    aae(sites(np.array([1, 1]), np.array([15, 25])), [True, False])
+    with pytest.raises(ValueError, match='Expected a single chromosome'):
+        main.read_sites(str(bed), position_only=True)
+
+
+def test_single_contig_bed(tmp_path):
+    # one chromosome of regions against a genome-wide vcf
+    bed = tmp_path / 'sites.bed'
+    bed.write_text('2\t10\t20\n'
+                   '2\t30\t50\n')
+    lines = ('##stuff\n'
+             '#c p a b c d e f g u1 u2 u3\n'
+             '1 11 a b c d e f g ./. 0|1 1|1\n'
+             '1 35 a b c d e f g 0|0 1|0 1|1\n'
+             '2 3 a b c d e f g 0|0 1|0 1|1\n'
+             '2 15 a b c d e f g ./. 0|1 1|1\n'
+             '2 40 a b c d e f g ./. 0|1 1|1\n'
+             '3 15 a b c d e f g ./. 0|1 1|1\n').replace(' ', '\t')
+    expected = ''.join(lines.splitlines(True)[i] for i in (0, 1, 5, 6))
+
+    for indivs in [None, ['u1', 'u2', 'u3']]:
+        p = main.line_parser(main.read_sites(str(bed)), indivs)
+        assert ''.join(p.process_line(line)
+                       for line in lines.splitlines(True)) == expected
+
+        p = main.line_parser(main.read_sites(str(bed)), indivs)
+        assert p.process_block(lines.encode()).decode() == expected
+
+        p = main.line_parser(main.read_sites(str(bed)), indivs)
+        writer = BytesIO()
+        main.filter_parallel(BytesIO(lines.encode()), writer, p, 2, size=50)
+        assert writer.getvalue().decode() == expected
+
+    # the old behaviour keeps positions of every chromosome
+    p = main.line_parser(main.read_sites(str(bed), position_only=True), None)
+    assert p.process_block(lines.encode()).decode().startswith(
+        ''.join(lines.splitlines(True)[i] for i in (0, 1, 2, 3)))
@@ -0,0 +1,89 @@
+from bed_vcf_match import vcf_cache
+from numpy.testing import assert_array_equal as aae
+import os
+import shutil
+
+
+MODERN = (
+    '##comment\n'
+    '#chrom\tpos\tid\tref\talt\tqual\tfilter\tinfor\tformat\tUV1\tUV2\n'
+    '8\t10346\t.\tA\tG\t.\tPASS\t.\tGT\t0|1\t0|0\n'
+    '8\t1036\t.\tC\tG\t.\tPASS\t.\tGT\t0|0\t1|0\n'
+    '8\t1336\t.\tG\tT\t.\tPASS\t.\tGT\t1|0\t./.\n'
+)
+
+ARCHAIC = (
+    '4\t1907358\t.\tG\tA\t.\t.\tCAnc=C\t.\t1/1:\n'
+    '1\t1073582\t.\tA\tT\t.\t.\tCAncX=T\t.\t0|1:\n'
+    '4\t1973582\t.\tT\tC\t.\t.\t.\t.\t1/0:\n'
+    '2\t1903582\t.\tC\tG\t.\t.\tCAnc=C\t.\t0/0:\n'
+)
+
+
+def test_load_genotypes(tmp_path):
+    vcf = tmp_path / 'modern.vcf'
+    vcf.write_text(MODERN)
+    cache = vcf_cache.vcf_cache(str(tmp_path / 'cache'))
+
+    expected = vcf_cache.vcf_cache().load_genotypes(str(vcf))
+    first = cache.load_genotypes(str(vcf))
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+    second = cache.load_genotypes(str(vcf))
+    for db in [first, second]:
+        assert db.individuals == ['UV1', 'UV2']
+        aae(db.chrom, expected.chrom)
+        aae(db.pos, expected.pos)
+        aae(db.ref, expected.ref)
+        aae(db.alt, expected.alt)
+        aae(db.genotypes, expected.genotypes)
+
+    # different individuals replace the entry
+    entries = os.listdir(tmp_path / 'cache')
+    db = cache.load_genotypes(str(vcf), individuals=['UV2'])
+    assert db.individuals == ['UV2']
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+    assert os.listdir(tmp_path / 'cache') != entries
+
+    # changing the file invalidates the cache
+    vcf.write_text(MODERN.replace('1036', '1037'))
+    db = cache.load_genotypes(str(vcf))
+    aae(db.pos, [10346, 1037, 1336])
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+
+    # rebuild replaces the entry
+    cache = vcf_cache.vcf_cache(str(tmp_path / 'cache'), rebuild=True)
+    db = cache.load_genotypes(str(vcf))
+    aae(db.pos, [10346, 1037, 1336])
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+
+    # entries of other vcfs are kept
+    other = tmp_path / 'other' / 'modern.vcf'
+    other.parent.mkdir()
+    other.write_text(MODERN)
+    cache.load_genotypes(str(other))
+    assert len(os.listdir(tmp_path / 'cache')) == 2
+
+    # entries removed by another run while loading are parsed
+    cache = vcf_cache.vcf_cache(str(tmp_path / 'cache'))
+    entry = cache.entry(str(vcf), kind='genotypes', check_phasing=False,
+                        individuals=None, regions=None, sites=None)
+    os.remove(os.path.join(entry, 'lists.json'))
+    aae(cache.load_genotypes(str(vcf)).pos, [10346, 1037, 1336])
+    shutil.rmtree(entry)
+
+
+def test_load_archaic(tmp_path):
+    vcf = tmp_path / 'archaic.vcf'
+    vcf.write_text(ARCHAIC)
+    cache = vcf_cache.vcf_cache(str(tmp_path / 'cache'))
+
+    for include_canc in [False, True]:
+        expected = vcf_cache.vcf_cache().load_archaic(
+            str(vcf), include_canc=include_canc)
+        for _ in range(2):
+            df = cache.load_archaic(str(vcf), include_canc=include_canc)
+            assert list(df.columns) == list(expected.columns)
+            for column in df.columns:
+                assert list(df[column]) == list(expected[column])
+    # the entry of the last options is kept
+    assert len(os.listdir(tmp_path / 'cache')) == 1
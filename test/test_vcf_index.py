@@ -0,0 +1,200 @@
+from bed_vcf_match import vcf_index, bgzf, vcf_cache
+from numpy.testing import assert_array_equal as aae
+import gzip
+import numpy as np
+import os
+import struct
+import pytest
+
+
+HEADER = ('##fileformat=VCFv4.2\n'
+          '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tUV1\n')
+
+
+def make_vcf(tmp_path, contigs=('1', '2'), sites=6000):
+    '''
+    Write a BGZF vcf spanning several blocks, with two lines per position
+    '''
+    lines = []
+    for contig in contigs:
+        for i in range(sites):
+            position = 1000 + 7 * (i // 2)
+            lines.append(f'{contig}\t{position}\t.\tA\tT\t.\t.\t'
+                         f'{"x" * 20}\tGT\t0|1\n')
+    filename = str(tmp_path / 'test.vcf.gz')
+    bgzf.write_bgzf(filename, (HEADER + ''.join(lines)).encode())
+    return filename, lines
+
+
+def expected_lines(lines, contig, starts, ends):
+    result = []
+    for line in lines:
+        fields = line.split('\t')
+        position = int(fields[1])
+        if fields[0] == contig and \
+                any(s < position <= e for s, e in zip(starts, ends)):
+            result.append(line)
+    return result
+
+
+def write_index(filename, vcf, csi=False):
+    '''
+    Write a minimal tabix or csi index from the line offsets of the vcf
+    '''
+    names = []
+    offsets = {}
+    with open(vcf, 'rb') as reader:
+        for offset, line in bgzf.iter_lines(reader):
+            if line.startswith(b'#'):
+                continue
+            contig, position = line.split(b'\t')[:2]
+            if contig not in offsets:
+                names.append(contig)
+                offsets[contig] = {}
+            window = (int(position) - 1) >> (14 if not csi else 12)
+            offsets[contig].setdefault(window, offset)
+
+    names = b''.join(name + b'\x00' for name in names)
+    header = struct.pack('<iiiiii', 2, 1, 2, 0, ord('#'), 0)
+    header += struct.pack('<i', len(names)) + names
+    if csi:
+        data = b'CSI\x01' + struct.pack('<iii', 12, 1, len(header)) + header
+        data += struct.pack('<i', len(offsets))
+        for windows in offsets.values():
+            # leaf bins of depth 1 start at 1, plus a pseudo bin
+            data += struct.pack('<i', len(windows) + 1)
+            for window, offset in windows.items():
+                data += struct.pack('<IQi', 1 + window, offset, 0)
+            data += struct.pack('<IQi', 10, 0, 0)
+    else:
+        data = b'TBI\x01' + struct.pack('<i', len(offsets)) + header
+        for windows in offsets.values():
+            data += struct.pack('<i', 0)
+            linear = np.zeros(max(windows) + 1, dtype='<u8')
+            for window in sorted(windows):
+                linear[window:] = windows[window]
+            data += struct.pack('<i', len(linear)) + linear.tobytes()
+    with gzip.open(filename, 'wb') as writer:
+        writer.write(data)
+
+
+def read_regions(vcf, chromosome, starts, ends, threads=1):
+    with vcf_index.open_regions(vcf, chromosome,
+                                np.array(starts), np.array(ends),
+                                threads) as reader:
+        return reader.readlines()
+
+
+def test_merge_regions():
+    starts, ends = vcf_index.merge_regions(np.array([10, 0, 5, 30, 40, 39]),
+                                           np.array([20, 5, 12, 30, 50, 41]))
+    # regions select start < pos <= end, so touching regions are disjoint
+    aae(starts, [0, 5, 39])
+    aae(ends, [5, 20, 50])
+
+    starts, ends = vcf_index.merge_regions(np.array([10, 0, 5, 30, 40, 39]),
+                                           np.array([20, 5, 12, 30, 50, 41]),
+                                           distance=19)
+    aae(starts, [0])
+    aae(ends, [50])
+
+    starts, ends = vcf_index.merge_regions(np.array([], dtype=int),
+                                           np.array([], dtype=int))
+    assert len(starts) == 0
+
+
+@pytest.mark.parametrize('kind', ['sidecar', 'tbi', 'csi'])
+def test_open_regions(tmp_path, kind):
+    vcf, lines = make_vcf(tmp_path)
+    if kind != 'sidecar':
+        write_index(f'{vcf}.{kind}', vcf, csi=kind == 'csi')
+
+    for contig, starts, ends in [
+            ('1', [1000, 5000], [1007, 5014]),
+            ('2', [999, 20000], [1000, 30000]),
+            ('2', [1500, 2000, 13000], [3000, 2500, 1000000]),
+            ('1', [1006, 1006], [1007, 1006]),
+            ('1', [40000], [50000]),
+    ]:
+        result = read_regions(vcf, contig, starts, ends, threads=2)
+        expected = expected_lines(lines, contig, starts, ends)
+        assert len(expected) > 0 or starts == [40000]
+        assert result == HEADER.splitlines(True) + expected
+
+    # absent contig leaves only the header
+    assert read_regions(vcf, 3, [0], [100000]) == HEADER.splitlines(True)
+
+    index = {'sidecar': vcf_index.sidecar_index,
+             'tbi': vcf_index.tabix_index,
+             'csi': vcf_index.csi_index}[kind]
+    assert isinstance(vcf_index.load_index(vcf), index)
+    assert os.path.exists(vcf + vcf_index.SIDECAR_SUFFIX) == \
+        (kind == 'sidecar')
+
+
+def test_sidecar(tmp_path):
+    vcf, lines = make_vcf(tmp_path)
+    index = vcf_index.build_sidecar(vcf)
+    assert list(index.positions) == ['1', '2']
+    # first line of each contig and block
+    assert index.positions['2'][0] == 1000
+    assert len(index.positions['1']) > 1
+    assert (np.diff(index.positions['1']) > 0).all()
+
+    filename = vcf + vcf_index.SIDECAR_SUFFIX
+    vcf_index.save_sidecar(filename, index, vcf)
+    loaded = vcf_index.load_sidecar(filename, vcf)
+    for contig in ['1', '2']:
+        aae(loaded.positions[contig], index.positions[contig])
+        aae(loaded.offsets[contig], index.offsets[contig])
+
+    # offsets of blocks inflated by threads match
+    with open(vcf, 'rb') as reader:
+        assert len(list(bgzf.iter_blocks(reader))) > 4 * 2
+    threaded = vcf_index.build_sidecar(vcf, threads=2)
+    for contig in ['1', '2']:
+        aae(threaded.positions[contig], index.positions[contig])
+        aae(threaded.offsets[contig], index.offsets[contig])
+
+    # a modified vcf invalidates the sidecar
+    os.utime(vcf, ns=(0, 0))
+    assert vcf_index.load_sidecar(filename, vcf) is None
+
+    # unsorted files can not be indexed
+    lines[5], lines[500] = lines[500], lines[5]
+    bgzf.write_bgzf(vcf, (HEADER + ''.join(lines)).encode())
+    assert vcf_index.build_sidecar(vcf) is None
+
+
+def test_unindexed(tmp_path):
+    vcf = str(tmp_path / 'test.vcf')
+    with open(vcf, 'w') as writer:
+        writer.write(HEADER + '1\t10\t.\tA\tT\t.\t.\t.\tGT\t0|1\n')
+    assert vcf_index.load_index(vcf) is None
+    # read in full
+    assert len(read_regions(vcf, 1, [100], [200])) == 3
+
+
+def test_cache_regions(tmp_path):
+    vcf, lines = make_vcf(tmp_path, sites=10)
+    regions = (1, np.array([1000]), np.array([1014]))
+    cache = vcf_cache.vcf_cache(str(tmp_path / 'cache'))
+    db = cache.load_genotypes(vcf, regions=regions)
+    aae(db.pos, [1007, 1007, 1014, 1014])
+    db = cache.load_genotypes(vcf, regions=regions)
+    aae(db.pos, [1007, 1007, 1014, 1014])
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+    # other regions replace the entry
+    db = cache.load_genotypes(vcf)
+    assert len(db) == 20
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+
+    archaic = cache.load_archaic(vcf, regions=(2, [0], [1000]))
+    assert list(archaic.pos) == [1000, 1000]
+    assert len(os.listdir(tmp_path / 'cache')) == 2
+
+
+def test_vcf_index():
+    # each index must provide offset
+    with pytest.raises(TypeError):
+        vcf_index.vcf_index()
@@ -10,9 +10,19 @@ vcftools recode with keep individuals
 '''
 
 import argparse
+import hashlib
 import numpy as np
 import sys
-from typing import List, TextIO
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, TextIO, Union
+from bed_vcf_match.read_vcf import (open_vcf, parse_ints,
+                                    parse_strings)
+from bed_vcf_match.vcf_index import merge_regions
+
+
+# bytes read at a time in block mode
+BLOCK_SIZE = 1 << 22
 
 
 def main():
@@ -20,8 +30,7 @@ def main():
 
     # read in and merge bedfile
     if args.bed_file is not None:
-        with open(args.bed_file) as bed_file:
-            bed = read_bed(bed_file, args.merge)
+        bed = read_sites(args.bed_file, args.merge, args.position_only)
     else:
         bed = None
 
@@ -33,8 +42,70 @@ def main():
 
     parser = line_parser(bed, indivs)
 
-    for line in sys.stdin:
-        print(parser.process_line(line), end='')
+    if args.input is None:
+        reader = sys.stdin
+    else:
+        reader = open_vcf(args.input, args.decompress_threads)
+
+    if args.threads > 1:
+        filter_parallel(reader.buffer, sys.stdout.buffer, parser, args.threads)
+    elif args.block:
+        for block in read_blocks(reader.buffer):
+            sys.stdout.buffer.write(parser.process_block(block))
+    else:
+        for line in reader:
+            print(parser.process_line(line), end='')
+
+
+def filter_parallel(reader: BinaryIO,
+                    writer: BinaryIO,
+                    parser: 'line_parser',
+                    threads: int,
+                    size: int = BLOCK_SIZE):
+    '''
+    Filter the vcf in blocks with a pool of worker processes.  Header lines
+    are processed first, then the parser is sent to each worker once.
+    Blocks are numbered as they are read and results are written in order,
+    with at most 2 blocks per worker pending.
+    '''
+    blocks = read_blocks(reader, size)
+    for block in blocks:
+        writer.write(parser.process_block(block))
+        # the last line of the block is past the header
+        if not block.startswith(b'#', block.rfind(b'\n', 0, -1) + 1):
+            break
+
+    with ProcessPoolExecutor(threads,
+                             initializer=init_worker,
+                             initargs=(parser,)) as pool:
+        pending = deque()
+        for block in blocks:
+            if len(pending) >= 2 * threads:
+                writer.write(pending.popleft().result())
+            pending.append(pool.submit(filter_block, block))
+        while pending:
+            writer.write(pending.popleft().result())
+
+
+# line parser of each worker process, set once by init_worker
+_worker_parser = None
+
+
+def init_worker(parser: 'line_parser'):
+    global _worker_parser
+    _worker_parser = parser
+
+
+def filter_block(block: bytes) -> bytes:
+    '''
+    Filter a block of vcf lines in a worker.  Blocks are independent, so
+    the bed is searched from the first region for each block, which is
+    equivalent for vcfs sorted by position.
+    '''
+    bed_ind = _worker_parser.bed_ind
+    result = _worker_parser.process_block(block)
+    _worker_parser.bed_ind = bed_ind
+    return result
 
 
 def read_args(args: List[str] = None) -> argparse.Namespace:
@@ -42,11 +113,35 @@ def read_args(args: List[str] = None) -> argparse.Namespace:
     read in command line arguments, returning namespace object
     '''
     parser = argparse.ArgumentParser(description='Filter vcfs from stdin')
+    parser.add_argument('--input',
+                        default=None,
+                        help='If set, read the vcf from this file instead '
+                        'of stdin.  Gzip and BGZF files are decompressed.')
+
+    parser.add_argument('--decompress_threads',
+                        default=1,
+                        type=int,
+                        help='Number of threads to inflate a BGZF '
+                        'compressed input file.')
+
+    parser.add_argument('--block',
+                        action='store_true',
+                        help='If set, filter blocks of lines at once '
+                        'instead of line by line.  Output is identical.')
+
+    parser.add_argument('--threads',
+                        default=1,
+                        type=int,
+                        help='If greater than 1, blocks of lines are '
+                        'filtered by this many worker processes and written '
+                        'in input order.  Implies --block.')
+
     parser.add_argument('--bed_file',
                         default=None,
                         help='If set, retain only the sites within bed '
                         'file regions.  Assumes indexing is identical and '
-                        'inclusive with start and end. Must be sorted.')
+                        'inclusive with start and end.  Regions of several '
+                        'chromosomes are matched by chromosome and position.')
 
     parser.add_argument('--merge',
                         default=None,
@@ -54,6 +149,12 @@ def read_args(args: List[str] = None) -> argparse.Namespace:
                         help='If set to an integer, merge bed regions within '
                         '<merge> away from eachother, inclusive.')
 
+    parser.add_argument('--position_only',
+                        action='store_true',
+                        help='If set, match sites by position only, ignoring '
+                        'the chromosome.  The bed file must hold a single '
+                        'chromosome and the vcf must be sorted.')
+
     parser.add_argument('--individuals_file',
                         default=None,
                         help='If set, only individuals from the file are kept.'
@@ -91,6 +192,99 @@ def read_bed(reader: TextIO, merge: int = None) -> np.array:
     return result
 
 
+def read_bed_index(reader: TextIO,
+                   merge: int = None) -> Dict[str, np.ndarray]:
+    '''
+    read in the opened bed file of any number of chromosomes, in any order.
+    Returns the sorted, merged regions of each chromosome as an array of
+    start and end sites.  Overlapping regions are always merged, and if
+    merge is provided, regions are merged if start_i - end_i-1 <= merge.
+    '''
+    bed = np.loadtxt(reader,
+                     dtype=str,
+                     delimiter='\t',
+                     usecols=(0, 1, 2),
+                     ndmin=2)
+    result = {}
+    for contig in np.unique(bed[:, 0]):
+        regions = bed[bed[:, 0] == contig, 1:].astype(np.int64)
+        result[str(contig)] = np.stack(
+            merge_regions(regions[:, 0], regions[:, 1], merge), axis=1)
+    return result
+
+
+def read_sites(filename: str,
+               merge: int = None,
+               position_only: bool = False) -> Union[np.ndarray, Dict]:
+    '''
+    read the bed file as read_bed_index, so sites are matched by chromosome
+    and position.  With position_only, the regions of a single chromosome
+    are returned as an array, matching sites of any chromosome by position.
+    '''
+    with open(filename) as bed_file:
+        bed = read_bed_index(bed_file, merge)
+    if position_only:
+        if len(bed) != 1:
+            raise ValueError('Expected a single chromosome in '
+                             f'{filename} to match by position only')
+        return next(iter(bed.values()))
+    return bed
+
+
+class site_filter():
+    '''
+    Select vcf sites within the regions of read_sites, as the bed filter of
+    line_parser for vcfs sorted by position
+    '''
+    def __init__(self, bed: Union[np.ndarray, Dict]):
+        self.bed = bed
+
+    def __call__(self, chrom: np.ndarray, pos: np.ndarray) -> np.ndarray:
+        '''
+        Return a mask of the positions within the regions
+        '''
+        pos = np.asarray(pos, dtype=np.int64)
+        if not isinstance(self.bed, dict):
+            return in_regions(self.bed, pos)
+
+        chrom = np.asarray(chrom).astype(str)
+        result = np.zeros(len(pos), dtype=bool)
+        for contig, regions in self.bed.items():
+            rows = chrom == contig
+            result[rows] = in_regions(regions, pos[rows])
+        return result
+
+    def digest(self) -> str:
+        '''
+        Return a key of the regions
+        '''
+        digest = hashlib.sha1()
+        bed = self.bed if isinstance(self.bed, dict) else {None: self.bed}
+        for contig in sorted(bed, key=str):
+            digest.update(repr(contig).encode())
+            digest.update(np.ascontiguousarray(bed[contig],
+                                               dtype=np.int64).tobytes())
+        return digest.hexdigest()
+
+
+def read_blocks(reader: BinaryIO,
+                size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    '''
+    read the binary file in blocks of about size bytes, split after the
+    last newline of each block
+    '''
+    remainder = b''
+    for block in iter(lambda: reader.read(size), b''):
+        end = block.rfind(b'\n') + 1
+        if end == 0:
+            remainder += block
+            continue
+        yield remainder + block[:end]
+        remainder = block[end:]
+    if remainder:
+        yield remainder
+
+
 def read_indivs(reader: TextIO) -> List[str]:
     '''
     read in each line of the file, return as list with newline stripped
@@ -106,12 +300,26 @@ def match_indivs(header: List[str], indivs: List[str]) -> List[int]:
     return np.where(matches)[0]
 
 
+def in_regions(regions: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    '''
+    True for each position with start < position <= end of a region.
+    Regions must be sorted and disjoint, as from read_bed_index.
+    '''
+    index = np.searchsorted(regions[:, 1], positions)
+    result = index < len(regions)
+    result[result] = regions[index[result], 0] < positions[result]
+    return result
+
+
 class line_parser():
     def __init__(self, bed: np.array, indivs: List[str]):
         self.bed = bed
         self.indivs = indivs
         if self.bed is None:
             self.parser = self.no_op
+        elif isinstance(self.bed, dict):
+            # regions of each chromosome, searched by position
+            self.parser = self.filter_contig
         else:
             self.bed += 1
             self.parser = self.filter_bed
@@ -130,6 +338,8 @@ class line_parser():
                                              self.indivs))
                 if self.bed is None:
                     self.parser = self.filter_indiv
+                elif isinstance(self.bed, dict):
+                    self.parser = self.filter_contig_both
                 else:
                     self.parser = self.filter_both
 
@@ -139,6 +349,113 @@ class line_parser():
 
         return self.parser(line)
 
+    def process_block(self, block: bytes) -> bytes:
+        '''
+        Process all lines of the block at once, returning the retained
+        lines as with process_line.  Header lines and a final line without
+        a newline are passed to process_line.
+        '''
+        result = []
+        start = 0
+        # header lines update the individuals to keep
+        while block.startswith(b'#', start):
+            end = block.find(b'\n', start) + 1 or len(block)
+            result.append(self.process_line(
+                block[start:end].decode()).encode())
+            start = end
+
+        end = max(block.rfind(b'\n') + 1, start)
+        if end > start:
+            result.append(self.filter_block(block[start:end]))
+        if end < len(block):
+            result.append(self.process_line(block[end:].decode()).encode())
+        return b''.join(result)
+
+    def filter_block(self, block: bytes) -> bytes:
+        '''
+        Filter complete vcf lines without headers.  Positions of the block
+        are located in the bed with searchsorted, giving the same rows as
+        stepping bed_ind through each line.
+        '''
+        data = np.frombuffer(block, dtype=np.uint8)
+        ends = np.flatnonzero(data == ord('\n'))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        tabs = np.flatnonzero(data == ord('\t'))
+        first_tab = np.searchsorted(tabs, starts)
+        project = self.parser in (self.filter_indiv, self.filter_both,
+                                  self.filter_contig_both)
+
+        if project:
+            columns = np.diff(np.searchsorted(tabs, ends, side='right'),
+                              prepend=0)
+            # lines with different numbers of columns use the line parser
+            if len(columns) == 0 or (columns != columns[0]).any() or \
+                    self.indivs[-1] > columns[0]:
+                return self.filter_lines(block)
+
+        bed_ind = self.bed_ind
+        if self.bed is None:
+            keep = np.ones(len(ends), dtype=bool)
+        else:
+            # lines without a position use the line parser
+            if (first_tab + 1 >= len(tabs)).any() or \
+                    (tabs[first_tab + 1] > ends).any():
+                return self.filter_lines(block)
+            positions = parse_ints(data,
+                                   tabs[first_tab] + 1,
+                                   tabs[first_tab + 1])
+        if isinstance(self.bed, dict):
+            keep = np.zeros(len(ends), dtype=bool)
+            contigs, rows = np.unique(
+                parse_strings(data, starts, tabs[first_tab]),
+                return_inverse=True)
+            for i, contig in enumerate(contigs):
+                regions = self.bed.get(contig.decode())
+                if regions is not None:
+                    rows_i = rows == i
+                    keep[rows_i] = in_regions(regions, positions[rows_i])
+        elif self.bed is not None:
+            # bed_ind is the first region with an end past each position,
+            # updated once the block is filtered
+            reach = np.maximum.accumulate(self.bed[:, 1])
+            bed_ind = np.maximum.accumulate(np.maximum(
+                np.searchsorted(reach, positions, side='right'),
+                bed_ind))
+            keep = bed_ind < self.bed.shape[0]
+            keep[keep] = positions[keep] >= \
+                self.bed[bed_ind[keep], 0]
+            bed_ind = int(bed_ind[-1])
+
+        if not project:
+            self.bed_ind = bed_ind
+            return data[np.repeat(keep, ends - starts + 1)].tobytes()
+
+        # keep each retained column and the tab or newline following it
+        lines = np.flatnonzero(keep)
+        column_starts = np.concatenate((starts[lines, None],
+                                        tabs[first_tab[lines, None]
+                                             + np.arange(columns[0])] + 1),
+                                       axis=1)
+        column_ends = np.concatenate((column_starts[:, 1:] - 1,
+                                      ends[lines, None]), axis=1)
+        column_starts = column_starts[:, self.indivs]
+        column_ends = column_ends[:, self.indivs]
+        if len(lines) > 0 and (data[column_ends[:, -1] - 1] <= ord(' ')).any():
+            # trailing whitespace is stripped by the line parser
+            return self.filter_lines(block)
+
+        self.bed_ind = bed_ind
+        data = data.copy()
+        data[column_ends[:, -1]] = ord('\n')
+        lengths = (column_ends - column_starts + 1).ravel()
+        offsets = np.repeat(column_starts.ravel() - np.cumsum(lengths)
+                            + lengths, lengths)
+        return data[offsets + np.arange(lengths.sum())].tobytes()
+
+    def filter_lines(self, block: bytes) -> bytes:
+        return ''.join(self.parser(line) for line in
+                       block.decode().splitlines(True)).encode()
+
     def no_op(self, line: str):
         return line
 
@@ -175,6 +492,24 @@ class line_parser():
         else:
             return ''
 
+    def filter_contig(self, line: str):
+        tokens = line.split('\t', 2)
+        if self.in_bed(tokens[0], int(tokens[1])):
+            return line
+        return ''
+
+    def filter_contig_both(self, line: str):
+        tokens = line.split('\t')
+        if self.in_bed(tokens[0], int(tokens[1])):
+            return '\t'.join([tokens[i] for i in self.indivs]).rstrip() + '\n'
+        return ''
+
+    def in_bed(self, contig: str, pos: int) -> bool:
+        regions = self.bed.get(contig)
+        if regions is None:
+            return False
+        return in_regions(regions, np.array([pos]))[0]
+
 
 if __name__ == "__main__":
     main()